@@ -25,16 +25,168 @@ DEALINGS IN THE SOFTWARE.
 # projects. That project also includes an ascii2shp wrapper.
 
 
+import datetime
+import hashlib
+import itertools
+import json
+import locale as _locale
+import mmap
+import operator
 import os
+import re
+import struct
+import subprocess
 import sys
+import time
 import traceback
-import win32com.client
+
+# NumPy is optional. When it is available, the native engine decodes and
+# packs whole chunks of coordinates at once; otherwise it falls back to
+# converting one row at a time. It takes longer to import than the rest of
+# this module, so it is only imported when the native engine first needs it,
+# by _load_numpy().
+
+numpy = None
+_numpy_loaded = False
+
+
+def _load_numpy():
+    """Imports NumPy the first time it is called and returns it, or None if it is not installed."""
+
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+# The resource module, which reports peak memory use, is not available on
+# Windows. Without it the metrics omit peak memory.
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_clock = getattr(time, "perf_counter", time.time)
+
+try:
+    _string_types = basestring
+    _integer_types = (int, long)
+except NameError:
+    _string_types = str
+    _integer_types = int
 
 
 class Geoprocessor:
-    """Class that allocates a singleton ArcGIS geoprocessor object and returns it to callers. Probably not thread safe. Doesn't fail gracefully."""
+    """Class that allocates a singleton geoprocessor object the first time get() is called and returns it to callers. The object is created by a backend, a callable that takes no arguments, which may be replaced with set_backend() before the geoprocessor is first used. The default backend returns the ArcGIS GpDispatch object if the win32com package is installed, and a LocalGeoprocessor otherwise. Probably not thread safe."""
+
+    backend = None
+    _instance = None
+
+    def get(cls):
+        """Returns the geoprocessor, creating it on the first call."""
+
+        if cls._instance is None:
+            backend = cls.backend
+            if backend is None:
+                backend = _default_geoprocessor
+            cls._instance = backend()
+        return cls._instance
+
+    get = classmethod(get)
+
+    def set_backend(cls, backend):
+        """Sets the backend that creates the geoprocessor and discards the geoprocessor created by the previous one, if any. Pass None to restore the default backend."""
+
+        cls.backend = backend
+        cls._instance = None
+
+    set_backend = classmethod(set_backend)
+
+
+def arcgis_geoprocessor():
+    """Geoprocessor backend that returns the ArcGIS GpDispatch object. Requires ArcGIS and the win32com package."""
+
+    import win32com.client
+    return win32com.client.Dispatch("esriGeoprocessing.GPDispatch.1")
+
+
+def _default_geoprocessor():
+    try:
+        return arcgis_geoprocessor()
+    except ImportError:
+        return LocalGeoprocessor()
+
+
+class LocalGeoprocessor:
+    """Geoprocessor backend for machines without ArcGIS. Implements the parts of the GpDispatch interface that these tools use, on the local file system: messages are kept in the messages list rather than displayed, all licenses are available, refreshing the catalog does nothing and DefineProjection_management writes the .prj file itself, for coordinate systems given as well-known text or a .prj file."""
+
+    # Tools run by this geoprocessor never return messages.
+
+    MessageCount = 0
+
+    def __init__(self):
+        self.messages = []
+
+    def AddMessage(self, message):
+        self.messages.append(("info", message))
+
+    def AddWarning(self, message):
+        self.messages.append(("warning", message))
+
+    def AddError(self, message):
+        self.messages.append(("error", message))
+
+    def CheckProduct(self, product):
+        return "Available"
+
+    def SetProduct(self, product):
+        return product
+
+    def CheckExtension(self, extension):
+        return "Available"
+
+    def CheckOutExtension(self, extension):
+        return "CheckedOut"
+
+    def CheckInExtension(self, extension):
+        return "CheckedIn"
+
+    def RefreshCatalog(self, path):
+        pass
+
+    def Exists(self, path):
+        return os.path.exists(path)
+
+    def DefineProjection_management(self, dataset, coordinate_system):
+        wkt = _get_projection_wkt(coordinate_system)
+        if wkt is None:
+            raise ValueError("The coordinate system \"" + coordinate_system + "\" can only be interpreted by ArcGIS. Please give it as well-known text or the path to a .prj file.")
+        f = open(os.path.splitext(dataset)[0] + ".prj", "w")
+        try:
+            f.write(wkt)
+        finally:
+            f.close()
+
+
+def _get_peak_memory(children=False):
+    """Returns the peak resident set size of this process, or of its child processes that have exited, in bytes. Returns None if the resource module is not available."""
 
-    instance = win32com.client.Dispatch("esriGeoprocessing.GPDispatch.1")
+    if resource is None:
+        return None
+    if children:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on Mac OS X and in kilobytes elsewhere.
+
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
 
 
 class MarineError(Exception):
@@ -45,7 +197,7 @@ class MarineError(Exception):
         try:
             indent = " " * indent_level
             message = indent + message.replace("\n", "\n" + indent)
-            Geoprocessor.instance.AddError(message)
+            Geoprocessor.get().AddError(message)
         except:
             pass
 
@@ -60,63 +212,105 @@ class MarineTool:
     """Base class for all Marine Ecology Tools."""
 
     def __init__(self, product=None, extensions=None, keyword_args=None):
-        """Base class initialization code. Should be called at the top of the derived class's init method."""
+        """Base class initialization code. Should be called at the top of the derived class's init method, which should call _finish_init() at the end."""
 
+        self._init_timer = self._start_timer()
+        self._init_finished = False
         self._product = product
         self._extensions = extensions
         self._keyword_args = keyword_args
         self._command_line_arg_count = 0
 
-        if keyword_args is not None and keyword_args.has_key("indent_level"):
+        if keyword_args is not None and "indent_level" in keyword_args:
             self._indent_level = keyword_args["indent_level"]
         else:
             self._indent_level = 1
 
-        if keyword_args is not None and keyword_args.has_key("from_command_line"):
+        if keyword_args is not None and "from_command_line" in keyword_args:
             self._from_command_line = keyword_args["from_command_line"]
         else:
             self._from_command_line = 0
 
-        if keyword_args is not None and keyword_args.has_key("verbose_logging"):
+        if keyword_args is not None and "verbose_logging" in keyword_args:
             self._verbose_logging = keyword_args["verbose_logging"]
         else:
             self._verbose_logging = 0
 
-        if self._extensions is not None and not isinstance(self._extensions, types.StringTypes) and not isinstance(self._extensions, types.ListType):
+        if self._extensions is not None and not isinstance(self._extensions, _string_types) and not isinstance(self._extensions, list):
             raise MarineError("The extensions parameter must be a string specifying exactly one extension or a list of strings that each specify exactly one extension.", self._indent_level)
         
-        self.tool_name = str(self.__class__)
-        if (self.tool_name.rfind(".") >= 0):
-            self.tool_name = self.tool_name[self.tool_name.rfind(".")+1:]
+        self.tool_name = self.__class__.__name__
+
+        # Instrumentation. run() fills in self.metrics with the wall clock
+        # and CPU time of each phase of the tool, peak memory use and the
+        # counters added by the tool, and appends it as a line of JSON to
+        # metrics_file, if one was given.
+
+        self.metrics = {"tool": self.tool_name,
+                        "started": datetime.datetime.now().isoformat(),
+                        "succeeded": None,
+                        "phases": {},
+                        "counters": {}}
+        if keyword_args is not None and "metrics_file" in keyword_args:
+            self._metrics_file = keyword_args["metrics_file"]
+        else:
+            self._metrics_file = None
 
         self._log_verbose(self.tool_name + " started.")
         self._indent_level= self._indent_level + 1
         self._log_verbose("Python " + sys.version)
 
+    def _finish_init(self):
+        """Stops timing the argument_parsing phase, which starts at the beginning of the base class initialization. Should be called at the end of the derived class's init method."""
+
+        if not self._init_finished:
+            self._init_finished = True
+            self._stop_timer("argument_parsing", self._init_timer)
+
     def run(self):
         """Initializes and runs this tool."""
 
+        # For derived classes that do not call _finish_init(), argument
+        # parsing is timed until run() is called.
+
+        self._finish_init()
+
         try:
             checkin = 0
-            if self._product is not None:
-                self._set_product()
-            if self._extensions is not None:
-                checkin = 1
-                self._checkout_extensions()
+            if self._product is not None or self._extensions is not None:
+                timer = self._start_timer()
+                try:
+                    if self._product is not None:
+                        self._set_product()
+                    if self._extensions is not None:
+                        checkin = 1
+                        self._checkout_extensions()
+                finally:
+                    self._stop_timer("licensing", timer)
 
             result = None
             try:
-                result = self._run_tool()
+                timer = self._start_timer()
+                try:
+                    result = self._run_tool()
+                finally:
+                    self._stop_timer("run_tool", timer)
             finally:
                 if checkin:
-                    self._checkin_extensions()
+                    timer = self._start_timer()
+                    try:
+                        self._checkin_extensions()
+                    finally:
+                        self._stop_timer("licensing", timer)
 
             self._indent_level = self._indent_level - 1
             self._log_verbose(self.tool_name + " completed successfully.")
+            self._finish_metrics(True)
             return result
         except:
             self._indent_level = self._indent_level - 1
             self._log(self.tool_name + " failed.", "error")
+            self._finish_metrics(False)
             raise
 
     def _run_tool(self):
@@ -124,6 +318,69 @@ class MarineTool:
         
         raise MarineError("The " + self.tool_name + " tool has not been implemented.", self._indent_level)
 
+    def _start_timer(self):
+        """Returns the current wall clock and CPU times, for passing to _stop_timer()."""
+
+        t = os.times()
+        return (_clock(), t[0] + t[1] + t[2] + t[3])
+
+    def _stop_timer(self, phase, timer):
+        """Adds the wall clock and CPU time elapsed since _start_timer() returned timer to the named phase in self.metrics. CPU time includes child processes that have exited, such as worker pools."""
+
+        t = os.times()
+        self._record_phase(phase, _clock() - timer[0], t[0] + t[1] + t[2] + t[3] - timer[1])
+
+    def _record_phase(self, phase, wall_seconds, cpu_seconds):
+        """Adds a measurement to the named phase in self.metrics. A phase may be measured more than once; the times are summed. cpu_seconds may be None if it is unknown."""
+
+        if phase not in self.metrics["phases"]:
+            self.metrics["phases"][phase] = {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+        p = self.metrics["phases"][phase]
+        p["calls"] = p["calls"] + 1
+        p["wall_seconds"] = p["wall_seconds"] + wall_seconds
+        if cpu_seconds is None or p["cpu_seconds"] is None:
+            p["cpu_seconds"] = None
+        else:
+            p["cpu_seconds"] = p["cpu_seconds"] + cpu_seconds
+        p["peak_memory_bytes"] = _get_peak_memory()
+
+    def _add_counter(self, name, count, phase):
+        """Adds count to the named counter in self.metrics. When the metrics are finished, the counter's rate is computed from the wall clock time of phase."""
+
+        if name not in self.metrics["counters"]:
+            self.metrics["counters"][name] = {"count": 0, "phase": phase, "per_second": None}
+        self.metrics["counters"][name]["count"] = self.metrics["counters"][name]["count"] + count
+
+    def _finish_metrics(self, succeeded):
+        """Computes the totals and rates in self.metrics and appends it to metrics_file as a line of JSON, if metrics_file was given."""
+
+        self.metrics["succeeded"] = bool(succeeded)
+        t = os.times()
+        self.metrics["cpu_seconds"] = t[0] + t[1] + t[2] + t[3] - self._init_timer[1]
+        self.metrics["wall_seconds"] = _clock() - self._init_timer[0]
+        self.metrics["peak_memory_bytes"] = _get_peak_memory()
+        self.metrics["peak_child_memory_bytes"] = _get_peak_memory(children=True)
+        for counter in self.metrics["counters"].values():
+            phase = self.metrics["phases"].get(counter["phase"])
+            if phase is not None and phase["wall_seconds"] > 0:
+                counter["per_second"] = counter["count"] / phase["wall_seconds"]
+
+        self._write_metrics(self.metrics)
+
+    def _write_metrics(self, metrics):
+        """Appends a metrics dictionary to metrics_file as a line of JSON, if metrics_file was given. Failures are only logged as warnings."""
+
+        if self._metrics_file is None:
+            return
+        try:
+            f = open(self._metrics_file, "a")
+            try:
+                f.write(json.dumps(metrics, sort_keys=True) + "\n")
+            finally:
+                f.close()
+        except Exception as e:
+            self._log("Failed to write the metrics to \"" + str(self._metrics_file) + "\". Error details: " + str(e), "warning")
+
     def _log(self, message, level="info"):
         """Helper function for logging."""
         
@@ -132,11 +389,11 @@ class MarineTool:
             message = indent + message.replace("\n", "\n" + indent)
             print(message)
             if level.lower() == "warning":
-                Geoprocessor.instance.AddWarning(message)
+                Geoprocessor.get().AddWarning(message)
             elif level.lower() == "error":
-                Geoprocessor.instance.AddError(message)
+                Geoprocessor.get().AddError(message)
             elif level.lower() == "info" or self._verbose_logging:
-                Geoprocessor.instance.AddMessage(message)
+                Geoprocessor.get().AddMessage(message)
         except:
             pass
 
@@ -144,37 +401,44 @@ class MarineTool:
         self._log(message, "verbose")
 
     def _log_returned_geoprocessor_messages(self, force_verbose_logging=0):
-        """Logs messages returned by ArcGIS tools invoked through Geoprocessor.instance (e.g., Geoprocessor.instance.Clip_analysis). Since non-tool GpDispatch methods (e.g. Geoprocessor.instance.UpdateCursor) do not return messages, this will log nothing if invoked after calling them."""\
+        """Logs messages returned by ArcGIS tools invoked through Geoprocessor.get() (e.g., Geoprocessor.get().Clip_analysis). Since non-tool GpDispatch methods (e.g. Geoprocessor.get().UpdateCursor) do not return messages, this will log nothing if invoked after calling them."""\
 
         self._indent_level = self._indent_level + 1
         
         try:
             i = 0
-            while i < Geoprocessor.instance.MessageCount:
-                sev = Geoprocessor.instance.GetSeverity(i)
+            while i < Geoprocessor.get().MessageCount:
+                sev = Geoprocessor.get().GetSeverity(i)
                 if sev == 0:
                     if force_verbose_logging:
-                        self._log(Geoprocessor.instance.GetMessage(i), "info")
+                        self._log(Geoprocessor.get().GetMessage(i), "info")
                     else:
-                        self._log_verbose(Geoprocessor.instance.GetMessage(i))
+                        self._log_verbose(Geoprocessor.get().GetMessage(i))
                 elif sev == 1:
-                    self._log(Geoprocessor.instance.GetMessage(i), "warning")
+                    self._log(Geoprocessor.get().GetMessage(i), "warning")
                 elif sev == 2:
-                    self._log(Geoprocessor.instance.GetMessage(i), "error")
+                    self._log(Geoprocessor.get().GetMessage(i), "error")
                 i = i + 1
         except:
             pass
         
         self._indent_level = self._indent_level - 1
 
+    def _next_command_line_arg(self):
+        """Returns the next command line argument, or None if the caller omitted the trailing optional arguments."""
+
+        self._command_line_arg_count = self._command_line_arg_count + 1
+        if self._command_line_arg_count >= len(sys.argv):
+            return None
+        return sys.argv[self._command_line_arg_count]
+
     def _parse_string_arg(self, arg_name, default=None, required=0):
         value = None
         if self._from_command_line:
-            self._command_line_arg_count = self._command_line_arg_count + 1
-            value = sys.argv[self._command_line_arg_count]
-        elif self._keyword_args is not None and self._keyword_args.has_key(arg_name):
+            value = self._next_command_line_arg()
+        elif self._keyword_args is not None and arg_name in self._keyword_args:
             value = self._keyword_args[arg_name]
-            if value is not None and not isinstance(value, types.StringTypes):
+            if value is not None and not isinstance(value, _string_types):
                 raise MarineError("Parameter " + arg_name + " must be a string.", self._indent_level)
         if value is not None:
             value = value.strip()
@@ -187,7 +451,7 @@ class MarineTool:
                 else:
                     raise MarineError("Parameter " + arg_name + " may not be omitted. Please provide a value for this parameter.", self._indent_level)
             if default is not None:
-                if not isinstance(default, types.StringTypes):
+                if not isinstance(default, _string_types):
                     raise MarineError("Internal error in the " + self.tool_name + " tool. The \"default\" parameter to self._parse_string_arg() must be a string. Please contact the developer of the tool.", self._indent_level)
                 value = default
         self.__dict__[arg_name] = value
@@ -196,8 +460,7 @@ class MarineTool:
     def _parse_boolean_arg(self, arg_name, default=0, required=0):
         value = None
         if self._from_command_line:
-            self._command_line_arg_count = self._command_line_arg_count + 1
-            arg = sys.argv[self._command_line_arg_count]
+            arg = self._next_command_line_arg()
             if arg is None or len(arg.strip()) <= 0 or arg.strip() == "#":
                 if required:
                     raise MarineError("Parameter " + str(self._command_line_arg_count) + ", " + arg_name + ", may not be omitted. Please specify either True or False for this parameter.", self._indent_level)
@@ -211,14 +474,14 @@ class MarineTool:
                 else:
                     raise MarineError("Parameter " + str(self._command_line_arg_count) + ", " + arg_name + ", must be either True, False or #. (# means use the default value, " + str(default) + " for this script. When ArcGIS invokes this script from an ArcGIS geoprocessing model, it provides # automatically when you leave the field blank.)", self._indent_level)
         else:
-            if self._keyword_args is not None and self._keyword_args.has_key(arg_name):
+            if self._keyword_args is not None and arg_name in self._keyword_args:
                 value = self._keyword_args[arg_name]
-            if value is not None and not isinstance(value, types.BooleanType):
+            if value is not None and not isinstance(value, bool):
                 raise MarineError("Parameter " + arg_name + " must be a boolean.", self._indent_level)
             if value is None and required:
                 raise MarineError("Parameter " + arg_name + " may not be omitted. Please provide a boolean for this parameter.", self._indent_level)
         if value is None and default is not None:
-            if not isinstance(default, types.BooleanType):
+            if not isinstance(default, bool):
                 raise MarineError("Internal error in the " + self.tool_name + " tool. The \"default\" parameter to self._parse_boolean_arg() must be a boolean. Please contact the developer of the tool.", self._indent_level)
             value = default
         self.__dict__[arg_name] = value
@@ -227,8 +490,7 @@ class MarineTool:
     def _parse_int_arg(self, arg_name, default=0, required=0):
         value = None
         if self._from_command_line:
-            self._command_line_arg_count = self._command_line_arg_count + 1
-            arg = sys.argv[self._command_line_arg_count]
+            arg = self._next_command_line_arg()
             if arg is None or len(arg.strip()) <= 0 or arg.strip() == "#":
                 if required:
                     raise MarineError("Parameter " + str(self._command_line_arg_count) + ", " + arg_name + ", may not be omitted. Please specify an integer ranging from -2147483648 to 2147483647.", self._indent_level)
@@ -238,14 +500,14 @@ class MarineTool:
                 except:
                     raise MarineError("\"" + arg.strip() + "\" is an invalid value for parameter " + str(self._command_line_arg_count) + ", " + arg_name + ". Please specify an integer ranging from -2147483648 to 2147483647.", self._indent_level)
         else:
-            if self._keyword_args is not None and self._keyword_args.has_key(arg_name):
+            if self._keyword_args is not None and arg_name in self._keyword_args:
                 value = self._keyword_args[arg_name]
-            if value is not None and not isinstance(value, types.IntType):
+            if value is not None and not isinstance(value, _integer_types):
                 raise MarineError("Parameter " + arg_name + " must be an int.", self._indent_level)
             if value is None and required:
                 raise MarineError("Parameter " + arg_name + " may not be omitted. Please provide an int for this parameter.", self._indent_level)
         if value is None and default is not None:
-            if not isinstance(default, types.IntType):
+            if not isinstance(default, _integer_types):
                 raise MarineError("Internal error in the " + self.tool_name + " tool. The \"default\" parameter to self._parse_int_arg() must be an int. Please contact the developer of the tool.", self._indent_level)
             value = default
         self.__dict__[arg_name] = value
@@ -254,8 +516,7 @@ class MarineTool:
     def _parse_float_arg(self, arg_name, default=0.0, required=0):
         value = None
         if self._from_command_line:
-            self._command_line_arg_count = self._command_line_arg_count + 1
-            arg = sys.argv[self._command_line_arg_count]
+            arg = self._next_command_line_arg()
             if arg is None or len(arg.strip()) <= 0 or arg.strip() == "#":
                 if required:
                     raise MarineError("Parameter " + str(self._command_line_arg_count) + ", " + arg_name + ", may not be omitted. Please specify a floating-point number.", self._indent_level)
@@ -265,14 +526,14 @@ class MarineTool:
                 except:
                     raise MarineError("\"" + arg.strip() + "\" is an invalid value for parameter " + str(self._command_line_arg_count) + ", " + arg_name + ". Please specify floating point number.", self._indent_level)
         else:
-            if self._keyword_args is not None and self._keyword_args.has_key(arg_name):
+            if self._keyword_args is not None and arg_name in self._keyword_args:
                 value = self._keyword_args[arg_name]
-            if value is not None and not isinstance(value, types.FloatType):
+            if value is not None and not isinstance(value, float):
                 raise MarineError("Parameter " + arg_name + " must be a float.", self._indent_level)
             if value is None and required:
                 raise MarineError("Parameter " + arg_name + " may not be omitted. Please provide a float for this parameter.", self._indent_level)
         if value is None and default is not None:
-            if not isinstance(default, types.FloatType):
+            if not isinstance(default, float):
                 raise MarineError("Internal error in the " + self.tool_name + " tool. The \"default\" parameter to self._parse_int_arg() must be a float. Please contact the developer of the tool.", self._indent_level)
             value = default
         self.__dict__[arg_name] = value
@@ -286,8 +547,8 @@ class MarineTool:
 
         if self._product is not None:
             try:
-                status = Geoprocessor.instance.CheckProduct(self._product)
-            except Exception, e:
+                status = Geoprocessor.get().CheckProduct(self._product)
+            except Exception as e:
                 self._log("Unable to determine if a license is available for the ArcGIS \"" + self._product + "\" product due to a failure in the ArcGIS GpDispatch.CheckProduct function. Please check your ArcGIS licensing configuration. Error details: " + str(e), "error")
                 raise
 
@@ -295,16 +556,16 @@ class MarineTool:
                 raise MarineError("The ArcGIS GpDispatch.CheckProduct function reports that an \"" + self._product + "\" product license is not available on this machine (it returned status code \"" + status + "\"). Please check your ArcGIS licensing configuration.", self._indent_level)
 
             try:
-                Geoprocessor.instance.SetProduct(self._product)
+                Geoprocessor.get().SetProduct(self._product)
                 self._log_verbose("Set the ArcGIS product level to \"" + self._product + "\".")
-            except Exception, e:
+            except Exception as e:
                 self._log("Unable to obtain a license for the ArcGIS \"" + self._product + "\" product due to a failure in the ArcGIS GpDispatch.SetProduct function. Please check your ArcGIS licensing configuration. Error details: " + str(e), "error")
                 raise
 
     def _checkout_extensions(self):
         """Check out the ArcGIS extensions."""
         
-        if isinstance(self._extensions, types.StringTypes):
+        if isinstance(self._extensions, _string_types):
             extension_list = [self._extensions]
         else:
             extension_list = self._extensions
@@ -314,8 +575,8 @@ class MarineTool:
             
             for e in extension_list:
                 try:
-                    status = Geoprocessor.instance.CheckExtension(e)
-                except Exception, e:
+                    status = Geoprocessor.get().CheckExtension(e)
+                except Exception as e:
                     self._log("Unable to determine if a license is available for the ArcGIS \"" + e + "\" extension due to a failure in the ArcGIS GpDispatch.CheckExtension function. Please check your ArcGIS licensing configuration. Error details: " + str(e), "error")
                     raise
 
@@ -323,8 +584,8 @@ class MarineTool:
                     raise MarineError("The ArcGIS GpDispatch.CheckExtension function reports that a license for the \"" + e + "\" extension is not available on this machine (it returned status code \"" + status + "\"). Please check your ArcGIS licensing configuration.", self._indent_level)
 
                 try:
-                    Geoprocessor.instance.CheckOutExtension(e)
-                except Exception, e:
+                    Geoprocessor.get().CheckOutExtension(e)
+                except Exception as e:
                     self._log("Unable to obtain a license for the ArcGIS \"" + e + "\" extension due to a failure in the ArcGIS GpDispatch.CheckOutExtension function. Please check your ArcGIS licensing configuration. Error details: " + str(e), "error")
                     raise
 
@@ -334,39 +595,1251 @@ class MarineTool:
         except:
             try:
                 for e in got_extensions:
-                    Geoprocessor.instance.CheckInExtension(e);
+                    Geoprocessor.get().CheckInExtension(e);
             except:
                 pass
 
     def _checkin_extensions(self):
         """Check in the ArcGIS extensions."""
         
-        if isinstance(self._extensions, types.StringTypes):
+        if isinstance(self._extensions, _string_types):
             extension_list = [self._extensions]
         else:
             extension_list = self._extensions
         
         for e in extension_list:
             try:
-                Geoprocessor.instance.CheckInExtension(e)
+                Geoprocessor.get().CheckInExtension(e)
                 self._log_verbose("Checked in the license for the ArcGIS \"" + e + "\" extension.")
             except:
                 pass
 
     # Wrapper functions for the ArcGIS GpDispatch object
 
+    def _GpDispatch_RefreshCatalog(self, path, obj):
+        """Wrapper around GpDispatch.RefreshCatalog: Refreshes the ArcGIS catalog for path. Failures are only logged as warnings, since they just mean that further geoprocessing involving obj may fail."""
+
+        self._log_verbose("Calling the ArcGIS RefreshCatalog function on \"" + path + "\"...")
+        timer = self._start_timer()
+        try:
+            Geoprocessor.get().RefreshCatalog(path)
+        except Exception as e:
+            self._log("The ArcGIS RefreshCatalog function failed on \"" + path + "\". Further geoprocessing involving \"" + obj + "\" may fail until you manually refresh the catalog. The exception raised by RefreshCatalog was: " + str(e), "warning")
+        self._stop_timer("catalog_refresh", timer)
+
     def _GpDispatch_Exists(self, obj):
         """Wrapper around GpDispatch.Exists: Tests the existance of the data object."""
 
         try:
-            return Geoprocessor.instance.Exists(obj)
-        except Exception, e:
+            return Geoprocessor.get().Exists(obj)
+        except Exception as e:
             self._log("Failed to test the existence of \"" + str(obj) + "\". The ArcGIS geoprocessor Exists function raised an error: " + str(e), "error")
             raise
 
 
+class DelimitedTextReader:
+    """Reads the rows of a delimited text file, honoring the same delimiter, quote character and comment string options as ascii2shp.exe. Blank lines and comment lines are skipped. The first remaining line is the header. Instances can be pickled, so that worker processes can read separate byte ranges of the same file."""
+
+    def __init__(self, path, delimiter=",", quote_character=None, comment_string=None, memory_map=False):
+        """delimiter is a single character, or None to split fields on runs of spaces and tabs. quote_character is a single character or None if fields are never quoted. If memory_map is true, chunks() scans the file in place through mmap rather than reading it into strings. That only pays off when most of each line is skipped: it is faster for files with many columns, of which only a few are read, and for quoted files, which split_line() must walk a character at a time, but no faster for files with just a few unquoted columns."""
+
+        self.path = path
+        self.delimiter = delimiter
+        self.quote_character = quote_character
+        self.comment_string = comment_string
+        self.memory_map = memory_map
+        self.header = None
+
+    def read_header(self):
+        """Reads the header line and stores its column names in self.header, or None if the file has no header. Returns the byte offset of the line after the header, which is where the data rows start."""
+
+        self.header = None
+        offset = 0
+        f = open(self.path, "rb")
+        try:
+            for line in f:
+                offset = offset + len(line)
+                fields = self.split_line(line.decode("latin-1"))
+                if fields is not None:
+                    self.header = [c.strip() for c in fields]
+                    break
+        finally:
+            f.close()
+        return offset
+
+    def split_ranges(self, start, count, end=None):
+        """Splits the bytes from start to end (or the end of the file) into at most count ranges that begin and end on line boundaries. Returns a list of (start, end) tuples."""
+
+        size = end
+        if size is None:
+            size = os.path.getsize(self.path)
+        boundaries = [start]
+        f = open(self.path, "rb")
+        try:
+            for i in range(1, count):
+                f.seek(start + (size - start) * i // count)
+                f.readline()
+                boundary = f.tell()
+                if boundary >= size:
+                    break
+                if boundary > boundaries[-1]:
+                    boundaries.append(boundary)
+        finally:
+            f.close()
+        boundaries.append(size)
+        return [(boundaries[i], boundaries[i+1]) for i in range(len(boundaries) - 1) if boundaries[i+1] > boundaries[i]]
+
+    def chunks(self, chunk_size=4194304, start=0, end=None, columns=None):
+        """Generator that reads the bytes from start to end (or the end of the file) about chunk_size bytes at a time and yields the rows found in each chunk as a list of sequences of field strings. start should be a line boundary after the header, such as the offset returned by read_header(). Only one chunk is held in memory at a time, so memory use does not depend on the size of the file.
+
+        If columns is given, it is a list of zero-based column indices and each row holds only those fields, in that order. A row that lacks any of them is yielded as a one-element list holding the whole line, which CoordinateDecoder rejects."""
+
+        if self.memory_map:
+            return self._mapped_chunks(chunk_size, start, end, columns)
+        return self._read_chunks(chunk_size, start, end, columns)
+
+    def _read_chunks(self, chunk_size, start, end, columns):
+        f = open(self.path, "rb")
+        try:
+            f.seek(start)
+            remaining = None
+            if end is not None:
+                remaining = end - start
+            carry = ""
+            while True:
+                if remaining is None:
+                    data = f.read(chunk_size)
+                else:
+                    data = f.read(min(chunk_size, remaining))
+                    remaining = remaining - len(data)
+                if len(data) > 0:
+
+                    # The last line of the chunk is probably incomplete.
+                    # Carry it over to the next chunk.
+
+                    lines = (carry + data.decode("latin-1")).split("\n")
+                    carry = lines.pop()
+                else:
+                    lines = [carry]
+
+                rows = [fields for fields in map(self.split_line, lines) if fields is not None]
+                if columns is not None:
+                    rows = self._project(rows, columns)
+                yield rows
+
+                if len(data) <= 0:
+                    break
+        finally:
+            f.close()
+
+    def _project(self, rows, columns):
+        if len(columns) == 1:
+            getter = lambda fields: (fields[columns[0]],)
+        else:
+            getter = operator.itemgetter(*columns)
+        try:
+            return list(map(getter, rows))
+        except IndexError:
+            projected = []
+            for fields in rows:
+                try:
+                    projected.append(getter(fields))
+                except IndexError:
+                    projected.append([(self.delimiter or " ").join(fields)])
+            return projected
+
+    def _mapped_chunks(self, chunk_size, start, end, columns):
+        """Implements chunks() for memory_map mode. The file is mapped into memory and scanned in place by a compiled regular expression that matches one line at a time, so blank lines, comment lines and unneeded fields are skipped without ever being copied into Python strings. Only the fields of the requested columns are materialized, and only for the rows that are yielded."""
+
+        if end is None:
+            end = os.path.getsize(self.path)
+        if end <= start:
+            yield []                # mmap cannot map an empty file
+            return
+
+        f = open(self.path, "rb")
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pattern, group_count, order = self._row_pattern(columns)
+                quote = None
+                if self.quote_character is not None:
+                    quote = self.quote_character.encode("latin-1")
+                    quoted_run = re.compile(re.escape(quote) + b"((?:[^" + re.escape(quote) + b"]|" + re.escape(quote + quote) + b")*)" + re.escape(quote) + b"?")
+                    unquote = lambda m: m.group(1).replace(quote + quote, quote)
+
+                pos = start
+                while pos < end:
+
+                    # Extend the chunk to the end of the line it stops in.
+
+                    stop = min(pos + chunk_size, end)
+                    if stop < end:
+                        newline = mm.find(b"\n", stop - 1, end)
+                        if newline < 0:
+                            stop = end
+                        else:
+                            stop = newline + 1
+
+                    rows = []
+                    for m in pattern.finditer(mm, pos, stop):
+                        last = m.lastindex
+                        if last is None:
+                            continue                    # blank or comment line
+                        if last > group_count:
+                            line = m.group(last).decode("latin-1")
+                            if columns is None:
+                                rows.append(self.split_line(line))
+                            else:
+                                rows.append([line])     # row lacks a column
+                            continue
+                        fields = []
+                        for field in m.groups()[:group_count]:
+                            if quote is not None and quote in field:
+                                field = quoted_run.sub(unquote, field)
+                            fields.append(field.decode("latin-1"))
+                        rows.append(tuple([fields[i] for i in order]))
+                    yield rows
+                    pos = stop
+            finally:
+                mm.close()
+        finally:
+            f.close()
+
+    def _row_pattern(self, columns):
+        """Compiles the regular expression used by _mapped_chunks. It matches one whole line: either a blank or comment line (no groups), a row with a group for each distinct requested column, or anything else (one final group). Returns the pattern, the number of column groups and, for each requested column, the index of its group.
+
+        Fields are split as split_line() splits them. A quote character anywhere in a field starts a quoted run that ends at the next quote not doubled, or at the end of the line, and delimiters inside it are part of the field. The field pattern can only end at a delimiter outside quotes, so when a row is short the pattern cannot backtrack into a quoted run and split it."""
+
+        if self.delimiter is None:
+            separator = b"[ \t]+"
+            leading = b"[ \t]*"
+            excluded = b" \t"
+        else:
+            separator = re.escape(self.delimiter.encode("latin-1"))
+            leading = b""
+            excluded = separator
+
+        if self.quote_character is None:
+            field = b"[^" + excluded + b"\r\n]*"
+        else:
+            q = re.escape(self.quote_character.encode("latin-1"))
+            plain = b"[^" + excluded + q + b"\r\n]*"
+            quoted = q + b"[^" + q + b"\r\n]*(?:" + q + q + b"[^" + q + b"\r\n]*)*(?:" + q + b"(?!" + q + b")|(?=[\r\n]|\\Z))"
+            field = plain + b"(?:" + quoted + plain + b")*"
+        if self.delimiter is None:
+            field = b"(?=[^ \t\r\n])" + field
+
+        blank = b"[ \t]*"
+        if self.comment_string is not None:
+            blank = blank + b"(?:" + re.escape(self.comment_string.encode("latin-1")) + b"[^\r\n]*)?"
+
+        if columns is None:
+            return re.compile(b"(?:" + blank + b"|([^\r\n]+))\r?(?:\n|\\Z)"), 0, []
+
+        wanted = sorted(set(columns))
+        parts = []
+        for i in range(wanted[-1] + 1):
+            if i in wanted:
+                parts.append(b"(" + field + b")")
+            else:
+                parts.append(field)
+        row = leading + separator.join(parts) + b"(?=" + separator + b"|[\r\n]|\\Z)[^\r\n]*"
+
+        pattern = re.compile(b"(?:" + blank + b"|" + row + b"|([^\r\n]+))\r?(?:\n|\\Z)")
+        return pattern, len(wanted), [wanted.index(c) for c in columns]
+
+    def split_line(self, line):
+        """Splits one line into a list of fields. Returns None for blank lines and comment lines."""
+
+        line = line.rstrip("\r\n")
+        stripped = line.strip()
+        if len(stripped) <= 0:
+            return None
+        if self.comment_string is not None and stripped.startswith(self.comment_string):
+            return None
+
+        # Fast path: no quote characters in this line, so str.split does
+        # exactly what we need.
+
+        if self.quote_character is None or line.find(self.quote_character) < 0:
+            if self.delimiter is None:
+                return line.split()
+            return line.split(self.delimiter)
+
+        # Slow path: walk the line, treating delimiters inside quotes as part
+        # of the field. A doubled quote inside a quoted field is a literal
+        # quote.
+
+        fields = []
+        field = []
+        quoted = False
+        in_field = False
+        i = 0
+        n = len(line)
+        while i < n:
+            c = line[i]
+            if quoted:
+                if c == self.quote_character:
+                    if i + 1 < n and line[i+1] == self.quote_character:
+                        field.append(c)
+                        i = i + 1
+                    else:
+                        quoted = False
+                else:
+                    field.append(c)
+            elif c == self.quote_character:
+                quoted = True
+                in_field = True
+            elif self.delimiter is None and (c == " " or c == "\t"):
+                if in_field:
+                    fields.append("".join(field))
+                    field = []
+                    in_field = False
+            elif c == self.delimiter:
+                fields.append("".join(field))
+                field = []
+            else:
+                field.append(c)
+                in_field = True
+            i = i + 1
+        if self.delimiter is not None or in_field:
+            fields.append("".join(field))
+        return fields
+
+
+class RowParseError(ValueError):
+    """Raised by CoordinateDecoder when a row of a chunk cannot be parsed."""
+
+    def __init__(self, index, fields):
+        ValueError.__init__(self, index, fields)
+        self.index = index
+        self.fields = fields
+
+
+class CoordinateDecoder:
+    """Converts the coordinate columns of chunks of rows to floats. If NumPy is available, each chunk becomes an n by k float64 array, decoded in one call; otherwise it becomes a list of coordinate tuples."""
+
+    def __init__(self, column_indices, decimal_point="."):
+        self.column_indices = column_indices
+        self.decimal_point = decimal_point
+
+    def decode(self, rows):
+        """Returns the coordinates of a list of rows. Raises RowParseError for the first row that does not have a numeric value in each coordinate column."""
+
+        # Decode the whole chunk in one call. If any row is bad, fall back to
+        # the row-at-a-time loop below, which finds it.
+
+        if _load_numpy() is not None and len(rows) > 0:
+            try:
+                return self._decode_columns(rows)
+            except (ValueError, IndexError, TypeError):
+                pass
+
+        column_indices = self.column_indices
+        decimal_point = self.decimal_point
+        points = []
+        for i in range(len(rows)):
+            fields = rows[i]
+            try:
+                if decimal_point == ".":
+                    points.append(tuple([float(fields[c]) for c in column_indices]))
+                else:
+                    points.append(tuple([float(fields[c].replace(decimal_point, ".")) for c in column_indices]))
+            except (ValueError, IndexError):
+                raise RowParseError(i, fields)
+        return points
+
+    def _decode_columns(self, rows):
+        text = list(map(operator.itemgetter(*self.column_indices), rows))
+        if self.decimal_point == ".":
+            return numpy.array(text, dtype=numpy.float64)
+        return numpy.char.replace(numpy.array(text), self.decimal_point, ".").astype(numpy.float64)
+
+
+# Patterns that match a whole column of stripped attribute values joined with
+# newlines, so that a column is checked with one call rather than one per
+# value. Empty values (nulls) are allowed anywhere.
+
+_INTEGER_VALUE = "[-+]?[0-9]+"
+_DECIMAL_VALUE = "[-+]?(?:[0-9]+\\.?[0-9]*|\\.[0-9]+)(?:[eE][-+]?[0-9]+)?"
+_DATE_VALUE = "[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12][0-9]|3[01])|[0-9]{4}/(?:0[1-9]|1[0-2])/(?:0[1-9]|[12][0-9]|3[01])"
+
+
+def _column_pattern(value):
+    return re.compile("(?:" + value + ")?(?:\n(?:" + value + ")?)*\\Z")
+
+
+_INTEGER_COLUMN = _column_pattern(_INTEGER_VALUE)
+_DECIMAL_COLUMN = _column_pattern(_DECIMAL_VALUE)
+_DATE_COLUMN = _column_pattern(_DATE_VALUE)
+_DATE_PATTERN = re.compile("(?:" + _DATE_VALUE + ")\\Z")
+_LEADING_ZERO = re.compile("^[-+]?0[0-9]", re.MULTILINE)
+_INTEGER_PARTS = re.compile("^[-+]?[0-9]*", re.MULTILINE)
+_FRACTION_PARTS = re.compile("\\.([0-9]*)")
+
+
+class _FieldStats:
+    """Accumulates what the values of one attribute column have in common, a chunk at a time, and infers the dBASE field that can hold them."""
+
+    MAX_NUMERIC_WIDTH = 19
+    MAX_DECIMALS = 15
+    MAX_CHARACTER_WIDTH = 254
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.max_length = 0
+        self.integer = True
+        self.decimal = True
+        self.date = True
+        self.exponent = False
+        self.leading_zero = False
+        self.max_integer_length = 0
+        self.max_decimals = 0
+
+    def update(self, values):
+        """Adds a list of stripped values, with "." as the decimal point."""
+
+        values = [v for v in values if v]
+        if len(values) <= 0:
+            return
+        self.count = self.count + len(values)
+        self.max_length = max(self.max_length, max(map(len, values)))
+        joined = "\n".join(values)
+        if not self.leading_zero and (self.integer or self.decimal) and _LEADING_ZERO.search(joined):
+            self.leading_zero = True
+        if self.integer and not _INTEGER_COLUMN.match(joined):
+            self.integer = False
+        if self.decimal and not _DECIMAL_COLUMN.match(joined):
+            self.decimal = False
+        if self.decimal:
+            if "e" in joined or "E" in joined:
+                self.exponent = True
+            self.max_integer_length = max(self.max_integer_length, max(map(len, _INTEGER_PARTS.findall(joined))))
+            self.max_decimals = max([self.max_decimals] + list(map(len, _FRACTION_PARTS.findall(joined))))
+        if self.date and not _DATE_COLUMN.match(joined):
+            self.date = False
+
+    def field(self, headroom=False):
+        """Returns the inferred field as a (name, type, width, decimals) tuple. Integers become N fields with no decimals, other numbers N fields with the most decimals seen, ISO dates D fields and everything else C fields. Numbers with leading zeros, such as postal codes, are kept as text.
+
+        N fields are as wide as the widest value seen. If headroom is true, because only some of the values were seen, they are MAX_NUMERIC_WIDTH wide instead, so that larger numbers among the rest still fit."""
+
+        if self.count > 0 and not self.leading_zero:
+            if self.integer and self.max_length <= self.MAX_NUMERIC_WIDTH:
+                if headroom:
+                    return (self.name, "N", self.MAX_NUMERIC_WIDTH, 0)
+                return (self.name, "N", max(self.max_length, 1), 0)
+            if self.decimal and self.exponent:
+                return (self.name, "N", self.MAX_NUMERIC_WIDTH, 11)
+            if self.decimal and self.max_integer_length < self.MAX_NUMERIC_WIDTH:
+                integer_length = max(self.max_integer_length, 1)
+                decimals = min(self.max_decimals, self.MAX_DECIMALS, self.MAX_NUMERIC_WIDTH - integer_length - 1)
+                width = integer_length
+                if decimals > 0:
+                    width = width + 1 + decimals
+                if headroom:
+                    width = self.MAX_NUMERIC_WIDTH
+                return (self.name, "N", min(max(width, self.max_length), self.MAX_NUMERIC_WIDTH), decimals)
+            if self.date:
+                return (self.name, "D", 8, 0)
+        return (self.name, "C", min(max(self.max_length, 1), self.MAX_CHARACTER_WIDTH), 0)
+
+
+def _dbf_field_names(names):
+    """Returns dBASE field names for a list of column names: at most 10 characters from A-Z, a-z, 0-9 and _, unique regardless of case and never ID, which PointShapefileWriter uses for the record number."""
+
+    used = set(["ID"])
+    fields = []
+    for name in names:
+        field = re.sub("[^A-Za-z0-9_]", "_", name)[:10] or "FIELD"
+        i = 1
+        while field.upper() in used:
+            suffix = "_" + str(i)
+            field = field[:10 - len(suffix)] + suffix
+            i = i + 1
+        used.add(field.upper())
+        fields.append(field)
+    return fields
+
+
+class AttributeFitError(ValueError):
+    """Raised by AttributeFormatter for the first attribute value of a chunk that does not fit its field."""
+
+    def __init__(self, index, field, value):
+        ValueError.__init__(self, index, field, value)
+        self.index = index
+        self.field = field
+        self.value = value
+
+
+class AttributeFormatter:
+    """Formats the attribute columns of chunks of rows as fixed-width dBASE field values, for PointShapefileWriter. Each column is formatted as a whole: a single pattern match checks that all of its values fit the field and they are then padded with string methods, and only the values of columns that fail the check are converted one at a time. Numbers are rounded to the field's decimals. A value that cannot be converted to its field's type, such as text in a numeric field or a fraction in an integer field, or that is too long for the field raises AttributeFitError, rather than being left blank or truncated. Instances can be pickled, so that worker processes can format their own chunks.
+
+    fields is a list of (name, type, width, decimals) tuples for the columns of each row starting at first_column."""
+
+    def __init__(self, fields, first_column, decimal_point="."):
+        self.fields = fields
+        self.first_column = first_column
+        self.decimal_point = decimal_point
+        self.record_length = sum([f[2] for f in fields])
+
+    def format(self, rows):
+        """Returns the attribute values of a list of rows as bytes holding record_length bytes for each row."""
+
+        if len(rows) <= 0:
+            return b""
+        columns = list(zip(*rows))[self.first_column:]
+        formatted = []
+        for field, values in zip(self.fields, columns):
+            values = [v.strip() for v in values]
+            if field[1] == "C":
+                text = self._format_character(values, field)
+            elif field[1] == "D":
+                text = self._format_date(values, field)
+            else:
+                text = self._format_number(values, field)
+            formatted.append(text)
+        return "".join(itertools.chain.from_iterable(zip(*formatted))).encode("latin-1")
+
+    def _format_character(self, values, field):
+        width = field[2]
+        if max(map(len, values)) > width:
+            for i in range(len(values)):
+                if len(values[i]) > width:
+                    raise AttributeFitError(i, field, values[i])
+        return [v.ljust(width) for v in values]
+
+    def _format_date(self, values, field):
+        joined = "\n".join(values)
+        if _DATE_COLUMN.match(joined):
+            return [v.ljust(8) for v in joined.replace("-", "").replace("/", "").split("\n")]
+        formatted = []
+        for i in range(len(values)):
+            v = values[i]
+            if _DATE_PATTERN.match(v):
+                formatted.append(v[0:4] + v[5:7] + v[8:10])
+            elif v:
+                raise AttributeFitError(i, field, v)
+            else:
+                formatted.append(" " * 8)
+        return formatted
+
+    def _format_number(self, values, field):
+        name, field_type, width, decimals = field
+        joined = "\n".join(values)
+        if self.decimal_point != ".":
+            joined = joined.replace(self.decimal_point, ".")
+            values = joined.split("\n")
+
+        # Numbers that already fit are written as they appear in the file,
+        # which dBASE readers parse the same as if they had been reformatted
+        # with exactly the field's number of decimals.
+
+        pattern = _DECIMAL_COLUMN
+        if decimals <= 0:
+            pattern = _INTEGER_COLUMN
+        if max(map(len, values)) <= width and pattern.match(joined):
+            return [v.rjust(width) for v in values]
+
+        formatted = []
+        for i in range(len(values)):
+            v = values[i]
+            text = None
+            if v:
+                try:
+                    x = float(v)
+                    if x - x == 0 and (decimals > 0 or x % 1 == 0):     # finite, and whole for integer fields
+                        text = "%*.*f" % (width, decimals, x)
+                except ValueError:
+                    pass
+                if text is None or len(text) > width:
+                    raise AttributeFitError(i, field, v)
+            formatted.append(text or " " * width)
+        return formatted
+
+
+def _read_dbf_fields(path):
+    """Returns the fields of a .dbf file written by PointShapefileWriter, other than its ID field, as (name, type, width, decimals) tuples."""
+
+    f = open(path, "rb")
+    try:
+        header = f.read(32)
+        header_length = struct.unpack("<H", header[8:10])[0]
+        descriptors = f.read(header_length - 32)
+    finally:
+        f.close()
+    fields = []
+    for i in range(32, len(descriptors) - 31, 32):
+        name, field_type, width, decimals = struct.unpack("<11sc4xBB14x", descriptors[i:i+32])
+        fields.append((name.split(b"\0")[0].decode("latin-1"), field_type.decode("latin-1"), width, decimals))
+    return fields
+
+
+def _decode_rows(decoder, formatter, rows):
+    """Decodes the coordinates of a chunk of rows and, if formatter is not None, formats their attributes. Returns a (points, attributes) tuple, where attributes is as returned by AttributeFormatter.format(), or None."""
+
+    points = decoder.decode(rows)
+    if formatter is None:
+        return points, None
+    return points, formatter.format(rows)
+
+
+def _decode_range(job):
+    """Worker process entry point for Ascii2Shp's parallel mode. Reads and decodes one byte range of the input file and returns the list of decoded chunks, as _decode_rows() tuples, and the number of rows in the range."""
+
+    reader, decoder, formatter, start, end, chunk_size, columns = job
+    decoded = []
+    row_count = 0
+    for rows in reader.chunks(chunk_size, start, end, columns):
+        try:
+            decoded.append(_decode_rows(decoder, formatter, rows))
+        except RowParseError as e:
+            raise RowParseError(row_count + e.index, e.fields)
+        except AttributeFitError as e:
+            raise AttributeFitError(row_count + e.index, e.field, e.value)
+        row_count = row_count + len(rows)
+    return decoded, row_count
+
+
+class QuadtreeIndexWriter:
+    """Builds a quadtree over the points of a shapefile and writes it as a .qix spatial index, in the format produced by shapelib's shptree utility and read by MapServer, GDAL and other shapefile readers. PointShapefileWriter passes it the coordinates as it writes them, so building the index does not require reading the .shp file again.
+
+    The tree is a complete quadtree over the extent of the points, deep enough that each leaf holds about LEAF_SIZE points, with empty nodes pruned. Shape IDs are stored in the leaves, and the bounds of each node are the tight bounds of the points beneath it. Requires NumPy."""
+
+    LEAF_SIZE = 8
+    MAX_DEPTH = 16
+
+    def __init__(self, path):
+        if _load_numpy() is None:
+            raise ValueError("Writing a spatial index requires the NumPy Python package.")
+        self.path = path
+        self._arrays = []
+
+    def add_points(self, points):
+        """Adds a list of coordinate tuples, in record order."""
+
+        if len(points) > 0:
+            self._arrays.append(numpy.array([(p[0], p[1]) for p in points], dtype=numpy.float64))
+
+    def add_array(self, coords):
+        """Adds an n by k NumPy array of coordinates, in record order. Only the first two columns (x and y) are used."""
+
+        if len(coords) > 0:
+            self._arrays.append(numpy.array(coords[:, :2], dtype=numpy.float64))
+
+    def write(self):
+        """Builds the tree from the points added so far and writes the .qix file."""
+
+        if len(self._arrays) > 0:
+            coords = numpy.concatenate(self._arrays)
+        else:
+            coords = numpy.zeros((0, 2), dtype=numpy.float64)
+        self._arrays = [coords]
+        n = len(coords)
+
+        depth = 1
+        while depth < self.MAX_DEPTH and self.LEAF_SIZE * 4 ** (depth - 1) < n:
+            depth = depth + 1
+
+        f = open(self.path, "wb")
+        try:
+
+            # Header: signature, byte order (1 = LSB), version, 3 reserved
+            # bytes, then the shape count and the tree depth.
+
+            f.write(b"SQT\x01\x01\x00\x00\x00" + struct.pack("<2i", n, depth))
+            if n <= 0:
+                f.write(struct.pack("<i4dii", 0, 0.0, 0.0, 0.0, 0.0, 0, 0))
+            else:
+                for record in self._node_records(coords[:, 0], coords[:, 1], depth):
+                    f.write(record)
+        finally:
+            f.close()
+
+    def _node_records(self, xs, ys, depth):
+        """Generator that yields the node records of the tree in the order they appear in the file: each node is followed by its subtrees. A node record is the number of bytes occupied by its subtrees, its bounds (xmin, ymin, xmax, ymax), its shape count, its shape IDs and its number of subnodes."""
+
+        n = len(xs)
+
+        # Give each point the Morton code of its leaf cell and sort the
+        # points by it. The points beneath any node then form a contiguous
+        # run, and the node is identified by the common prefix of their
+        # codes.
+
+        cells = 1 << (depth - 1)
+
+        def cell_index(values):
+            low = values.min()
+            span = values.max() - low
+            if span <= 0:
+                return numpy.zeros(len(values), dtype=numpy.int64)
+            return numpy.minimum(((values - low) * (cells / span)).astype(numpy.int64), cells - 1)
+
+        cx = cell_index(xs)
+        cy = cell_index(ys)
+        codes = numpy.zeros(n, dtype=numpy.int64)
+        for bit in range(depth - 1):
+            codes |= ((cx >> bit) & 1) << (2 * bit)
+            codes |= ((cy >> bit) & 1) << (2 * bit + 1)
+        order = numpy.argsort(codes, kind="mergesort")
+        codes = codes[order]
+        xs = xs[order]
+        ys = ys[order]
+
+        # Describe the nodes one level at a time, with vectorized operations
+        # over all of the nodes of the level.
+
+        levels = []
+        for level in range(depth):
+            prefixes = codes >> (2 * (depth - 1 - level))
+            starts = numpy.flatnonzero(numpy.concatenate(([True], prefixes[1:] != prefixes[:-1])))
+            levels.append({"prefix": prefixes[starts],
+                           "start": starts,
+                           "end": numpy.append(starts[1:], n),
+                           "bounds": (numpy.minimum.reduceat(xs, starts), numpy.minimum.reduceat(ys, starts), numpy.maximum.reduceat(xs, starts), numpy.maximum.reduceat(ys, starts))})
+
+        # Working up from the leaves, compute the number of shape IDs, the
+        # number of subnodes and the size of the subtrees of each node.
+
+        for level in range(depth - 1, -1, -1):
+            nodes = levels[level]
+            count = len(nodes["start"])
+            if level == depth - 1:
+                nodes["ids"] = nodes["end"] - nodes["start"]
+                nodes["offset"] = numpy.zeros(count, dtype=numpy.int64)
+                nodes["subnodes"] = numpy.zeros(count, dtype=numpy.int64)
+            else:
+                children = levels[level + 1]
+                parents = numpy.searchsorted(nodes["prefix"], children["prefix"] >> 2)
+                nodes["ids"] = numpy.zeros(count, dtype=numpy.int64)
+                nodes["offset"] = numpy.bincount(parents, weights=children["size"], minlength=count).astype(numpy.int64)
+                nodes["subnodes"] = numpy.bincount(parents, minlength=count)
+            nodes["size"] = 44 + 4 * nodes["ids"] + nodes["offset"]
+
+        # A node comes before its first child, which starts at the same
+        # point, and siblings are in point order, so sorting all of the
+        # nodes by (start, level) gives the file order.
+
+        node_levels = numpy.concatenate([numpy.full(len(levels[level]["start"]), level, dtype=numpy.int64) for level in range(depth)])
+        node_indices = numpy.concatenate([numpy.arange(len(levels[level]["start"])) for level in range(depth)])
+        node_starts = numpy.concatenate([levels[level]["start"] for level in range(depth)])
+        file_order = numpy.lexsort((node_levels, node_starts))
+
+        ids = order.astype("<i4")
+        for i in file_order:
+            level = node_levels[i]
+            j = node_indices[i]
+            nodes = levels[level]
+            bounds = nodes["bounds"]
+            record = struct.pack("<i4di", nodes["offset"][j], bounds[0][j], bounds[1][j], bounds[2][j], bounds[3][j], nodes["ids"][j])
+            if nodes["ids"][j] > 0:
+                record = record + ids[nodes["start"][j]:nodes["end"][j]].tobytes()
+            yield record + struct.pack("<i", nodes["subnodes"][j])
+
+
+class PointShapefileWriter:
+    """Writes a Point, PointZ or PointM shapefile (the .shp, .shx and .dbf files) directly, without ArcGIS. Records are packed into preallocated buffers and written to disk a block at a time. The .dbf receives an ID field holding the one-based record number, followed by any attribute fields, whose values are formatted by AttributeFormatter."""
+
+    # Shapefile readers treat any measure less than -10^38 as "no data".
+
+    NO_DATA = -1.0e39
+
+    def __init__(self, path, has_z=False, has_m=False, block_size=4096, append=False, spatial_index=False, fields=None):
+        """If append is true, the shapefile must already exist with the same shape type and fields, and new records are added after the existing ones. If spatial_index is true, a .qix quadtree index is written by close(), using QuadtreeIndexWriter; otherwise any existing .qix file is deleted, since it would no longer match the shapefile. fields is a list of (name, type, width, decimals) tuples for the attribute fields that follow the ID field in the .dbf."""
+
+        if os.path.splitext(path)[1].lower() == ".shp":
+            path = os.path.splitext(path)[0]
+        self.shp_path = path + ".shp"
+        self.shx_path = path + ".shx"
+        self.dbf_path = path + ".dbf"
+        self.qix_path = path + ".qix"
+
+        if has_z:
+            self.shape_type = 11
+            self._dimensions = 4
+        elif has_m:
+            self.shape_type = 21
+            self._dimensions = 3
+        else:
+            self.shape_type = 1
+            self._dimensions = 2
+        self._has_z = has_z
+        self._has_m = has_m
+        self._pad_m = has_z and not has_m
+        self._input_dimensions = 2 + int(bool(has_z)) + int(bool(has_m))
+
+        # Each .shp record is an 8-byte big-endian header (record number and
+        # content length in 16-bit words) followed by little-endian content
+        # (shape type and coordinates). struct cannot mix byte orders in one
+        # format, so we pack the two halves separately.
+
+        self._record_header_struct = struct.Struct(">2i")
+        self._content_struct = struct.Struct("<i" + "d" * self._dimensions)
+        self._content_words = self._content_struct.size // 2
+        self._shp_record_length = 8 + self._content_struct.size
+        self._fields = []
+        if fields is not None:
+            self._fields = list(fields)
+        self._attribute_length = sum([f[2] for f in self._fields])
+        self._dbf_record_length = 11 + self._attribute_length
+
+        self.block_size = block_size
+        if _load_numpy() is not None:
+            self._shp_dtype = numpy.dtype([("number", ">i4"), ("length", ">i4"), ("type", "<i4"), ("coords", "<f8", (self._dimensions,))])
+            self._shx_dtype = numpy.dtype([("offset", ">i4"), ("length", ">i4")])
+
+        self._shp_buffer = bytearray(block_size * self._shp_record_length)
+        self._shx_buffer = bytearray(block_size * 8)
+        self._dbf_buffer = bytearray(block_size * self._dbf_record_length)
+        self._buffered = 0
+
+        self.record_count = 0
+        self._mins = [None] * self._input_dimensions
+        self._maxs = [None] * self._input_dimensions
+
+        self._append = append
+        if append:
+            mode = "r+b"
+        else:
+            mode = "wb"
+        self._shp = open(self.shp_path, mode)
+        try:
+            self._shx = open(self.shx_path, mode)
+            try:
+                self._dbf = open(self.dbf_path, mode)
+            except:
+                self._shx.close()
+                raise
+        except:
+            self._shp.close()
+            raise
+
+        if append:
+            try:
+                self._seek_to_end()
+            except:
+                self._shp.close()
+                self._shx.close()
+                self._dbf.close()
+                raise
+        else:
+            self._shp.write(b"\0" * 100)
+            self._shx.write(b"\0" * 100)
+            self._dbf.write(self._dbf_header())
+
+        self._index = None
+        if spatial_index:
+            self._index = QuadtreeIndexWriter(self.qix_path)
+            if append and self.record_count > 0:
+                self._index.add_array(self._read_existing_coordinates())
+        elif os.path.isfile(self.qix_path):
+            os.remove(self.qix_path)
+
+    def _read_existing_coordinates(self):
+        """For append mode: returns the x and y coordinates of the existing records as an n by 2 NumPy array."""
+
+        f = open(self.shp_path, "rb")
+        try:
+            f.seek(100)
+            records = numpy.frombuffer(f.read(self.record_count * self._shp_record_length), dtype=self._shp_dtype)
+        finally:
+            f.close()
+        return records["coords"][:, :2]
+
+    def _seek_to_end(self):
+        """For append mode: reads the existing headers, checks that they are consistent with this writer, restores the record count and bounds from them and positions each file after its last record."""
+
+        shp_header = self._shp.read(100)
+        shx_header = self._shx.read(100)
+        dbf_header = self._dbf.read(32)
+        if len(shp_header) < 100 or len(shx_header) < 100 or len(dbf_header) < 32:
+            raise ValueError("\"" + self.shp_path + "\" is not a valid shapefile. Its .shp, .shx or .dbf header is truncated.")
+
+        shape_type = struct.unpack("<i", shp_header[32:36])[0]
+        if shape_type != self.shape_type:
+            raise ValueError("\"" + self.shp_path + "\" has shape type %i, but shape type %i is needed to append these points." % (shape_type, self.shape_type))
+
+        self.record_count = (os.path.getsize(self.shx_path) - 100) // 8
+        dbf_count, dbf_header_length, dbf_record_length = struct.unpack("<I2H", dbf_header[4:12])
+        if os.path.getsize(self.shp_path) != 100 + self.record_count * self._shp_record_length or dbf_count != self.record_count or dbf_record_length != self._dbf_record_length:
+            raise ValueError("The .shp, .shx and .dbf files of \"" + self.shp_path + "\" do not agree on the number or size of records, so points cannot be appended to it.")
+
+        if self.record_count > 0:
+            bounds = struct.unpack("<8d", shp_header[36:100])
+            dimensions = [(bounds[0], bounds[2]), (bounds[1], bounds[3])]
+            if self._has_z:
+                dimensions.append((bounds[4], bounds[5]))
+            if self._has_m:
+                dimensions.append((bounds[6], bounds[7]))
+            self._mins = [d[0] for d in dimensions]
+            self._maxs = [d[1] for d in dimensions]
+
+        # Remember the original state so that abort() can restore it. The
+        # .dbf end-of-file marker is overwritten by the new records and
+        # rewritten by close().
+
+        self._original = (shp_header, shx_header, dbf_header, self.record_count, dbf_header_length)
+        self._shp.seek(0, 2)
+        self._shx.seek(0, 2)
+        self._dbf.seek(dbf_header_length + self.record_count * dbf_record_length)
+        self._dbf.truncate()
+
+    def write_points(self, points, attributes=None):
+        """Writes a list of coordinate tuples. Each tuple is (x, y) for Point shapefiles, (x, y, m) for PointM and (x, y, z) or (x, y, z, m) for PointZ, depending on whether the writer was created with has_m. If the writer has attribute fields, attributes is the bytes returned by AttributeFormatter.format() for the same rows."""
+
+        if self._index is not None:
+            self._index.add_points(points)
+
+        content_struct = self._content_struct
+        header_struct = self._record_header_struct
+        shx_struct = self._record_header_struct
+        shp_length = self._shp_record_length
+        dbf_length = self._dbf_record_length
+        mins = self._mins
+        maxs = self._maxs
+        dims = range(self._input_dimensions)
+        pad_m = self._pad_m
+        no_data = (self.NO_DATA,)
+        attribute_length = self._attribute_length
+
+        for j, p in enumerate(points):
+            if self._buffered >= self.block_size:
+                self._flush()
+            i = self._buffered
+            record_number = self.record_count + 1
+            offset_words = (100 + self.record_count * shp_length) // 2
+
+            header_struct.pack_into(self._shp_buffer, i * shp_length, record_number, self._content_words)
+            if pad_m:
+                content_struct.pack_into(self._shp_buffer, i * shp_length + 8, self.shape_type, *(tuple(p) + no_data))
+            else:
+                content_struct.pack_into(self._shp_buffer, i * shp_length + 8, self.shape_type, *p)
+            shx_struct.pack_into(self._shx_buffer, i * 8, offset_words, self._content_words)
+            if attribute_length > 0:
+                self._dbf_buffer[i * dbf_length:(i + 1) * dbf_length] = (" %10d" % record_number).encode("ascii") + attributes[j * attribute_length:(j + 1) * attribute_length]
+            else:
+                self._dbf_buffer[i * dbf_length:(i + 1) * dbf_length] = (" %10d" % record_number).encode("ascii")
+
+            for d in dims:
+                v = p[d]
+                if mins[d] is None or v < mins[d]:
+                    mins[d] = v
+                if maxs[d] is None or v > maxs[d]:
+                    maxs[d] = v
+
+            self._buffered = i + 1
+            self.record_count = record_number
+
+    def write_array(self, coords, attributes=None):
+        """Writes an n by k NumPy float64 array of coordinates, with the columns ordered as for write_points, and their attributes as for write_points. The records of all n points are packed at once with vectorized operations rather than one at a time."""
+
+        n = len(coords)
+        if n <= 0:
+            return
+        self._flush()
+        if self._index is not None:
+            self._index.add_array(coords)
+
+        k = self._input_dimensions
+        numbers = numpy.arange(self.record_count + 1, self.record_count + 1 + n, dtype=numpy.int64)
+
+        shp = numpy.empty(n, dtype=self._shp_dtype)
+        shp["number"] = numbers
+        shp["length"] = self._content_words
+        shp["type"] = self.shape_type
+        shp["coords"][:, :k] = coords
+        if self._pad_m:
+            shp["coords"][:, 3] = self.NO_DATA
+
+        shx = numpy.empty(n, dtype=self._shx_dtype)
+        shx["offset"] = (100 + (numbers - 1) * self._shp_record_length) // 2
+        shx["length"] = self._content_words
+
+        self._shp.write(shp.tobytes())
+        self._shx.write(shx.tobytes())
+        dbf = self._format_ids(numbers)
+        if self._attribute_length > 0:
+            dbf = numpy.hstack((dbf, numpy.frombuffer(attributes, dtype=numpy.uint8).reshape(n, self._attribute_length)))
+        self._dbf.write(dbf.tobytes())
+
+        lows = coords.min(axis=0)
+        highs = coords.max(axis=0)
+        for d in range(k):
+            if self._mins[d] is None or lows[d] < self._mins[d]:
+                self._mins[d] = float(lows[d])
+            if self._maxs[d] is None or highs[d] > self._maxs[d]:
+                self._maxs[d] = float(highs[d])
+
+        self.record_count = self.record_count + n
+
+    def _format_ids(self, numbers):
+        """Returns an n by 11 uint8 array holding the .dbf records for the given record numbers: a blank deletion flag followed by the number, right-justified in 10 characters."""
+
+        records = numpy.full((len(numbers), 11), ord(" "), dtype=numpy.uint8)
+        remaining = numbers.copy()
+        for column in range(10, 0, -1):
+            present = remaining > 0
+            records[present, column] = ord("0") + remaining[present] % 10
+            remaining //= 10
+        return records
+
+    def close(self):
+        """Flushes buffered records, writes the final file headers and closes the files."""
+
+        try:
+            self._flush()
+            self._dbf.write(b"\x1a")
+
+            self._shp.seek(0)
+            self._shp.write(self._main_header(100 + self.record_count * self._shp_record_length))
+            self._shx.seek(0)
+            self._shx.write(self._main_header(100 + self.record_count * 8))
+            self._dbf.seek(0)
+            self._dbf.write(self._dbf_header())
+        finally:
+            self._shp.close()
+            self._shx.close()
+            self._dbf.close()
+
+        if self._index is not None:
+            self._index.write()
+
+    def abort(self):
+        """Closes and deletes the partially-written files. In append mode, the files are instead truncated back to their original records and headers."""
+
+        if self._append:
+            try:
+                shp_header, shx_header, dbf_header, record_count, dbf_header_length = self._original
+                self._shp.truncate(100 + record_count * self._shp_record_length)
+                self._shp.seek(0)
+                self._shp.write(shp_header)
+                self._shx.truncate(100 + record_count * 8)
+                self._shx.seek(0)
+                self._shx.write(shx_header)
+                self._dbf.seek(dbf_header_length + record_count * self._dbf_record_length)
+                self._dbf.write(b"\x1a")
+                self._dbf.truncate()
+                self._dbf.seek(0)
+                self._dbf.write(dbf_header)
+            finally:
+                for f in [self._shp, self._shx, self._dbf]:
+                    f.close()
+            return
+
+        for f in [self._shp, self._shx, self._dbf]:
+            try:
+                f.close()
+            except:
+                pass
+        for path in [self.shp_path, self.shx_path, self.dbf_path]:
+            try:
+                os.remove(path)
+            except:
+                pass
+
+    def _flush(self):
+        if self._buffered > 0:
+            self._shp.write(memoryview(self._shp_buffer)[:self._buffered * self._shp_record_length])
+            self._shx.write(memoryview(self._shx_buffer)[:self._buffered * 8])
+            self._dbf.write(memoryview(self._dbf_buffer)[:self._buffered * self._dbf_record_length])
+            self._buffered = 0
+
+    def _bounds(self, d):
+        if d >= self._input_dimensions or self._mins[d] is None:
+            return 0.0, 0.0
+        return self._mins[d], self._maxs[d]
+
+    def _main_header(self, file_length):
+        """Returns the 100-byte header shared by the .shp and .shx files."""
+
+        xmin, xmax = self._bounds(0)
+        ymin, ymax = self._bounds(1)
+        if self._has_z:
+            zmin, zmax = self._bounds(2)
+            if self._has_m:
+                mmin, mmax = self._bounds(3)
+            else:
+                mmin, mmax = 0.0, 0.0
+        elif self._has_m:
+            zmin, zmax = 0.0, 0.0
+            mmin, mmax = self._bounds(2)
+        else:
+            zmin, zmax, mmin, mmax = 0.0, 0.0, 0.0, 0.0
+        return struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length // 2) + struct.pack("<2i8d", 1000, self.shape_type, xmin, ymin, xmax, ymax, zmin, zmax, mmin, mmax)
+
+    def _dbf_header(self):
+        """Returns the dBASE III header and field descriptors for the .dbf file."""
+
+        today = datetime.date.today()
+        header = struct.pack("<4BIHH20x", 3, today.year - 1900, today.month, today.day, self.record_count, 32 + 32 * (1 + len(self._fields)) + 1, self._dbf_record_length)
+        fields = [struct.pack("<11sc4xBB14x", b"ID", b"N", 10, 0)]
+        for name, field_type, width, decimals in self._fields:
+            fields.append(struct.pack("<11sc4xBB14x", name.encode("latin-1"), field_type.encode("latin-1"), width, decimals))
+        return header + b"".join(fields) + b"\r"
+
+
+def _get_projection_wkt(coordinate_system):
+    """Returns the well-known text for coordinate_system if it is either well-known text itself or the path to a .prj file, or None if only ArcGIS can interpret it."""
+
+    if coordinate_system.upper().startswith("GEOGCS[") or coordinate_system.upper().startswith("PROJCS[") or coordinate_system.upper().startswith("GEOCCS["):
+        return coordinate_system
+    if coordinate_system.lower().endswith(".prj") and os.path.isfile(coordinate_system):
+        f = open(coordinate_system, "r")
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+    return None
+
+
+class _ProcessProtocol:
+    """asyncio subprocess protocol used by _ProcessRunner for one child process. Splits the process's stdout and stderr into lines as the data arrives and reports the outcome to the runner once the process has exited and both pipes have closed."""
+
+    def __init__(self, runner, index):
+        self._runner = runner
+        self.index = index
+        self.transport = None
+        self.timed_out = False
+        self.started = None
+        self._timer = None
+        self._partial = {1: b"", 2: b""}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.started = time.time()
+
+    def pipe_data_received(self, fd, data):
+        lines = (self._partial[fd] + data).split(b"\n")
+        self._partial[fd] = lines.pop()
+        for line in lines:
+            self._runner._line(self.index, fd, line)
+
+    def pipe_connection_lost(self, fd, exc):
+        if self._partial.get(fd):
+            self._runner._line(self.index, fd, self._partial[fd])
+            self._partial[fd] = b""
+
+    def process_exited(self):
+        pass
+
+    def connection_lost(self, exc):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._runner._finish(self.index, {"returncode": self.transport.get_returncode(), "timed_out": self.timed_out, "error": None, "seconds": time.time() - self.started})
+
+    def start_done(self, task):
+        """Callback for the task that starts the process."""
+
+        if task.cancelled():
+            self._runner._finish(self.index, {"returncode": None, "timed_out": False, "error": "The process was not started.", "seconds": None})
+        elif task.exception() is not None:
+            e = task.exception()
+            self._runner._finish(self.index, {"returncode": None, "timed_out": False, "error": e.__class__.__name__ + ": " + str(e), "seconds": None})
+        elif self._runner._timeouts[self.index] is not None:
+            self._timer = self._runner._loop.call_later(self._runner._timeouts[self.index], self._time_out)
+
+    def kill(self):
+        """Kills the process, if it is still running, and closes its pipes. Closing the pipes means the runner does not wait for them to reach end of file, which would never happen if the process started children of its own that inherited them."""
+
+        if self.transport is not None:
+            if self.transport.get_returncode() is None:
+                try:
+                    self.transport.kill()
+                except ProcessLookupError:
+                    pass
+            self.transport.close()
+
+    def _time_out(self):
+        self.timed_out = True
+        self.kill()
+
+
+class _ProcessRunner:
+    """Runs child processes on an asyncio event loop, as a replacement for blocking on os.popen(). Output is read as the processes write it and passed to on_line(index, stream, line), where index is the position of the command in the list passed to run() and stream is "stdout" or "stderr". Processes that run for longer than timeout seconds are killed, and up to max_processes commands run at once from the calling thread.
+
+    The loop is driven with protocol callbacks rather than coroutines so that this module can still be loaded by Python 2. Running processes requires Python 3.4.4 or later, which provides asyncio. Before Python 3.8, on POSIX systems, run() must be called from the main thread, because asyncio's child watcher relies on a SIGCHLD handler."""
+
+    def __init__(self, on_line, timeout=None, max_processes=None, encoding=None):
+        self.on_line = on_line
+        self.timeout = timeout
+        self.max_processes = max_processes
+        if encoding is None:
+            encoding = _locale.getpreferredencoding(False) or "utf-8"
+        self.encoding = encoding
+
+    def run(self, commands, timeouts=None):
+        """Runs each command, a list of the program and its arguments, and returns a list with one dictionary per command, in the same order, with the keys returncode, timed_out, error and seconds. If the process could not be started, returncode is None and error describes why. timeouts optionally gives a timeout for each command, overriding the one given to the constructor."""
+
+        try:
+            import asyncio
+        except ImportError:
+            raise RuntimeError("Running child processes asynchronously requires Python 3.4 or later.")
+
+        # Only the proactor event loop supports child processes on Windows,
+        # and it is not the default before Python 3.8.
+
+        if sys.platform == "win32" and hasattr(asyncio, "ProactorEventLoop"):
+            self._loop = asyncio.ProactorEventLoop()
+        else:
+            self._loop = asyncio.new_event_loop()
+
+        # Before Python 3.8, the child watcher that reports the exit of the
+        # processes only works once it is attached to the loop that runs
+        # them. Later versions watch each process from a thread.
+
+        watcher = None
+        if sys.platform != "win32" and sys.version_info < (3, 8):
+            watcher = asyncio.get_child_watcher()
+            watcher.attach_loop(self._loop)
+        self._asyncio = asyncio
+        self._commands = commands
+        if timeouts is None:
+            timeouts = [self.timeout] * len(commands)
+        self._timeouts = timeouts
+        self._results = [None] * len(commands)
+        self._next = 0
+        self._running = {}
+        self._finished = asyncio.Future(loop=self._loop)
+        try:
+            if len(commands) > 0:
+                self._start_processes()
+                self._loop.run_until_complete(self._finished)
+        finally:
+            for protocol in list(self._running.values()):
+                protocol.kill()
+            if watcher is not None:
+                watcher.attach_loop(None)
+            self._loop.close()
+        return self._results
+
+    def _start_processes(self):
+        while self._next < len(self._commands) and (self.max_processes is None or len(self._running) < self.max_processes):
+            index = self._next
+            self._next = self._next + 1
+            protocol = _ProcessProtocol(self, index)
+            self._running[index] = protocol
+            task = self._asyncio.ensure_future(self._loop.subprocess_exec(lambda protocol=protocol: protocol, *self._commands[index], stdin=subprocess.DEVNULL), loop=self._loop)
+            task.add_done_callback(protocol.start_done)
+
+    def _finish(self, index, result):
+        self._results[index] = result
+        del self._running[index]
+        self._start_processes()
+        if len(self._running) <= 0 and not self._finished.done():
+            self._finished.set_result(None)
+
+    def _line(self, index, fd, line):
+        if fd == 2:
+            stream = "stderr"
+        else:
+            stream = "stdout"
+        self.on_line(index, stream, line.decode(self.encoding, "replace").rstrip("\r"))
+
+
 class Ascii2Shp(MarineTool):
-    """Real implementation of the ascii2shp.exe wrapper."""
+    """Real implementation of the ascii2shp.exe wrapper. By default the conversion is done in-process by DelimitedTextReader and PointShapefileWriter; set engine to "ascii2shp.exe" to run the original executable instead."""
 
     def __init__(self, **keyword_args):
         MarineTool.__init__(self, keyword_args=keyword_args)
@@ -384,15 +1857,67 @@ class Ascii2Shp(MarineTool):
         self._parse_string_arg("locale")
         self._parse_string_arg("coordinate_system")
 
+        # Parameter 13, verbose_logging, is consumed by main() before this
+        # tool is constructed. Skip over it so that the optional parameters
+        # below line up with their command line positions.
+
+        if self._from_command_line:
+            self._command_line_arg_count = self._command_line_arg_count + 1
+
+        self._parse_string_arg("engine", default="native")
+        self._parse_int_arg("chunk_size", default=4194304)
+        self._parse_int_arg("parallel_workers", default=1)
+        self._parse_boolean_arg("memory_map", default=False)
+        self._parse_boolean_arg("incremental", default=False)
+        self._parse_boolean_arg("spatial_index", default=False)
+        self._parse_string_arg("executable")
+        self._parse_float_arg("timeout", default=None)
+        self._parse_string_arg("attribute_columns")
+        self._parse_int_arg("attribute_sample_rows", default=10000)
+
+        self.record_count = None
+        self.row_count = None
+        self.metrics["input_textfile"] = self.input_textfile
+        self.metrics["output_shapefile"] = self.output_shapefile
+        self._finish_init()
+
     def _run_tool(self):
         """Entry point for this tool."""
 
-        # Validate input parameters.
+        self._validate_parameters()
+
+        # Do the conversion. In incremental mode, there may be nothing to
+        # do, in which case the catalog and projection are already up to
+        # date.
+
+        if not self._convert():
+            return
+
+        # Refresh the catalog. This must be done for Arc to detect that the
+        # shapefile was created. If it is not done, the DefineProjection
+        # function will fail, saying that the shapefile does not exist. It is
+        # not clear what should be passed to RefreshCatalog. When I passed
+        # self.output_shapefile, it worked fine on my machine but on someone
+        # else's machine, it would then fail on the DefineProjection. When I
+        # passed os.path.dirname(self.output_shapefile), it would crash python
+        # on my machine (it went straight into "we're sorry" prompt for
+        # python.exe). The following hack will hopefully not crash python.exe
+        # and successfully refresh the catalog on all machines.
+
+        self._GpDispatch_RefreshCatalog(self.output_shapefile, self.output_shapefile)
+        self._GpDispatch_RefreshCatalog(os.path.dirname(os.path.dirname(self.output_shapefile)), self.output_shapefile)
+
+        # Define the projection.
+
+        self._define_projection()
+
+    def _validate_parameters(self):
+        """Validates the input parameters and normalizes their values."""
 
         if not os.path.isfile(self.input_textfile):
             raise MarineError("The input file \"" + str(self.input_textfile) + "\" does not exist or is not accessible. Please check the file path and try again.", self._indent_level)
 
-        if self._GpDispatch_Exists(self.output_shapefile):
+        if self._GpDispatch_Exists(self.output_shapefile) and not (self.incremental and os.path.isfile(self._output_base() + ".a2s")):
             raise MarineError("The shapefile or other GIS object \"" + str(self.output_shapefile) + "\" already exists. Please delete it and try again.", self._indent_level)
 
         if self.delimiter is not None:
@@ -403,7 +1928,7 @@ class Ascii2Shp(MarineTool):
                 if self.delimiter_character is None or len(self.delimiter_character) != 1:
                     raise MarineError("The user specified delimiter must be a single character.", self._indent_level)
         
-        if self.comment_string is not None and self.comment_string == "\#":
+        if self.comment_string is not None and self.comment_string == "\\#":
             self.comment_string = "#"
 
         if self.quote_character is not None:
@@ -411,127 +1936,767 @@ class Ascii2Shp(MarineTool):
                 raise MarineError("The value \"" + self.quote_character + "\" is not valid for the quote character parameter. It must be either \"single quote\" or \"double quote\".", self._indent_level)
             self.quote_character = self.quote_character.lower();
 
-        # Build the ASCII2SHP.EXE command line to execute.
+        if self.engine.lower() != "native" and self.engine.lower() != "ascii2shp.exe":
+            raise MarineError("The value \"" + self.engine + "\" is not valid for the engine parameter. It must be either \"native\" or \"ascii2shp.exe\".", self._indent_level)
+        self.engine = self.engine.lower()
+
+        if self.chunk_size <= 0:
+            raise MarineError("The chunk_size parameter must be a positive number of bytes.", self._indent_level)
+
+        if self.parallel_workers < 1:
+            raise MarineError("The parallel_workers parameter must be 1 or more.", self._indent_level)
+
+        if self.incremental and self.engine != "native":
+            raise MarineError("Incremental mode requires the native engine. Ascii2shp.exe cannot append to an existing shapefile.", self._indent_level)
+
+        if self.spatial_index and (self.engine != "native" or _load_numpy() is None):
+            raise MarineError("The spatial_index option requires the native engine and the NumPy Python package. Please install NumPy or disable spatial_index.", self._indent_level)
+
+        if self.timeout is not None and self.timeout <= 0:
+            raise MarineError("The timeout parameter must be a positive number of seconds.", self._indent_level)
+
+        if self.attribute_columns is not None and self.engine != "native":
+            raise MarineError("The attribute_columns parameter requires the native engine. Ascii2shp.exe only writes the ID field.", self._indent_level)
+
+        if self.attribute_sample_rows < 0:
+            raise MarineError("The attribute_sample_rows parameter must be 0 (to examine every row) or more.", self._indent_level)
+
+        if self.executable is None:
+            self.executable = os.path.join(os.path.dirname(sys.argv[0]), "ascii2shp.exe")
+
+    def _define_projection(self):
+        """Defines the projection of output_shapefile from the coordinate_system parameter, if one was given."""
+
+        if self.coordinate_system is None:
+            return
+
+        self._log("Defining the projection of \"" + self.output_shapefile + "\"...")
+
+        timer = self._start_timer()
+        try:
+            if self._write_projection_file():
+                return
+
+            try:
+                Geoprocessor.get().DefineProjection_management(self.output_shapefile, self.coordinate_system)
+            except:
+                self._log_returned_geoprocessor_messages(1)
+                raise
+
+            self._log_returned_geoprocessor_messages()
+        finally:
+            self._stop_timer("projection", timer)
+
+    def _write_projection_file(self):
+        """If the native engine wrote the shapefile and coordinate_system is either well-known text or the path to a .prj file, writes the shapefile's .prj file directly, without calling the ArcGIS DefineProjection tool, and returns True. Otherwise returns False."""
 
-        cmd = "cmd.exe /c " + os.path.dirname(sys.argv[0]) + "\\ascii2shp.exe \"%s\" \"%s\" %s %s" % (self.input_textfile, self.output_shapefile, self.xcol, self.ycol)
+        if self.engine != "native":
+            return False
+        wkt = _get_projection_wkt(self.coordinate_system)
+        if wkt is None:
+            return False
+
+        path = self._output_base()
+        f = open(path + ".prj", "w")
+        try:
+            f.write(wkt)
+        finally:
+            f.close()
+        self._log_verbose("Wrote \"" + path + ".prj\".")
+        return True
+
+    def _ascii2shp_exe_args(self):
+        """Returns the ascii2shp.exe command line as a list of arguments. Passing a list, rather than a string to a shell, means that paths containing spaces or quotes need no escaping."""
+
+        args = [self.executable, self.input_textfile, self.output_shapefile, self.xcol, self.ycol]
 
         if self.zcol is not None:
-            cmd = cmd + " -z " + self.zcol
+            args.extend(["-z", self.zcol])
 
         if self.mcol is not None:
-            cmd = cmd + " -m " + self.mcol
+            args.extend(["-m", self.mcol])
 
         if self.delimiter is not None:
             if self.delimiter == "comma":
-                cmd = cmd + " -c"
+                args.append("-c")
             elif self.delimiter == "space or tab":
-                cmd = cmd + " -t"
+                args.append("-t")
             elif self.delimiter == "user specified":
-                cmd = cmd + " -d " + self.delimiter_character
+                args.extend(["-d", self.delimiter_character])
             else:
                 raise MarineError("Programming error in ascii2shp.py. The value \"" + self.delimiter + "\" is an unknown delimiter value. Please contact the author of this tool.", self._indent_level)
 
         if self.quote_character is not None:
             if self.quote_character == "single quote":
-                cmd = cmd + " -a"
+                args.append("-a")
             elif self.quote_character == "double quote":
-                cmd = cmd + " -q"
+                args.append("-q")
             else:
                 raise MarineError("Programming error in ascii2shp.py. The value \"" + self.quote_character + "\" is an unknown delimiter value. Please contact the author of this tool.", self._indent_level)
 
         if self.locale is not None:
-            cmd = cmd + " -l " + self.locale
+            args.extend(["-l", self.locale])
 
-        # Execute ASCII2SHP.EXE
+        return args
 
-        self._log("Executing '" + cmd + "'...")
+    def _run_ascii2shp_exe(self):
+        """Converts input_textfile to output_shapefile by running ascii2shp.exe. Its output is logged line by line as it is written."""
 
-        try:
-            f = os.popen(cmd)
-        except Exception, e:
-            self._log("Failed to execute '" + cmd + "'. The python os.popen() function raised the following exception when passed that command: " + str(e), "error")
-            raise
+        args = self._ascii2shp_exe_args()
+        self._log("Executing '" + subprocess.list2cmdline(args) + "'...")
 
         self._indent_level = self._indent_level + 2
-        self._log_verbose("Please wait. No progress will be reported until ascii2shp.exe exits...")
+
+        def log_line(index, stream, line):
+            if stream == "stderr":
+                self._log(line, "warning")
+            else:
+                self._log(line)
 
         try:
-            ascii2shp_output = f.read()
-        except Exception, e:
-            self._log("Failed to read from the stdout pipe of the ASCII2SHP.EXE child process. The python file.read() function raised the following exception: " + str(e), "error")
+            result = _ProcessRunner(log_line, timeout=self.timeout).run([args])[0]
+        finally:
             self._indent_level = self._indent_level - 2
-            raise
 
+        self._check_ascii2shp_exe_result(result)
+        self._log("Ascii2shp.exe completed successfully.")
+
+    def _check_ascii2shp_exe_result(self, result):
+        """Raises MarineError if a _ProcessRunner result shows that ascii2shp.exe failed."""
+
+        if result["error"] is not None:
+            raise MarineError("Failed to execute \"" + self.executable + "\". The operating system reported the following error: " + result["error"], self._indent_level)
+        if result["timed_out"]:
+            raise MarineError("Ascii2shp.exe did not finish within %g seconds and was stopped. The output shapefile may be incomplete." % self.timeout, self._indent_level)
+        if result["returncode"] != 0:
+            raise MarineError("Ascii2shp.exe failed with exit code %i. Please see the messages above for details." % result["returncode"], self._indent_level)
+
+    def _convert(self):
+        """Converts input_textfile to output_shapefile with the selected engine. Returns False if incremental mode found nothing to do, True otherwise."""
+
+        timer = self._start_timer()
         try:
-            ascii2shp_result = f.close()
-        except Exception, e:
-            self._log("Failed to close the stdout pipe of the ASCII2SHP.EXE child process. The python file.close() function raised the following exception: " + str(e), "error")
-            self._indent_level = self._indent_level - 2
+            if self.engine != "native":
+                self._run_ascii2shp_exe()
+                return True
+            if self.incremental:
+                return self._convert_incremental()
+            self._convert_native()
+            return True
+        finally:
+            self._stop_timer("conversion", timer)
+
+    def _convert_incremental(self):
+        """Implements incremental mode. The sidecar index file next to output_shapefile records the size, modification time and SHA-1 hash of the part of input_textfile that has been converted, along with the parameters that were used. If the input file has not changed, nothing is done. If rows have only been appended to it, they are appended to the existing shapefile. Otherwise the shapefile is rebuilt."""
+
+        index_path = self._output_base() + ".a2s"
+        settings = self._incremental_settings()
+        size = os.path.getsize(self.input_textfile)
+        mtime = os.path.getmtime(self.input_textfile)
+
+        index = None
+        if os.path.isfile(index_path) and os.path.isfile(self._output_base() + ".shp"):
+            try:
+                f = open(index_path, "r")
+                try:
+                    index = json.load(f)
+                finally:
+                    f.close()
+            except Exception as e:
+                self._log("The incremental index \"" + index_path + "\" could not be read and will be rebuilt. Error details: " + str(e), "warning")
+            if index is not None and index.get("settings") != settings:
+                self._log("The parameters differ from those used to create \"" + self.output_shapefile + "\". It will be rebuilt.")
+                index = None
+
+        if index is not None and index["size"] == size and index["mtime"] == mtime:
+            self.record_count = index["record_count"]
+            self._log("\"" + self.input_textfile + "\" has not changed since \"" + self.output_shapefile + "\" was last updated. Skipping it.")
+            return False
+
+        # Only complete lines are converted. A partial last line is probably
+        # still being written; it will be picked up by the next run.
+
+        data_end = self._find_last_line_end(size)
+
+        # Hash the previously-converted part of the file. If it is unchanged,
+        # keep hashing the new rows with the same hasher to get the hash for
+        # the next run.
+
+        hasher = hashlib.sha1()
+        if index is not None and index["data_end"] <= data_end:
+            self._hash_file_range(hasher, 0, index["data_end"])
+            if hasher.hexdigest() != index["hash"]:
+                self._log("\"" + self.input_textfile + "\" was modified, not just appended to, since \"" + self.output_shapefile + "\" was last updated. It will be rebuilt.")
+                index = None
+        else:
+            index = None
+
+        # Append the new rows. If one of their attribute values does not fit
+        # the fields of the shapefile, the writer restores the shapefile and
+        # it is rebuilt with fields inferred afresh.
+
+        if index is not None:
+            self._log("Appending the rows added to \"" + self.input_textfile + "\" since \"" + self.output_shapefile + "\" was last updated...")
+            try:
+                self._convert_native(data_start=index["data_end"], data_end=data_end, append=True, rows_before=index["row_count"])
+                self._hash_file_range(hasher, index["data_end"], data_end)
+            except AttributeFitError as e:
+                self._log("Data row %i of \"%s\" has the value \"%s\", which cannot be stored in the %s(%i,%i) field %s of \"%s\". It will be rebuilt." % (e.index + 1, self.input_textfile, e.value, e.field[1], e.field[2], e.field[3], e.field[0], self.output_shapefile))
+                index = None
+
+        if index is None:
+            hasher = hashlib.sha1()
+            for extension in [".shp", ".shx", ".dbf", ".qix", ".a2s"]:
+                if os.path.isfile(self._output_base() + extension):
+                    os.remove(self._output_base() + extension)
+            self._convert_native(data_end=data_end)
+            self._hash_file_range(hasher, 0, data_end)
+
+        index = {"settings": settings,
+                 "size": size,
+                 "mtime": mtime,
+                 "data_end": data_end,
+                 "hash": hasher.hexdigest(),
+                 "row_count": self.row_count,
+                 "record_count": self.record_count}
+        f = open(index_path, "w")
+        try:
+            json.dump(index, f)
+        finally:
+            f.close()
+        return True
+
+    def _incremental_settings(self):
+        """Returns the parameters that must not change between incremental runs."""
+
+        return {"xcol": self.xcol, "ycol": self.ycol, "zcol": self.zcol, "mcol": self.mcol, "delimiter": self.delimiter, "delimiter_character": self.delimiter_character, "comment_string": self.comment_string, "quote_character": self.quote_character, "locale": self.locale, "spatial_index": self.spatial_index, "attribute_columns": self.attribute_columns}
+
+    def _find_last_line_end(self, size):
+        """Returns the offset just after the last newline in input_textfile, or 0 if it has none."""
+
+        f = open(self.input_textfile, "rb")
+        try:
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                block = f.read(end - start)
+                i = block.rfind(b"\n")
+                if i >= 0:
+                    return start + i + 1
+                end = start
+        finally:
+            f.close()
+        return 0
+
+    def _hash_file_range(self, hasher, start, end):
+        f = open(self.input_textfile, "rb")
+        try:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(self.chunk_size, remaining))
+                if len(data) <= 0:
+                    break
+                hasher.update(data)
+                remaining = remaining - len(data)
+        finally:
+            f.close()
+
+    def _output_base(self):
+        """Returns output_shapefile without its .shp extension."""
+
+        if os.path.splitext(self.output_shapefile)[1].lower() == ".shp":
+            return os.path.splitext(self.output_shapefile)[0]
+        return self.output_shapefile
+
+    def _convert_native(self, data_start=None, data_end=None, append=False, rows_before=0, sample_rows=None):
+        """Converts input_textfile to output_shapefile in-process, without ascii2shp.exe. By default the whole file is converted; incremental mode passes data_start and data_end to convert only part of it, and append to add the points to the existing shapefile. rows_before is the number of data rows that precede data_start, for error messages. sample_rows overrides attribute_sample_rows.
+
+        In append mode, AttributeFitError is raised if an attribute value does not fit the fields of the existing shapefile."""
+
+        if self.delimiter == "space or tab":
+            delimiter = None
+        elif self.delimiter == "user specified":
+            delimiter = self.delimiter_character
+        else:
+            delimiter = ","
+
+        if self.quote_character == "single quote":
+            quote_character = "'"
+        elif self.quote_character == "double quote":
+            quote_character = "\""
+        else:
+            quote_character = None
+
+        decimal_point = self._get_decimal_point()
+        if sample_rows is None:
+            sample_rows = self.attribute_sample_rows
+
+        # The conversion is a pipeline of generators: the reader yields
+        # chunks of rows, the decoder converts each chunk to coordinates and
+        # the writer packs them into its buffers. Only one chunk is alive at
+        # a time (per worker process, in parallel mode).
+
+        reader = DelimitedTextReader(self.input_textfile, delimiter, quote_character, self.comment_string, self.memory_map)
+        header_end = reader.read_header()
+        if data_start is None:
+            data_start = header_end
+        header = reader.header
+        if header is None:
+            raise MarineError("The input file \"" + self.input_textfile + "\" does not contain a header line. The first line that is not blank or a comment must list the column names.", self._indent_level)
+
+        column_indices = [self._get_column_index(header, self.xcol, "xcol"), self._get_column_index(header, self.ycol, "ycol")]
+        if self.zcol is not None:
+            column_indices.append(self._get_column_index(header, self.zcol, "zcol"))
+        if self.mcol is not None:
+            column_indices.append(self._get_column_index(header, self.mcol, "mcol"))
+
+        # The reader projects each row down to just the coordinate columns,
+        # followed by the attribute columns, so the decoder sees the
+        # coordinates as columns 0 to k-1 and no other column is parsed.
+
+        decoder = CoordinateDecoder(list(range(len(column_indices))), decimal_point)
+
+        attribute_indices = self._get_attribute_columns(header, column_indices)
+        fields = None
+        complete = True
+        formatter = None
+        if len(attribute_indices) > 0:
+            if append:
+                fields = _read_dbf_fields(self._output_base() + ".dbf")
+                if len(fields) != len(attribute_indices):
+                    raise MarineError("\"" + self.output_shapefile + "\" has %i attribute fields but %i attribute columns were requested, so points cannot be appended to it." % (len(fields), len(attribute_indices)), self._indent_level)
+            else:
+                fields, complete = self._infer_attribute_fields(reader, header, attribute_indices, data_start, data_end, decimal_point, sample_rows)
+            formatter = AttributeFormatter(fields, len(column_indices), decimal_point)
+
+        self._log("Converting \"" + self.input_textfile + "\" to \"" + self.output_shapefile + "\"...")
+
+        try:
+            writer = PointShapefileWriter(self.output_shapefile, has_z=self.zcol is not None, has_m=self.mcol is not None, append=append, spatial_index=self.spatial_index, fields=fields)
+        except ValueError as e:
+            raise MarineError(str(e), self._indent_level)
+        records_before = writer.record_count
+        try:
+            for points, attributes in self._decode_chunks(reader, decoder, data_start, data_end, column_indices + attribute_indices, rows_before, formatter):
+                if numpy is not None and isinstance(points, numpy.ndarray):
+                    writer.write_array(points, attributes)
+                else:
+                    writer.write_points(points, attributes)
+        except AttributeFitError as e:
+            writer.abort()
+
+            # Values are never left blank or truncated. In append mode, the
+            # caller rebuilds the shapefile. If the fields were inferred from
+            # a sample of the rows, infer them from every row and start
+            # again. Otherwise the value cannot be stored at all.
+
+            if append:
+                raise
+            message = "Data row %i of the input file \"%s\" has the value \"%s\" in its %s column, which cannot be stored in the %s(%i,%i) field " % (e.index + 1, self.input_textfile, e.value, header[attribute_indices[fields.index(e.field)]], e.field[1], e.field[2], e.field[3])
+            if not complete:
+                self._log(message + "inferred from the first %i rows. Inferring the attribute fields from every row and starting again..." % sample_rows)
+                return self._convert_native(data_start, data_end, append, rows_before, sample_rows=0)
+            if e.field[1] == "C":
+                raise MarineError(message + "because it is longer than the %i characters a dBASE text field can hold. Please shorten it or leave the column out of attribute_columns." % e.field[2], self._indent_level)
+            raise MarineError(message + "inferred from every row.", self._indent_level)
+        except:
+            writer.abort()
             raise
+        writer.close()
 
-        if ascii2shp_result is not None:
-            self._log("")        
-            self._log(ascii2shp_output, "error")
-            self._indent_level = self._indent_level - 2
-            raise MarineError("Ascii2shp.exe failed.", self._indent_level)
+        self.record_count = writer.record_count
+        self.row_count = rows_before + self._rows_decoded
+        self._log("Wrote %i points." % (writer.record_count - records_before))
 
-        self._log_verbose("")        
-        self._log_verbose(ascii2shp_output)        
-        self._indent_level = self._indent_level - 2
-        self._log("Ascii2shp.exe completed successfully.")
+        if data_end is None:
+            data_end = os.path.getsize(self.input_textfile)
+        self._add_counter("rows", self._rows_decoded, "conversion")
+        self._add_counter("bytes", data_end - data_start, "conversion")
+        self._add_counter("records", writer.record_count - records_before, "conversion")
+        if fields is not None:
+            self._add_counter("attribute_values", self._rows_decoded * len(fields), "conversion")
 
-        # Refresh the catalog. This must be done for Arc to detect that the
-        # shapefile was created. If it is not done, the DefineProjection
-        # function will fail, saying that the shapefile does not exist. It is
-        # not clear what should be passed to RefreshCatalog. When I passed
-        # self.output_shapefile, it worked fine on my machine but on someone
-        # else's machine, it would then fail on the DefineProjection. When I
-        # passed os.path.dirname(self.output_shapefile), it would crash python
-        # on my machine (it went straight into "we're sorry" prompt for
-        # python.exe). The following hack will hopefully not crash python.exe
-        # and successfully refresh the catalog on all machines.
+    def _decode_chunks(self, reader, decoder, data_start, data_end, columns, rows_before=0, formatter=None):
+        """Generator that yields the decoded coordinates of each chunk of the input file from data_start to data_end (or the end of the file), in file order, along with their attributes formatted by formatter (or None if formatter is None). If parallel_workers is greater than 1, the file is split at line boundaries into byte ranges of about chunk_size bytes, which are decoded and formatted by a pool of worker processes. The number of rows decoded is left in self._rows_decoded. If an attribute value does not fit its field, AttributeFitError is raised with the index of its data row in the whole file."""
 
-        self._log_verbose("Calling the ArcGIS RefreshCatalog function on \"" + self.output_shapefile + "\"...")
+        row_number = rows_before
+        self._rows_decoded = 0
         try:
-            Geoprocessor.instance.RefreshCatalog(self.output_shapefile)
-        except Exception, e:
-            self._log("The ArcGIS RefreshCatalog function failed on \"" + self.output_shapefile + "\". Further geoprocessing involving \"" + self.output_shapefile + "\" may fail until you manually refresh the catalog. The exception raised by RefreshCatalog was: " + str(e), "warning")
+            if self.parallel_workers <= 1:
+                for rows in reader.chunks(self.chunk_size, data_start, data_end, columns):
+                    points, attributes = _decode_rows(decoder, formatter, rows)
+                    row_number = row_number + len(rows)
+                    self._rows_decoded = row_number - rows_before
+                    yield points, attributes
+                return
+
+            if data_end is None:
+                data_end = os.path.getsize(self.input_textfile)
+            range_count = max(self.parallel_workers, (data_end - data_start) // self.chunk_size + 1)
+            jobs = [(reader, decoder, formatter, start, end, self.chunk_size, columns) for (start, end) in reader.split_ranges(data_start, range_count, data_end)]
+
+            self._log_verbose("Decoding %i byte ranges with %i worker processes..." % (len(jobs), self.parallel_workers))
+            import multiprocessing
+            pool = multiprocessing.Pool(self.parallel_workers)
+            try:
 
-        self._log_verbose("Calling the ArcGIS RefreshCatalog function on \"" + os.path.os.path.dirname(os.path.dirname(self.output_shapefile)) + "\"...")
+                # The results are taken in the order of the jobs, so the
+                # records are written in file order and the writer assigns
+                # the record numbers, offsets and bounds as usual. At most
+                # two byte ranges per worker are in flight, so that decoded
+                # chunks do not pile up in memory when the workers decode
+                # faster than the writer writes.
+
+                window = 2 * self.parallel_workers
+                pending = []
+                next_job = 0
+                while next_job < len(jobs) or len(pending) > 0:
+                    while next_job < len(jobs) and len(pending) < window:
+                        pending.append(pool.apply_async(_decode_range, (jobs[next_job],)))
+                        next_job = next_job + 1
+                    decoded, row_count = pending.pop(0).get()
+                    for points, attributes in decoded:
+                        yield points, attributes
+                    row_number = row_number + row_count
+                    self._rows_decoded = row_number - rows_before
+            finally:
+                pool.terminate()
+                pool.join()
+
+        except AttributeFitError as e:
+            raise AttributeFitError(row_number + e.index, e.field, e.value)
+        except RowParseError as e:
+            raise MarineError("Data row %i of the input file \"%s\" could not be parsed. It must contain a numeric value for each coordinate column. The row contains: %s" % (row_number + e.index + 1, self.input_textfile, repr(e.fields)), self._indent_level)
+
+    def _get_attribute_columns(self, header, coordinate_indices):
+        """Returns the zero-based indices of the columns given by the attribute_columns parameter: either "all", for every column that is not a coordinate column, or a list of column names or one-based column numbers separated by semicolons."""
+
+        if self.attribute_columns is None:
+            return []
+        if self.attribute_columns.lower() == "all":
+            return [i for i in range(len(header)) if i not in coordinate_indices]
+        indices = []
+        for column in self.attribute_columns.split(";"):
+
+            # ArcGIS quotes the values of multivalue parameters that contain
+            # spaces.
+
+            column = column.strip().strip("'")
+            if len(column) > 0:
+                index = self._get_column_index(header, column, "attribute_columns")
+                if index not in indices:
+                    indices.append(index)
+        return indices
+
+    def _infer_attribute_fields(self, reader, header, indices, data_start, data_end, decimal_point, sample_rows):
+        """Infers the dBASE field for each of the attribute columns given by indices from the first sample_rows data rows, or from every row if it is 0. Only the attribute columns are parsed. Returns a list of (name, type, width, decimals) tuples and whether every row was examined. If not, the numeric fields are given headroom for wider values in the rows that were not."""
+
+        stats = [_FieldStats(name) for name in _dbf_field_names([header[i] for i in indices])]
+        sampled = 0
+        complete = True
+        chunks = reader.chunks(self.chunk_size, data_start, data_end, indices)
         try:
-            Geoprocessor.instance.RefreshCatalog(os.path.dirname(os.path.dirname(self.output_shapefile)))
-        except Exception, e:
-            self._log("The ArcGIS RefreshCatalog function failed on \"" + os.path.dirname(os.path.dirname(self.output_shapefile)) + "\". Further geoprocessing involving \"" + self.output_shapefile + "\" may fail until you manually refresh the catalog. The exception raised by RefreshCatalog was: " + str(e), "warning")
+            for rows in chunks:
+                if sample_rows > 0:
+                    rows = rows[:sample_rows - sampled]
+                rows = [r for r in rows if len(r) == len(indices)]
+                sampled = sampled + len(rows)
+                for field_stats, values in zip(stats, zip(*rows)):
+                    if decimal_point != ".":
+                        field_stats.update([v.strip().replace(decimal_point, ".") for v in values])
+                    else:
+                        field_stats.update([v.strip() for v in values])
+                if sample_rows > 0 and sampled >= sample_rows:
+                    complete = False
+                    break
+        finally:
+            chunks.close()
+
+        fields = [field_stats.field(headroom=not complete) for field_stats in stats]
+        self._log_verbose("Inferred the attribute fields from %i rows: " % sampled + ", ".join(["%s %s(%i,%i)" % f for f in fields]))
+        return fields, complete
+
+    def _get_column_index(self, header, column, arg_name):
+        """Returns the zero-based index of column, which may be either a column name from the header line or a one-based column number."""
+
+        if column.isdigit():
+            index = int(column) - 1
+            if index < 0 or index >= len(header):
+                raise MarineError("Column number " + column + " given for the " + arg_name + " parameter is out of range. The input file has %i columns." % len(header), self._indent_level)
+            return index
+
+        lowered = [c.strip().lower() for c in header]
+        if column.lower() not in lowered:
+            raise MarineError("The input file does not have a column named \"" + column + "\" (given for the " + arg_name + " parameter). The columns are: " + ", ".join(header), self._indent_level)
+        return lowered.index(column.lower())
+
+    def _get_decimal_point(self):
+        """Returns the decimal point character of the locale parameter, in the same way that ascii2shp.exe obtains it from setlocale."""
+
+        if self.locale is None:
+            return "."
+
+        saved = _locale.setlocale(_locale.LC_NUMERIC)
+        try:
+            try:
+                _locale.setlocale(_locale.LC_NUMERIC, self.locale)
+            except _locale.Error as e:
+                raise MarineError("The locale \"" + self.locale + "\" is not recognized by this machine. Error details: " + str(e), self._indent_level)
+            return _locale.localeconv()["decimal_point"]
+        finally:
+            _locale.setlocale(_locale.LC_NUMERIC, saved)
+
+
+def _run_batch_job(job):
+    """Worker process entry point for BatchAscii2Shp. Validates and converts one text file and returns a dictionary describing the outcome."""
+
+    index, keyword_args = job
+    result = {"index": index,
+              "input_textfile": keyword_args.get("input_textfile"),
+              "output_shapefile": keyword_args.get("output_shapefile"),
+              "succeeded": False,
+              "error": None,
+              "record_count": None,
+              "seconds": None,
+              "define_projection": False,
+              "metrics": None}
+    started = time.time()
+    tool = None
+    try:
+        tool = Ascii2Shp(**keyword_args)
+        tool._validate_parameters()
+        tool._convert()
+        if tool.coordinate_system is not None:
+            timer = tool._start_timer()
+            if not tool._write_projection_file():
+                result["define_projection"] = True
+            tool._stop_timer("projection", timer)
+        result["record_count"] = tool.record_count
+        result["succeeded"] = True
+    except MarineError as e:
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = e.__class__.__name__ + ": " + str(e)
+    result["seconds"] = time.time() - started
+    if tool is not None:
+        tool._finish_metrics(result["succeeded"])
+        result["metrics"] = tool.metrics
+    return result
+
+
+class BatchAscii2Shp(MarineTool):
+    """Converts many text files to shapefiles in one session. The ArcGIS licensing, catalog refreshes and projection file lookups are done once for the whole batch rather than once per file, and the conversions run in a pool of worker processes.
+
+    The manifest keyword argument is a list of (input_textfile, output_shapefile) or (input_textfile, output_shapefile, options) tuples, where options is a dictionary of any other Ascii2Shp keyword arguments. The optional common_options dictionary supplies defaults for every job. run() returns a list with one result dictionary per job, in manifest order; if any job failed, it raises MarineError after all of the jobs have been attempted, and the results are available in job_results."""
 
-        # Define the projection.
+    def __init__(self, **keyword_args):
+        MarineTool.__init__(self, keyword_args=keyword_args)
 
-        if self.coordinate_system is not None:
-            self._log("Defining the projection of \"" + self.output_shapefile + "\"...")
-            
+        self.manifest = keyword_args.get("manifest")
+        if not isinstance(self.manifest, list) or len(self.manifest) <= 0:
+            raise MarineError("Parameter manifest must be a list of (input_textfile, output_shapefile) or (input_textfile, output_shapefile, options) tuples.", self._indent_level)
+        for entry in self.manifest:
+            if not isinstance(entry, tuple) or len(entry) < 2 or len(entry) > 3 or (len(entry) == 3 and not isinstance(entry[2], dict)):
+                raise MarineError("The manifest entry " + repr(entry) + " is not valid. Each entry must be an (input_textfile, output_shapefile) or (input_textfile, output_shapefile, options) tuple, where options is a dictionary.", self._indent_level)
+        self._log_verbose("manifest = %i jobs" % len(self.manifest))
+
+        self.common_options = keyword_args.get("common_options")
+        if self.common_options is None:
+            self.common_options = {}
+        if not isinstance(self.common_options, dict):
+            raise MarineError("Parameter common_options must be a dictionary.", self._indent_level)
+        self._log_verbose("common_options = " + repr(self.common_options))
+
+        self._parse_int_arg("batch_workers", default=1)
+        self.job_results = None
+        self._finish_init()
+
+    def _run_tool(self):
+        """Entry point for this tool."""
+
+        if self.batch_workers < 1:
+            raise MarineError("The batch_workers parameter must be 1 or more.", self._indent_level)
+
+        # Build the keyword arguments for each job. A coordinate system that
+        # is given as the path to a .prj file is read here, once, rather than
+        # by every job.
+
+        wkt_cache = {}
+        jobs = []
+        for i in range(len(self.manifest)):
+            entry = self.manifest[i]
+            keyword_args = dict(self.common_options)
+            if len(entry) == 3:
+                keyword_args.update(entry[2])
+            keyword_args["input_textfile"] = entry[0]
+            keyword_args["output_shapefile"] = entry[1]
+            keyword_args["indent_level"] = self._indent_level + 1
+            keyword_args["verbose_logging"] = self._verbose_logging
+
+            # The metrics of the jobs are written to the batch's metrics
+            # file by this process, after the jobs finish.
+
+            keyword_args.pop("metrics_file", None)
+
+            # Worker processes may not start pools of their own.
+
+            if self.batch_workers > 1:
+                keyword_args["parallel_workers"] = 1
+
+            coordinate_system = keyword_args.get("coordinate_system")
+            if coordinate_system is not None and coordinate_system.lower().endswith(".prj"):
+                if coordinate_system not in wkt_cache:
+                    wkt_cache[coordinate_system] = _get_projection_wkt(coordinate_system)
+                if wkt_cache[coordinate_system] is not None:
+                    keyword_args["coordinate_system"] = wkt_cache[coordinate_system]
+
+            jobs.append((i, keyword_args))
+
+        # Run the jobs. Jobs that use ascii2shp.exe spend their time waiting
+        # on a child process, so they run concurrently from this process
+        # rather than occupying a worker process each.
+
+        self._log("Converting %i text files with %i worker processes..." % (len(jobs), self.batch_workers))
+        exe_jobs = [job for job in jobs if str(job[1].get("engine", "native")).lower() == "ascii2shp.exe"]
+        native_jobs = [job for job in jobs if str(job[1].get("engine", "native")).lower() != "ascii2shp.exe"]
+        results = self._run_exe_jobs(exe_jobs)
+        if self.batch_workers <= 1 or len(native_jobs) <= 1:
+            results.extend(map(_run_batch_job, native_jobs))
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(self.batch_workers)
             try:
-                Geoprocessor.instance.DefineProjection_management(self.output_shapefile, self.coordinate_system)
-            except:
-                self._log_returned_geoprocessor_messages(1)
-                raise
+                results.extend(pool.imap_unordered(_run_batch_job, native_jobs))
+            finally:
+                pool.close()
+                pool.join()
+        results.sort(key=lambda r: r["index"])
+        self.job_results = results
+
+        # Add up the jobs' counters, so that the batch's metrics report its
+        # overall throughput, and write each job's metrics to the metrics
+        # file.
+
+        for r in results:
+            if r["metrics"] is not None:
+                for name, counter in r["metrics"]["counters"].items():
+                    self._add_counter(name, counter["count"], "run_tool")
+                self._write_metrics(r["metrics"])
+
+        # Refresh the catalog once per distinct directory, rather than once
+        # per shapefile. See Ascii2Shp._run_tool for why the grandparent
+        # directory is used. As there, the shapefiles that still need their
+        # projection defined must also be refreshed themselves, or
+        # DefineProjection fails, saying that they do not exist.
+
+        directories = {}
+        for r in results:
+            if r["succeeded"]:
+                if r["define_projection"]:
+                    self._GpDispatch_RefreshCatalog(r["output_shapefile"], r["output_shapefile"])
+                directories[os.path.dirname(os.path.dirname(r["output_shapefile"]))] = r["output_shapefile"]
+        for directory in sorted(directories.keys()):
+            self._GpDispatch_RefreshCatalog(directory, directories[directory])
+
+        # Define the projections that the jobs could not write directly.
+
+        for r in results:
+            if r["succeeded"] and r["define_projection"]:
+                coordinate_system = jobs[r["index"]][1]["coordinate_system"]
+                self._log("Defining the projection of \"" + r["output_shapefile"] + "\"...")
+                timer = self._start_timer()
+                try:
+                    Geoprocessor.get().DefineProjection_management(r["output_shapefile"], coordinate_system)
+                    self._log_returned_geoprocessor_messages()
+                except Exception as e:
+                    self._log_returned_geoprocessor_messages(1)
+                    r["succeeded"] = False
+                    r["error"] = "The ArcGIS DefineProjection tool failed: " + str(e)
+                self._stop_timer("projection", timer)
+
+        # Report the outcome of the batch.
+
+        failures = [r for r in results if not r["succeeded"]]
+        self._log("%i of %i conversions succeeded." % (len(results) - len(failures), len(results)))
+        if len(failures) > 0:
+            for r in failures:
+                self._log("Converting \"" + str(r["input_textfile"]) + "\" to \"" + str(r["output_shapefile"]) + "\" failed: " + str(r["error"]), "error")
+            raise MarineError("%i of the %i conversions failed. Please see the messages above for details." % (len(failures), len(results)), self._indent_level)
+
+        return results
+
+    def _run_exe_jobs(self, jobs):
+        """Runs the jobs that use ascii2shp.exe, up to batch_workers at a time, with _ProcessRunner. Returns a list of result dictionaries like those returned by _run_batch_job."""
+
+        results = []
+        tools = []
+        commands = []
+        for index, keyword_args in jobs:
+            result = {"index": index,
+                      "input_textfile": keyword_args.get("input_textfile"),
+                      "output_shapefile": keyword_args.get("output_shapefile"),
+                      "succeeded": False,
+                      "error": None,
+                      "record_count": None,
+                      "seconds": None,
+                      "define_projection": keyword_args.get("coordinate_system") is not None,
+                      "metrics": None}
+            results.append(result)
+            try:
+                tool = Ascii2Shp(**keyword_args)
+                tool._validate_parameters()
+                commands.append(tool._ascii2shp_exe_args())
+                tools.append((tool, result))
+            except MarineError as e:
+                result["error"] = str(e)
+        if len(commands) <= 0:
+            return results
+
+        def log_line(i, stream, line):
+            message = os.path.basename(tools[i][1]["input_textfile"]) + ": " + line
+            if stream == "stderr":
+                self._log(message, "warning")
+            else:
+                self._log_verbose(message)
 
-            self._log_returned_geoprocessor_messages()
+        for (tool, result), process_result in zip(tools, _ProcessRunner(log_line, max_processes=self.batch_workers).run(commands, [tool.timeout for tool, result in tools])):
+            result["seconds"] = process_result["seconds"]
+            try:
+                tool._check_ascii2shp_exe_result(process_result)
+                result["succeeded"] = True
+            except MarineError as e:
+                result["error"] = str(e)
+
+            # The processes ran concurrently, so only their wall clock time
+            # is known.
+
+            if process_result["seconds"] is not None:
+                tool._record_phase("conversion", process_result["seconds"], None)
+            tool._finish_metrics(result["succeeded"])
+            result["metrics"] = tool.metrics
+        return results
 
 
 def main():
     """Entry point for this tool when invoked from the command line."""
 
-    verbose_logging=(sys.argv[13] is not None and sys.argv[13].lower() == "true")
+    # verbose_logging is parameter 13. It and the parameters after it may be
+    # omitted.
+
+    verbose_logging=(len(sys.argv) > 13 and sys.argv[13].lower() == "true")
     
     try:
         t = Ascii2Shp(from_command_line=1, verbose_logging=verbose_logging)
         return t.run()
     except:
         if verbose_logging:
-            msg_list = traceback.format_exception(sys.exc_type, sys.exc_value, sys.exc_traceback)
+            msg_list = traceback.format_exception(*sys.exc_info())
             msg = ""
             for m in msg_list:
                 msg = msg + m
-            Geoprocessor.instance.AddError(msg)
+            Geoprocessor.get().AddError(msg)
         raise
 
     logger.shutdown()
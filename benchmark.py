@@ -0,0 +1,372 @@
+"""benchmark.py - benchmarks for sequences.py and ascii2shp.py
+
+Measures how long each module takes to import in a fresh interpreter, which
+every worker process of a pool pays when it starts, and checks that importing
+it has no side effects such as printing. Then times the hot paths of both
+modules on synthetic data: validating, packing, adding, reverse complementing
+and transcribing random reads, and converting a random point file to a
+shapefile with a local geoprocessor in place of ArcGIS. Each benchmark
+reports its throughput and the peak memory Python allocated while it ran.
+
+The results can be written as JSON and compared with an earlier run, the
+baseline, to detect regressions. The synthetic data depends only on the
+parameters and the seed, so runs with the same parameters are comparable.
+
+Usage: python benchmark.py [--repeat N] [--json results.json]
+                           [--baseline baseline.json] [--tolerance F]
+                           [--only imports|sequences|conversion]
+                           [--reads N] [--read-length N] [--rows N]
+                           [--attribute-columns N] [--delimiter NAME]
+                           [--quote NAME] [--seed N]
+
+The exit status is 1 if any benchmark regressed compared with the baseline.
+"""
+
+import argparse
+import contextlib
+import functools
+import gc
+import io
+import json
+import operator
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+MODULES = ["sequences", "ascii2shp"]
+
+SECTIONS = ["imports", "sequences", "conversion"]
+
+# Each conversion benchmark converts the same point file with these extra
+# Ascii2Shp parameters.
+
+CONVERSIONS = [("convert", {}),
+               ("convert_memory_map", {"memory_map": True}),
+               ("convert_attributes", {"attribute_columns": "all"}),
+               ("convert_parallel", {"parallel_workers": 2})]
+
+DELIMITERS = {"comma": ",", "tab": "\t", "space": " ", "semicolon": ";", "pipe": "|"}
+
+QUOTES = {"none": None, "double": "\"", "single": "'"}
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Run in the child interpreter. The import time is printed on the last line,
+# after anything the module itself printed.
+
+_IMPORT_SCRIPT = """import time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print()
+print(repr(elapsed))
+"""
+
+
+def bench_import(module, repeat=10):
+    """Imports module in repeat fresh interpreters and returns a dictionary of the import times in seconds and whether the module wrote anything to stdout or stderr while being imported. A first, untimed import makes sure the module's bytecode is cached."""
+
+    command = [sys.executable, "-c", _IMPORT_SCRIPT.format(module=module)]
+    subprocess.run(command, cwd=_DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    seconds = []
+    output = ""
+    for i in range(repeat):
+        process = subprocess.run(command, cwd=_DIRECTORY, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        lines = process.stdout.split("\n")
+        seconds.append(float(lines[-2]))
+        output = output + "\n".join(lines[:-3]) + process.stderr
+    return {"seconds": seconds,
+            "min_seconds": min(seconds),
+            "median_seconds": statistics.median(seconds),
+            "side_effects": output}
+
+
+def random_reads(count, length, alphabet="ACGT", n_fraction=0.0, seed=0):
+    """Returns count random reads of length bases each, as str, with the bases drawn uniformly from alphabet. If n_fraction is greater than 0, that fraction of the bases are N instead. The reads depend only on the arguments."""
+
+    rng = random.Random(seed)
+    letters = list(alphabet)
+    weights = None
+    if n_fraction > 0:
+        letters.append("N")
+        weights = [(1.0 - n_fraction) / len(alphabet)] * len(alphabet) + [n_fraction]
+    return ["".join(rng.choices(letters, weights, k=length)) for i in range(count)]
+
+
+def write_point_file(path, rows, attribute_columns=4, delimiter=",", quote_character=None, z=True, seed=0):
+    """Writes a delimited text file with a header line and rows random points: x and y columns in decimal degrees and, if z is true, a z column, followed by attribute_columns columns of integers, decimals, ISO dates and text, in turn. If quote_character is not None, the text values are quoted and contain the delimiter. The file depends only on the arguments. Returns the list of column names."""
+
+    rng = random.Random(seed)
+    kinds = ["integer", "decimal", "date", "text"]
+    names = ["x", "y"]
+    if z:
+        names.append("z")
+    names.extend(["%s%i" % (kinds[i % len(kinds)], i + 1) for i in range(attribute_columns)])
+
+    f = open(path, "w", newline="")
+    try:
+        f.write(delimiter.join(names) + "\n")
+        lines = []
+        for i in range(rows):
+            values = ["%.6f" % rng.uniform(-180.0, 180.0), "%.6f" % rng.uniform(-90.0, 90.0)]
+            if z:
+                values.append("%.2f" % rng.uniform(-5000.0, 0.0))
+            for j in range(attribute_columns):
+                kind = kinds[j % len(kinds)]
+                if kind == "integer":
+                    values.append(str(rng.randrange(-100000, 100000)))
+                elif kind == "decimal":
+                    values.append("%.3f" % rng.uniform(0.0, 1000.0))
+                elif kind == "date":
+                    values.append("%04i-%02i-%02i" % (rng.randrange(1990, 2030), rng.randrange(1, 13), rng.randrange(1, 29)))
+                elif quote_character is None:
+                    values.append("station_%i" % rng.randrange(10000))
+                else:
+                    values.append(quote_character + "station" + delimiter + "%i" % rng.randrange(10000) + quote_character)
+            lines.append(delimiter.join(values))
+            if len(lines) >= 10000:
+                f.write("\n".join(lines) + "\n")
+                lines = []
+        if len(lines) > 0:
+            f.write("\n".join(lines) + "\n")
+    finally:
+        f.close()
+    return names
+
+
+def _measure(function, repeat, items, unit, setup=None):
+    """Calls function repeat times and returns a dictionary of the times in seconds, the throughput in units per second, where each call processes items units, and the peak memory that tracemalloc saw Python allocate during one more, untimed call. setup, if given, is called before each call of function, outside of the timings."""
+
+    seconds = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    best = min(seconds)
+    return {"seconds": seconds,
+            "min_seconds": best,
+            "median_seconds": statistics.median(seconds),
+            "items": items,
+            "unit": unit,
+            "per_second": items / best if best > 0 else None,
+            "peak_bytes": peak_bytes}
+
+
+def bench_sequences(count=10000, length=150, repeat=10, seed=0):
+    """Times the hot paths of sequences.py on count random reads of length bases and returns a dictionary mapping the name of each benchmark to its _measure() results. Throughputs are in bases per second."""
+
+    from sequences import DNASequence, RNASequence, Sequence, SequenceBatch, find_invalid
+
+    dna_strings = random_reads(count, length, "ACGT", seed=seed)
+    rna_strings = random_reads(count, length, "ACGU", seed=seed + 1)
+    plain = [Sequence(s) for s in dna_strings]
+    dna = [DNASequence(s) for s in dna_strings]
+    batch = SequenceBatch(dna)
+    bases = count * length
+
+    benchmarks = [("validate_dna", lambda: find_invalid(dna_strings, DNASequence)),
+                  ("validate_rna", lambda: find_invalid(rna_strings, RNASequence)),
+                  ("pack", lambda: [DNASequence(s) for s in dna_strings]),
+                  ("pack_batch", lambda: SequenceBatch.from_strings(dna_strings)),
+                  ("add", lambda: [a + b for a, b in zip(plain[0::2], plain[1::2])]),
+                  ("add_packed", lambda: [(a + b).materialize() for a, b in zip(dna[0::2], dna[1::2])]),
+                  ("concatenate", lambda: functools.reduce(operator.add, dna).materialize()),
+                  ("reverse_complement", lambda: [s.reverse_complement() for s in dna]),
+                  ("reverse_complement_batch", batch.reverse_complement),
+                  ("transcribe", lambda: [s.transcribe() for s in dna]),
+                  ("transcribe_batch", batch.transcribe)]
+
+    results = {}
+    for name, function in benchmarks:
+        results[name] = _measure(function, repeat, bases, "bases")
+    return results
+
+
+@contextlib.contextmanager
+def _local_geoprocessor():
+    """Context manager that makes ascii2shp use a LocalGeoprocessor, so that conversions do not need ArcGIS, and restores the previous backend afterwards."""
+
+    from ascii2shp import Geoprocessor, LocalGeoprocessor
+
+    backend = Geoprocessor.backend
+    Geoprocessor.set_backend(LocalGeoprocessor)
+    try:
+        yield
+    finally:
+        Geoprocessor.set_backend(backend)
+
+
+def _conversion_options(delimiter, quote_character):
+    """Returns the Ascii2Shp delimiter and quote_character parameters that read files written by write_point_file() with delimiter and quote_character."""
+
+    if delimiter == ",":
+        options = {"delimiter": "comma"}
+    elif delimiter == " " or delimiter == "\t":
+        options = {"delimiter": "space or tab"}
+    else:
+        options = {"delimiter": "user specified", "delimiter_character": delimiter}
+    if quote_character == "\"":
+        options["quote_character"] = "double quote"
+    elif quote_character == "'":
+        options["quote_character"] = "single quote"
+    return options
+
+
+def bench_conversion(path, rows, repeat=10, options=None, delimiter=",", quote_character=None, z=True):
+    """Times Ascii2Shp converting path, a file of rows points written by write_point_file(), to a shapefile with a LocalGeoprocessor, and returns the _measure() results. Throughput is in rows per second; bytes_per_second is also given. options is a dictionary of extra Ascii2Shp parameters. Peak memory does not include worker processes."""
+
+    from ascii2shp import Ascii2Shp
+
+    output_shapefile = os.path.splitext(path)[0] + "_benchmark.shp"
+    output_base = os.path.splitext(output_shapefile)[0]
+    parameters = _conversion_options(delimiter, quote_character)
+    parameters.update({"input_textfile": path, "output_shapefile": output_shapefile, "xcol": "x", "ycol": "y"})
+    if z:
+        parameters["zcol"] = "z"
+    if options is not None:
+        parameters.update(options)
+
+    def remove_output():
+        for extension in [".shp", ".shx", ".dbf", ".prj", ".qix", ".a2s"]:
+            if os.path.isfile(output_base + extension):
+                os.remove(output_base + extension)
+
+    def convert():
+        # The tool logs every step to stdout.
+        with contextlib.redirect_stdout(io.StringIO()):
+            Ascii2Shp(**parameters).run()
+
+    try:
+        with _local_geoprocessor():
+            result = _measure(convert, repeat, rows, "rows", remove_output)
+    finally:
+        remove_output()
+    result["bytes_per_second"] = os.path.getsize(path) / result["min_seconds"] if result["min_seconds"] > 0 else None
+    return result
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compares results with baseline, the results of an earlier run, and returns a list of (section, name, measure, baseline value, value) tuples, one for each min_seconds or peak_bytes that grew by more than the fraction tolerance. Benchmarks that are not in both are skipped."""
+
+    regressions = []
+    for section in SECTIONS:
+        for name in sorted(results.get(section, {})):
+            if name not in baseline.get(section, {}):
+                continue
+            for measure in ["min_seconds", "peak_bytes"]:
+                old = baseline[section][name].get(measure)
+                new = results[section][name].get(measure)
+                if old and new is not None and new > old * (1.0 + tolerance):
+                    regressions.append((section, name, measure, old, new))
+    return regressions
+
+
+def _print_table(title, section):
+    print("%-26s %12s %12s %18s %10s" % (title, "min (ms)", "median (ms)", "throughput", "peak (MB)"))
+    for name in sorted(section):
+        r = section[name]
+        print("%-26s %12.1f %12.1f %12.3g %-5s %10.1f" % (name, 1000 * r["min_seconds"], 1000 * r["median_seconds"], r["per_second"] or 0, r["unit"] + "/s", r["peak_bytes"] / 1048576.0))
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks sequences.py and ascii2shp.py.")
+    parser.add_argument("--repeat", type=int, default=10, help="number of times to repeat each measurement (default 10)")
+    parser.add_argument("--json", help="file to write the results to, as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fraction by which a time or peak memory may exceed the baseline before it is reported as a regression (default 0.1)")
+    parser.add_argument("--only", action="append", choices=SECTIONS, help="run only these benchmarks (may be repeated)")
+    parser.add_argument("--reads", type=int, default=10000, help="number of random reads (default 10000)")
+    parser.add_argument("--read-length", type=int, default=150, help="length of the random reads (default 150)")
+    parser.add_argument("--rows", type=int, default=100000, help="number of points in the point file (default 100000)")
+    parser.add_argument("--attribute-columns", type=int, default=4, help="number of attribute columns in the point file (default 4)")
+    parser.add_argument("--delimiter", choices=sorted(DELIMITERS), default="comma", help="delimiter of the point file (default comma)")
+    parser.add_argument("--quote", choices=sorted(QUOTES), default="none", help="quote character of the text columns of the point file (default none)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data (default 0)")
+    args = parser.parse_args(argv)
+
+    sections = args.only if args.only is not None else SECTIONS
+    delimiter = DELIMITERS[args.delimiter]
+    quote_character = QUOTES[args.quote]
+    results = {"python": sys.version,
+               "parameters": {"repeat": args.repeat, "reads": args.reads, "read_length": args.read_length, "rows": args.rows, "attribute_columns": args.attribute_columns, "delimiter": args.delimiter, "quote": args.quote, "seed": args.seed}}
+
+    baseline = None
+    if args.baseline is not None:
+        f = open(args.baseline)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+
+        # Throughputs are only comparable on the same data.
+
+        for key in sorted(results["parameters"]):
+            if key != "repeat" and key in baseline.get("parameters", {}) and baseline["parameters"][key] != results["parameters"][key]:
+                parser.error("The baseline was run with %s = %r, not %r. Run with the same data parameters as the baseline." % (key.replace("_", "-"), baseline["parameters"][key], results["parameters"][key]))
+
+    if "imports" in sections:
+        results["imports"] = {}
+        print("%-12s %12s %12s  %s" % ("import", "min (ms)", "median (ms)", "side effects"))
+        for module in MODULES:
+            r = bench_import(module, args.repeat)
+            results["imports"][module] = r
+            print("%-12s %12.1f %12.1f  %s" % (module, 1000 * r["min_seconds"], 1000 * r["median_seconds"], "none" if not r["side_effects"] else repr(r["side_effects"][:60])))
+        print()
+
+    if "sequences" in sections:
+        results["sequences"] = bench_sequences(args.reads, args.read_length, args.repeat, args.seed)
+        _print_table("sequences", results["sequences"])
+
+    if "conversion" in sections:
+        directory = tempfile.mkdtemp(prefix="benchmark")
+        try:
+            path = os.path.join(directory, "points.txt")
+            write_point_file(path, args.rows, args.attribute_columns, delimiter, quote_character, seed=args.seed)
+            results["conversion"] = {}
+            for name, options in CONVERSIONS:
+                results["conversion"][name] = bench_conversion(path, args.rows, args.repeat, options, delimiter, quote_character)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        _print_table("conversion", results["conversion"])
+
+    if baseline is not None:
+        results["regressions"] = compare(results, baseline, args.tolerance)
+        if len(results["regressions"]) > 0:
+            print("Regressions compared with %s (tolerance %g%%):" % (args.baseline, 100 * args.tolerance))
+            for section, name, measure, old, new in results["regressions"]:
+                print("  %s.%s %s: %.6g -> %.6g (%+.1f%%)" % (section, name, measure, old, new, 100.0 * (new - old) / old))
+        else:
+            print("No regressions compared with %s (tolerance %g%%)." % (args.baseline, 100 * args.tolerance))
+
+    if args.json is not None:
+        f = open(args.json, "w")
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main().get("regressions") else 0)
@@ -1,56 +1,1301 @@
+import gzip
+import heapq
+import itertools
+import mmap
+import operator
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left,bisect_right
+
+# Packed storage: 2 bits per base, 4 bases per byte with the first base in the
+# most significant bits. A/C/G/T(U) are coded 0/1/2/3 so the complement of a
+# code is 3 - code, i.e. every bit flipped. Unused bits in the last byte are 0.
+
+_CODES = bytes({'C':1,'G':2,'T':3,'U':3}.get(chr(i),0) for i in range(256))
+_SHIFTS = [bytes((i << (6 - 2 * k)) & 0xFF for i in range(256)) for k in range(4)]
+_REVERSE_COMPLEMENT = bytes(sum((3 - ((b >> (2 * k)) & 3)) << (6 - 2 * k) for k in range(4)) for b in range(256))
+_PHRED_DECODE = bytes(max(i - 33,0) for i in range(256))
+_PHRED_ENCODE = bytes(min(i,93) + 33 for i in range(256))
+_MASK_COMPLEMENT = dict(zip('NRYSWKMBDHV','NYRSWMKVHDB'))
+_INVALID_PATTERNS = {}
+
+IUPAC_CODES = 'RYSWKMBDHV'
+
+class SequenceValidationError(ValueError):
+    """Raised when sequences contain letters outside their alphabet. errors maps the index of each invalid sequence to the positions of its invalid letters"""
+    def __init__(self,message,errors):
+        ValueError.__init__(self,message)
+        self.errors = errors
+
+def find_invalid(sequences,sequence_class,iupac=False):
+    """Checks a list of str sequences against the alphabet of sequence_class, optionally with the IUPAC ambiguity codes. Returns a dict mapping the index of each invalid sequence to the positions of its invalid letters, which is empty if they are all valid"""
+    alphabet = sequence_class.alphabet
+    if iupac:
+        alphabet += IUPAC_CODES
+    alphabet = alphabet.encode('ascii')
+    # Check all of the sequences with one table lookup, and only look for
+    # the positions if something failed
+    buffer = b''.join([sequence.encode('ascii','replace') for sequence in sequences])
+    if not buffer.translate(None,alphabet):
+        return {}
+    offsets = [0] + list(itertools.accumulate(len(sequence) for sequence in sequences))
+    if alphabet not in _INVALID_PATTERNS:
+        _INVALID_PATTERNS[alphabet] = re.compile(b'[^' + alphabet + b']')
+    errors = {}
+    for match in _INVALID_PATTERNS[alphabet].finditer(buffer):
+        i = bisect_right(offsets,match.start()) - 1
+        errors.setdefault(i,[]).append(match.start() - offsets[i])
+    return errors
+
+def _validation_error(sequence_class,errors,names=None):
+    descriptions = []
+    for i in sorted(errors)[:5]:
+        name = names[i] if names is not None and names[i] is not None else 'sequence {}'.format(i)
+        positions = ', '.join(str(position) for position in errors[i][:10])
+        if len(errors[i]) > 10:
+            positions += ' and {} more'.format(len(errors[i]) - 10)
+        descriptions.append('{} has invalid letters at {}'.format(name,positions))
+    if len(errors) > 5:
+        descriptions.append('{} more sequences are invalid'.format(len(errors) - 5))
+    return SequenceValidationError("Not valid {}: {}".format(sequence_class.__name__,'; '.join(descriptions)),errors)
+_UNPACK_TABLES = {}
+
+def _pack(sequence):
+    """Packs a str of bases into bytes. Returns (packed,mask) where mask is a tuple of (start,length,letter) runs of the bases that are not A, C, G, T or U."""
+    raw = sequence.encode('ascii')
+    mask = ()
+    if raw.translate(None,b'ACGTU'):
+        mask = tuple((m.start(),m.end() - m.start(),m.group(1).decode('ascii')) for m in re.finditer(br'([^ACGTU])\1*',raw))
+    codes = raw.translate(_CODES)
+    size = (len(codes) + 3) // 4
+    codes = codes + b'\x00' * (size * 4 - len(codes))
+    value = 0
+    for k in range(4):
+        value += int.from_bytes(codes[k::4].translate(_SHIFTS[k]),'big')
+    return value.to_bytes(size,'big'),mask
+
+def _unpack_bytes(packed,length,letters):
+    """Returns a bytearray with one byte per base, using the characters of letters for codes 0-3"""
+    if letters not in _UNPACK_TABLES:
+        _UNPACK_TABLES[letters] = [bytes(ord(letters[(b >> (6 - 2 * k)) & 3]) for b in range(256)) for k in range(4)]
+    tables = _UNPACK_TABLES[letters]
+    out = bytearray(len(packed) * 4)
+    for k in range(4):
+        out[k::4] = packed.translate(tables[k])
+    del out[length:]
+    return out
+
+def _unpack(packed,length,mask,letters):
+    """Inverse of _pack(): returns the str of bases, using letters for codes 0-3."""
+    out = _unpack_bytes(packed,length,letters)
+    for start,run,letter in mask:
+        out[start:start + run] = letter.encode('ascii') * run
+    return out.decode('ascii')
+
+def _packed_to_int(packed,length):
+    return int.from_bytes(packed,'big') >> (2 * (-length % 4))
+
+def _int_to_packed(value,length):
+    return (value << (2 * (-length % 4))).to_bytes((length + 3) // 4,'big')
+
+def _join_packed(pieces):
+    """Joins a list of (packed,length) pairs without unpacking them. Their values are shifted together in pairs, then pairs of pairs and so on, so that each round costs time linear in the total length"""
+    values = [(_packed_to_int(packed,length),length) for packed,length in pieces]
+    while len(values) > 1:
+        joined = [((a << (2 * n)) | b,m + n) for (a,m),(b,n) in zip(values[0::2],values[1::2])]
+        if len(values) % 2:
+            joined.append(values[-1])
+        values = joined
+    return _int_to_packed(*values[0])
+
+def _reverse_complement_mask(mask,length):
+    return tuple((length - start - run,run,_MASK_COMPLEMENT.get(letter,letter)) for start,run,letter in reversed(mask))
+
+def _align_left(packed,length):
+    """Moves the bases of a packed sequence whose padding is at the front, as left by reversing it, back to the start."""
+    return _int_to_packed(int.from_bytes(packed,'big') & ((1 << (2 * length)) - 1),length)
+
+def _slice_packed(packed,start,stop):
+    """Returns the packed bases from start to stop, reading only the bytes that hold them"""
+    first = start // 4
+    chunk = packed[first:(stop + 3) // 4]
+    if start % 4 == 0 and stop % 4 == 0:
+        return chunk
+    value = int.from_bytes(chunk,'big') >> (2 * (len(chunk) * 4 - (stop - first * 4)))
+    return _int_to_packed(value & ((1 << (2 * (stop - start))) - 1),stop - start)
+
+def _slice_mask(mask,start,stop):
+    if start >= stop:
+        return ()
+    return tuple((max(s,start) - start,min(s + run,stop) - max(s,start),letter) for s,run,letter in mask if s < stop and s + run > start)
+
+def _quality_bytes(quality,length):
+    """Returns per-base Phred scores: quality itself if it is already bytes, otherwise length copies of the number"""
+    if isinstance(quality,bytes):
+        return quality
+    return bytes([min(max(int(round(quality)),0),255)]) * length
+
+def _concat_quality(quality,length,other,other_length):
+    if isinstance(quality,bytes) or isinstance(other,bytes):
+        return _quality_bytes(quality,length) + _quality_bytes(other,other_length)
+    if length + other_length == 0:
+        return 0
+    return (length * quality + other_length * other) / (length + other_length)
+
+# Translation: codons are indexed by their base codes, 16 * first + 4 * second
+# + third, with masked bases coded 4 so that any codon holding one maps past
+# the 64 real codons to X
+
+_CODE_LETTERS = '\x00\x01\x02\x03'
+_CODON_SHIFTS = [bytes(code << shift if code < 4 else 0x40 for code in range(256)) for shift in (4,2,0)]
+_TRANSLATION_TABLES = {}
+
+# NCBI genetic codes by table number: the amino acid of each codon, with the
+# codons in TCAG order (TTT, TTC, TTA, TTG, TCT, ...)
+GENETIC_CODES = {
+    1:'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG', # standard
+    2:'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG', # vertebrate mitochondrial
+    3:'FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG', # yeast mitochondrial
+    4:'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG', # mold, protozoan and mycoplasma
+    5:'FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG', # invertebrate mitochondrial
+    6:'FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG', # ciliate nuclear
+    11:'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG', # bacterial and plant plastid
+}
+
+def _translation_table(table):
+    """Returns a bytes.translate() table from codon index to amino acid letter for a genetic code"""
+    if table not in _TRANSLATION_TABLES:
+        if table not in GENETIC_CODES:
+            raise ValueError('Unknown genetic code {}, expected one of {}'.format(table,sorted(GENETIC_CODES)))
+        aminos = bytearray(b'X' * 256)
+        for codon in range(64):
+            ncbi = sum(4 ** (2 - k) * 'TCAG'.index('ACGT'[(codon >> (4 - 2 * k)) & 3]) for k in range(3))
+            aminos[codon] = ord(GENETIC_CODES[table][ncbi])
+        _TRANSLATION_TABLES[table] = bytes(aminos)
+    return _TRANSLATION_TABLES[table]
+
+def _masked_codes(packed,length,mask):
+    """Returns a bytearray of the base codes, with 4 for masked bases"""
+    codes = _unpack_bytes(packed,length,_CODE_LETTERS)
+    for start,run,letter in mask:
+        codes[start:start + run] = b'\x04' * run
+    return codes
+
+def _translate_codons(first,second,third,table):
+    """Returns the amino acids, as bytes, of the codons whose bases are given by three equal-length byte strings of codes. The codon indexes are combined with big integer operations and looked up with one table translation, instead of a dict lookup for each codon"""
+    if not first:
+        return b''
+    index = int.from_bytes(first.translate(_CODON_SHIFTS[0]),'big') | int.from_bytes(second.translate(_CODON_SHIFTS[1]),'big') | int.from_bytes(third.translate(_CODON_SHIFTS[2]),'big')
+    return index.to_bytes(len(first),'big').translate(_translation_table(table))
+
 class Sequence():
-    """Nucleic acid sequence data class"""
-    def __init__(self,sequence='',quality=0):
+    """Nucleic acid sequence data class. quality is either one number for the whole sequence or bytes holding the Phred score of each base"""
+    __slots__ = ('_sequence','quality','name')
+
+    def __init__(self,sequence='',quality=0,name=None):
         self.sequence=sequence
         self.quality=quality
-    
+        self.name=name
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @sequence.setter
+    def sequence(self,value):
+        self._sequence=value
+
+    def __len__(self):
+        return len(self._sequence)
+
+    def __getitem__(self,key):
+        if not isinstance(key,slice):
+            return self.sequence[key]
+        quality = self.quality
+        if isinstance(quality,bytes):
+            quality = quality[key]
+        return Sequence(self.sequence[key],quality,self.name)
+
     def __add__(self,other):
         result = Sequence()
+        result.name = None
         result.sequence = self.sequence + other.sequence
-        result.quality = (len(self.sequence) * self.quality + len(other.sequence) * other.quality) / (len(self.sequence) + len(other.sequence))
+        result.quality = _concat_quality(self.quality,len(self),other.quality,len(other))
         return result
 
     def __str__(self): #magic method, interacts with print function
-        return 'Sequence: {}\nQuality: {}'.format(self.sequence,self.quality)
+        quality = self.quality
+        if isinstance(quality,bytes):
+            quality = quality.translate(_PHRED_ENCODE).decode('ascii')
+        return 'Sequence: {}\nQuality: {}'.format(self.sequence,quality)
+
+    def mean_quality(self):
+        if isinstance(self.quality,bytes):
+            return sum(self.quality) / len(self.quality) if self.quality else 0
+        return self.quality
+
+    def min_quality(self):
+        if isinstance(self.quality,bytes):
+            return min(self.quality) if self.quality else 0
+        return self.quality
+
+    def trim(self,threshold=20,window=4):
+        """Cuts the sequence at the start of the first window of bases whose mean quality is below threshold"""
+        quality = self.quality
+        if not isinstance(quality,bytes):
+            return self if quality >= threshold else self[:0]
+        if len(quality) < window:
+            return self if self.mean_quality() >= threshold else self[:0]
+        # Window sums from prefix sums, compared all at once
+        sums = [0] + list(itertools.accumulate(quality))
+        low = list(map(operator.lt,map(operator.sub,sums[window:],sums[:-window]),itertools.repeat(threshold * window)))
+        if True not in low:
+            return self
+        return self[:low.index(True)]
+
+class PackedSequence(Sequence):
+    """Sequence stored 2 bits per base. Bases that are not in the 4-letter alphabet (N and, if iupac is true, the other IUPAC ambiguity codes) are stored as A and listed in a mask of (start,length,letter) runs. Invalid letters raise SequenceValidationError"""
+    __slots__ = ('_length','_mask')
+    letters = 'ACGT'
+    alphabet = 'ACGTN'
+
+    @property
+    def sequence(self):
+        return _unpack(self._sequence,self._length,self._mask,self.letters)
 
-class DNASequence(Sequence):
+    @sequence.setter
+    def sequence(self,value):
+        self._sequence,self._mask = _pack(value)
+        self._length = len(value)
+
+    @classmethod
+    def _from_packed(cls,packed,length,mask,quality,name=None):
+        """Makes a sequence from packed bases without validating them"""
+        result = cls.__new__(cls)
+        result._sequence = packed
+        result._length = length
+        result._mask = mask
+        result.quality = quality
+        result.name = name
+        return result
+
+    def __init__(self,sequence='',quality=0,name=None,iupac=False):
+        errors = find_invalid([sequence],type(self),iupac)
+        if errors:
+            raise _validation_error(type(self),errors,[name])
+        if isinstance(quality,bytes) and len(quality) != len(sequence):
+            raise ValueError('The sequence {} has {} bases but {} quality scores'.format(name,len(sequence),len(quality)))
+        Sequence.__init__(self,sequence,quality,name)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self,key):
+        if not isinstance(key,slice):
+            if key < 0:
+                key += self._length
+            if not 0 <= key < self._length:
+                raise IndexError('sequence index out of range')
+            return self[key:key + 1].sequence
+        start,stop,step = key.indices(self._length)
+        if step != 1:
+            return type(self)(self.sequence[key],self.quality[key] if isinstance(self.quality,bytes) else self.quality,self.name,True)
+        stop = max(start,stop)
+        quality = self.quality
+        if isinstance(quality,bytes):
+            quality = quality[start:stop]
+        return self._from_packed(_slice_packed(self._sequence,start,stop),stop - start,_slice_mask(self._mask,start,stop),quality,self.name)
+
+    def __add__(self,other):
+        # Sequences of the same class are joined lazily, see SequenceRope
+        if type(other) is not type(self) and not (isinstance(other,SequenceRope) and other.sequence_class is type(self)):
+            return Sequence.__add__(self,other)
+        return SequenceRope([self],type(self)) + other
+
+    def reverse_complement(self):
+        # Reversing the bytes and the 4 codes within each byte reverses the
+        # bases; the table flips the bits at the same time to complement them.
+        # The padding of the last byte ends up at the front and is shifted out.
+        length = self._length
+        packed = self._sequence[::-1].translate(_REVERSE_COMPLEMENT)
+        if length % 4:
+            packed = _align_left(packed,length)
+        quality = self.quality
+        if isinstance(quality,bytes):
+            quality = quality[::-1]
+        return self._from_packed(packed,length,_reverse_complement_mask(self._mask,length),quality,self.name)
+
+    def translate(self,table=1,frame=0,to_stop=False):
+        """Returns the protein, as a str, coded from frame (0, 1 or 2) onwards using an NCBI genetic code table from GENETIC_CODES. Codons with N or ambiguous bases give X and stop codons *; with to_stop true the protein ends before the first stop codon"""
+        codes = _masked_codes(self._sequence,self._length,self._mask)
+        stop = frame + (self._length - frame) // 3 * 3
+        protein = _translate_codons(codes[frame:stop:3],codes[frame + 1:stop:3],codes[frame + 2:stop:3],table).decode('ascii')
+        if to_stop:
+            protein = protein.split('*',1)[0]
+        return protein
+
+class DNASequence(PackedSequence):
     """DNA-specific sequence"""
-    def __init__(self,sequence='',quality=0):
-        print(sequence)
-        if set(sequence) <= {'A','C','G','T'}:
-            Sequence.__init__(self,sequence,quality)
+    __slots__ = ()
+
+    def transcribe(self):
+        # T and U have the same code, so the packed bases are shared as is
+        return RNASequence._from_packed(self._sequence,self._length,self._mask,self.quality,self.name)
+
+class RNASequence(PackedSequence):
+    """RNA sequence"""
+    __slots__ = ()
+    letters = 'ACGU'
+    alphabet = 'ACGUN'
+
+class SequenceRope(Sequence):
+    """Lazy concatenation of packed sequences, returned by adding them together. The pieces are kept in a list that is shared by the ropes made from it and only appended to, so adding a piece to the end of a rope costs O(1). The contiguous sequence is only built when it is needed. Indexing and slicing take O(log n) in the number of pieces"""
+    __slots__ = ('sequence_class','_pieces','_offsets','_start','_stop','_materialized')
+
+    def __init__(self,pieces=(),sequence_class=DNASequence):
+        self.sequence_class = sequence_class
+        self.name = None
+        self._pieces = []
+        self._offsets = array('q',[0]) # where each piece starts, then the total length
+        self._start = 0
+        self._stop = 0
+        self._materialized = None
+        for piece in pieces:
+            self._append(piece)
+
+    def _append(self,piece):
+        if len(piece):
+            self._pieces.append(piece)
+            self._offsets.append(self._offsets[-1] + len(piece))
+        self._stop = self._offsets[-1]
+
+    def _view(self,start,stop):
+        result = SequenceRope((),self.sequence_class)
+        result._pieces = self._pieces
+        result._offsets = self._offsets
+        result._start = start
+        result._stop = stop
+        return result
+
+    def _view_pieces(self):
+        """Returns the pieces of this rope, with the first and last cut down to its ends"""
+        if self._start >= self._stop:
+            return []
+        first = bisect_right(self._offsets,self._start) - 1
+        last = bisect_right(self._offsets,self._stop - 1) - 1
+        pieces = self._pieces[first:last + 1]
+        pieces[-1] = pieces[-1][:self._stop - self._offsets[last]]
+        pieces[0] = pieces[0][self._start - self._offsets[first]:]
+        return pieces
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self,key):
+        if not isinstance(key,slice):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('sequence index out of range')
+            position = self._start + key
+            i = bisect_right(self._offsets,position) - 1
+            return self._pieces[i][position - self._offsets[i]]
+        start,stop,step = key.indices(len(self))
+        if step != 1:
+            return self.materialize()[key]
+        return self._view(self._start + start,self._start + max(start,stop))
+
+    def __add__(self,other):
+        if isinstance(other,SequenceRope) and other.sequence_class is self.sequence_class:
+            pieces = other._view_pieces()
+        elif type(other) is self.sequence_class:
+            pieces = [other]
         else:
-            print("The input sequence isn't valid DNA input")
+            return Sequence.__add__(self,other)
+        # Extend the shared list in place if this rope ends at its end;
+        # otherwise another rope has already been extended from here
+        if self._stop == self._offsets[-1]:
+            result = self._view(self._start,self._stop)
+        else:
+            result = SequenceRope(self._view_pieces(),self.sequence_class)
+        for piece in pieces:
+            result._append(piece)
+        return result
+
+    def materialize(self):
+        """Returns the contiguous sequence, building it the first time"""
+        if self._materialized is None:
+            pieces = self._view_pieces()
+            if len(pieces) == 1:
+                self._materialized = pieces[0]
+            else:
+                length = len(self)
+                if all(len(piece) % 4 == 0 for piece in pieces[:-1]):
+                    packed = b''.join(piece._sequence for piece in pieces)
+                else:
+                    packed = _join_packed([(piece._sequence,len(piece)) for piece in pieces])
+                # The runs are collected in a list, as concatenating the
+                # tuples piece by piece takes quadratic time
+                runs = []
+                offset = 0
+                for piece in pieces:
+                    for start,run,letter in piece._mask:
+                        start += offset
+                        if runs and runs[-1][0] + runs[-1][1] == start and runs[-1][2] == letter:
+                            runs[-1] = (runs[-1][0],runs[-1][1] + run,letter)
+                        else:
+                            runs.append((start,run,letter))
+                    offset += len(piece)
+                mask = tuple(runs)
+                if any(isinstance(piece.quality,bytes) for piece in pieces):
+                    quality = b''.join([_quality_bytes(piece.quality,len(piece)) for piece in pieces])
+                else:
+                    quality = sum(len(piece) * piece.quality for piece in pieces) / length if length else 0
+                self._materialized = self.sequence_class._from_packed(packed,length,mask,quality)
+        return self._materialized
+
+    @property
+    def sequence(self):
+        return self.materialize().sequence
+
+    @property
+    def quality(self):
+        return self.materialize().quality
 
     def reverse_complement(self):
-        rc_seq = ''
-        complement = {'A':'T','T':'A','C':'G','G':'C'}
-        for base in reversed(self.sequence):
-            rc_seq = rc_seq + complement[base]
-        return Sequence(rc_seq,self.quality)
+        return self.materialize().reverse_complement()
 
     def transcribe(self):
-        transcribed = ''.join([base if base !='T' else 'U' for base in self.sequence]) #for loop and if statement all in one line                                                                                                                          
-        return RNASequence(transcribed,self.quality)
+        return self.materialize().transcribe()
 
-class RNASequence(Sequence):
-    """RNA sequence"""
-    def __init__(self,sequence='',quality=0):
-        if set(sequence) <= {'A','C','G','U'}:
-            Sequence.__init__(self,sequence,quality)
+    def translate(self,table=1,frame=0,to_stop=False):
+        return self.materialize().translate(table,frame,to_stop)
+
+class SequenceBatch():
+    """Packed sequences of one class stored in a single buffer, so that operations run over all of them at once"""
+    __slots__ = ('sequence_class','_buffer','_starts','_lengths','_masks','_qualities','_names','_right_aligned')
+
+    def __init__(self,sequences=(),sequence_class=DNASequence):
+        # Each sequence's packed bytes are copied into the buffer as they are,
+        # so every sequence starts on a byte boundary
+        sequences = [sequence.materialize() if isinstance(sequence,SequenceRope) else sequence for sequence in sequences]
+        for sequence in sequences:
+            if type(sequence) is not sequence_class:
+                raise ValueError('All sequences in a batch must be {}, not {}'.format(sequence_class.__name__,type(sequence).__name__))
+        self.sequence_class = sequence_class
+        self._buffer = b''.join(sequence._sequence for sequence in sequences)
+        self._lengths = array('q',[sequence._length for sequence in sequences])
+        self._starts = array('q',[0] * len(sequences))
+        start = 0
+        for i,length in enumerate(self._lengths):
+            self._starts[i] = start
+            start += (length + 3) // 4
+        self._masks = [sequence._mask for sequence in sequences]
+        self._qualities = [sequence.quality for sequence in sequences]
+        self._names = [sequence.name for sequence in sequences]
+        self._right_aligned = False
+
+    @classmethod
+    def from_strings(cls,sequences,sequence_class=DNASequence,qualities=None,names=None,iupac=False):
+        """Makes a batch from str sequences, validating them all at once. Raises SequenceValidationError listing every invalid sequence"""
+        errors = find_invalid(sequences,sequence_class,iupac)
+        if errors:
+            raise _validation_error(sequence_class,errors,names)
+        if qualities is None:
+            qualities = [0] * len(sequences)
+        if names is None:
+            names = [None] * len(sequences)
+        packed = []
+        for sequence,quality,name in zip(sequences,qualities,names):
+            bases,mask = _pack(sequence)
+            packed.append(sequence_class._from_packed(bases,len(sequence),mask,quality,name))
+        return cls(packed,sequence_class)
+
+    def _copy(self,sequence_class,buffer,starts,masks,right_aligned):
+        result = SequenceBatch((),sequence_class)
+        result._buffer = buffer
+        result._starts = starts
+        result._lengths = self._lengths
+        result._masks = masks
+        result._qualities = self._qualities
+        result._names = self._names
+        result._right_aligned = right_aligned
+        return result
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __getitem__(self,i):
+        length = self._lengths[i]
+        start = self._starts[i]
+        packed = self._buffer[start:start + (length + 3) // 4]
+        if self._right_aligned and length % 4:
+            packed = _align_left(packed,length)
+        return self.sequence_class._from_packed(packed,length,self._masks[i],self._qualities[i],self._names[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def reverse_complement(self):
+        # One table translation reverse complements the whole buffer, which
+        # also reverses the order of the sequences in it and moves each one's
+        # padding to its front. The starts are updated to match and the
+        # padding is only dealt with when a sequence is taken out of the batch.
+        size = len(self._buffer)
+        starts = array('q',[size - start - (length + 3) // 4 for start,length in zip(self._starts,self._lengths)])
+        masks = [_reverse_complement_mask(mask,length) if mask else mask for mask,length in zip(self._masks,self._lengths)]
+        result = self._copy(self.sequence_class,self._buffer[::-1].translate(_REVERSE_COMPLEMENT),starts,masks,not self._right_aligned)
+        result._qualities = [quality[::-1] if isinstance(quality,bytes) else quality for quality in self._qualities]
+        return result
+
+    def transcribe(self):
+        if self.sequence_class is not DNASequence:
+            raise ValueError('Only a batch of DNASequence can be transcribed')
+        return self._copy(RNASequence,self._buffer,self._starts,self._masks,self._right_aligned)
+
+    def _codon_aminos(self,table):
+        """Returns the amino acid of the codon starting at every base of the buffer, and where the first base of each sequence is"""
+        codes = _unpack_bytes(self._buffer,4 * len(self._buffer),_CODE_LETTERS)
+        firsts = [4 * start + (-length % 4 if self._right_aligned else 0) for start,length in zip(self._starts,self._lengths)]
+        for first,mask in zip(firsts,self._masks):
+            for start,run,letter in mask:
+                codes[first + start:first + start + run] = b'\x04' * run
+        return _translate_codons(codes[:-2],codes[1:-1],codes[2:],table),firsts
+
+    def six_frames(self,table=1):
+        """Translates every sequence in all six reading frames. Returns a tuple for each sequence of its 3 forward frames then the 3 frames of its reverse complement, as protein str. Each strand is translated at every base with one pass over the buffer and the frames are sliced out of it"""
+        forward,forward_firsts = self._codon_aminos(table)
+        reverse,reverse_firsts = self.reverse_complement()._codon_aminos(table)
+        frames = []
+        for length,forward_first,reverse_first in zip(self._lengths,forward_firsts,reverse_firsts):
+            frames.append(tuple(aminos[first + frame:first + length - 2:3].decode('ascii') for aminos,first in ((forward,forward_first),(reverse,reverse_first)) for frame in range(3)))
+        return frames
+
+def _open(path,mode):
+    """Opens a file in binary mode, through gzip if it is compressed (when reading) or its name ends in .gz (when writing)"""
+    if mode == 'rb':
+        f = open(path,'rb')
+        compressed = f.read(2) == b'\x1f\x8b'
+        f.close()
+    else:
+        compressed = path.endswith('.gz')
+    if compressed:
+        return gzip.open(path,mode)
+    return open(path,mode,1 << 20)
+
+def read_fasta(path,sequence_class=DNASequence,iupac=False):
+    """Generator that yields a sequence for each record of a FASTA file, which may be gzip compressed. Only one record is held in memory at a time. Bases are upper-cased; invalid ones raise ValueError"""
+    f = _open(path,'rb')
+    try:
+        name = None
+        lines = []
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield sequence_class(b''.join(lines).decode('ascii').upper(),0,name,iupac)
+                name = line[1:].strip().decode('ascii','replace')
+                lines = []
+            elif name is not None:
+                lines.append(line.strip())
+            elif line.strip():
+                raise ValueError('{} is not a FASTA file: the first record does not start with >'.format(path))
+        if name is not None:
+            yield sequence_class(b''.join(lines).decode('ascii').upper(),0,name,iupac)
+    finally:
+        f.close()
+
+def read_fastq(path,sequence_class=DNASequence,iupac=False):
+    """Generator that yields a sequence for each record of a FASTQ file, which may be gzip compressed. The quality of each sequence is bytes holding the Phred score of each base"""
+    f = _open(path,'rb')
+    try:
+        line_number = 0
+        while True:
+            header = f.readline()
+            line_number += 1
+            if not header.strip():
+                if not header:
+                    break
+                continue
+            bases = f.readline().strip()
+            separator = f.readline()
+            scores = f.readline().strip()
+            if not header.startswith(b'@') or not separator.startswith(b'+') or len(scores) != len(bases):
+                raise ValueError('{} line {}: invalid FASTQ record'.format(path,line_number))
+            line_number += 3
+            yield sequence_class(bases.decode('ascii').upper(),scores.translate(_PHRED_DECODE),header[1:].strip().decode('ascii','replace'),iupac)
+    finally:
+        f.close()
+
+def write_fasta(path,sequences,line_width=60):
+    """Writes sequences to a FASTA file, gzip compressed if path ends in .gz. Returns the number written"""
+    count = 0
+    f = _open(path,'wb')
+    try:
+        for sequence in sequences:
+            bases = sequence.sequence.encode('ascii')
+            f.write(b'>' + (sequence.name or 'sequence{}'.format(count + 1)).encode('ascii') + b'\n')
+            for i in range(0,len(bases),line_width):
+                f.write(bases[i:i + line_width] + b'\n')
+            count += 1
+    finally:
+        f.close()
+    return count
+
+def write_fastq(path,sequences):
+    """Writes sequences to a FASTQ file, gzip compressed if path ends in .gz. If a sequence's quality is a single number, every base is given that score. Returns the number written"""
+    count = 0
+    f = _open(path,'wb')
+    try:
+        for sequence in sequences:
+            bases = sequence.sequence.encode('ascii')
+            scores = _quality_bytes(sequence.quality,len(bases)).translate(_PHRED_ENCODE)
+            f.write(b'@' + (sequence.name or 'sequence{}'.format(count + 1)).encode('ascii') + b'\n' + bases + b'\n+\n' + scores + b'\n')
+            count += 1
+    finally:
+        f.close()
+    return count
+
+# 2-bit sequence files: a header, then for each record its length, mask and
+# quality, its packed bases as stored by PackedSequence, its mask runs and its
+# per-base quality, then an index of record offsets and names. Sections are
+# padded to 8 bytes
+
+_TWOBIT_MAGIC = b'SEQ2BIT1'
+_TWOBIT_HEADER = struct.Struct('<8sQQQ') # magic, records, index offset, bytes of names
+_TWOBIT_RECORD = struct.Struct('<QQQd') # length, mask runs, bytes of quality, mean quality
+
+def _padding(size):
+    return b'\x00' * (-size % 8)
+
+def _padded(size):
+    return size + (-size % 8)
+
+def write_2bit(path,sequences):
+    """Writes packed sequences to a 2-bit file that TwoBitReader can read, keeping their masks and qualities. The format is like UCSC .2bit but not compatible with it. Returns the number written"""
+    offsets = array('Q')
+    names = []
+    seen = set()
+    f = open(path,'wb')
+    try:
+        f.write(_TWOBIT_HEADER.pack(_TWOBIT_MAGIC,0,0,0))
+        for sequence in sequences:
+            if isinstance(sequence,SequenceRope):
+                sequence = sequence.materialize()
+            elif not isinstance(sequence,PackedSequence):
+                sequence = DNASequence(sequence.sequence,sequence.quality,sequence.name,True)
+            name = sequence.name or 'sequence{}'.format(len(names) + 1)
+            if name in seen:
+                raise ValueError('{}: more than one sequence is called {}'.format(path,name))
+            seen.add(name)
+            names.append(name)
+            offsets.append(f.tell())
+            quality = sequence.quality
+            quality_size = len(quality) if isinstance(quality,bytes) else 0
+            f.write(_TWOBIT_RECORD.pack(len(sequence),len(sequence._mask),quality_size,0.0 if isinstance(quality,bytes) else quality))
+            f.write(sequence._sequence + _padding(len(sequence._sequence)))
+            if sequence._mask:
+                starts,runs,letters = zip(*sequence._mask)
+                letters = ''.join(letters).encode('ascii')
+                f.write(_little_endian(array('Q',starts)))
+                f.write(_little_endian(array('Q',runs)))
+                f.write(letters + _padding(len(letters)))
+            if quality_size:
+                f.write(quality + _padding(quality_size))
+        index = f.tell()
+        f.write(_little_endian(offsets))
+        names = '\n'.join(names).encode('utf-8')
+        f.write(names)
+        f.seek(0)
+        f.write(_TWOBIT_HEADER.pack(_TWOBIT_MAGIC,len(offsets),index,len(names)))
+    finally:
+        f.close()
+    return len(offsets)
+
+class TwoBitReader():
+    """Random access to a file written by write_2bit(). The file is memory-mapped and only the index is read when it is opened; fetch() reads just the bytes that hold the requested region. Call close() when done"""
+    __slots__ = ('path','sequence_class','names','_buffer','_offsets','_masks')
+
+    def __init__(self,path,sequence_class=DNASequence):
+        self.path = path
+        self.sequence_class = sequence_class
+        with open(path,'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        if self._buffer[:len(_TWOBIT_MAGIC)] != _TWOBIT_MAGIC:
+            self._buffer.close()
+            raise ValueError('{} is not a 2-bit sequence file'.format(path))
+        magic,count,index,names_size = _TWOBIT_HEADER.unpack_from(self._buffer)
+        offsets = struct.unpack_from('<{}Q'.format(count),self._buffer,index)
+        self.names = self._buffer[index + 8 * count:index + 8 * count + names_size].decode('utf-8').split('\n') if count else []
+        self._offsets = dict(zip(self.names,offsets))
+        self._masks = {} # name: (run ends,runs), read the first time they are needed
+
+    def close(self):
+        self._buffer.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self,name):
+        return name in self._offsets
+
+    def __getitem__(self,name):
+        return self.fetch(name)
+
+    def length(self,name):
+        return _TWOBIT_RECORD.unpack_from(self._buffer,self._offsets[name])[0]
+
+    def _mask(self,name,offset,runs):
+        if name not in self._masks:
+            starts = struct.unpack_from('<{}Q'.format(runs),self._buffer,offset)
+            lengths = struct.unpack_from('<{}Q'.format(runs),self._buffer,offset + 8 * runs)
+            letters = self._buffer[offset + 16 * runs:offset + 17 * runs].decode('ascii')
+            self._masks[name] = ([start + run for start,run in zip(starts,lengths)],tuple(zip(starts,lengths,letters)))
+        return self._masks[name]
+
+    def fetch(self,name,start=0,stop=None):
+        """Returns the bases from start to stop of the sequence called name, with their qualities"""
+        offset = self._offsets[name]
+        length,runs,quality_size,quality = _TWOBIT_RECORD.unpack_from(self._buffer,offset)
+        start,stop,step = slice(start,stop).indices(length)
+        stop = max(start,stop)
+        offset += _TWOBIT_RECORD.size
+        first = start // 4
+        packed = _slice_packed(self._buffer[offset + first:offset + (stop + 3) // 4],start - 4 * first,stop - 4 * first)
+        offset += _padded((length + 3) // 4)
+        mask = ()
+        if runs:
+            ends,all_runs = self._mask(name,offset,runs)
+            i = bisect_right(ends,start)
+            j = bisect_left(all_runs,(stop,),i)
+            mask = _slice_mask(all_runs[i:j],start,stop)
+            offset += 16 * runs + _padded(runs)
+        if quality_size:
+            quality = self._buffer[offset + start:offset + stop]
+        return self.sequence_class._from_packed(packed,stop - start,mask,quality,name)
+
+_CODE_COMPLEMENT = bytes(3 - i if i < 4 else i for i in range(256))
+
+def _kmer_lanes(codes,k,reverse=False):
+    """Returns a big integer with a 64-bit lane for each position of codes (one byte per base, 0-3), holding the code of the k-mer that starts there, or with reverse true, of the k-mer read backwards. Lanes less than k from the end hold partial codes.
+
+    Shifting the integer by whole lanes lines up neighbouring bases, so the codes for every position are built with about 2 log2(k) big integer operations instead of a loop over the bases"""
+    lanes = bytearray(8 * len(codes))
+    lanes[0::8] = codes
+    window,width = int.from_bytes(lanes,'little'),1
+    result,size = None,0
+    # The code of a window of a+b bases is made from the codes of its first
+    # a and last b bases, so windows of k bases are built by doubling
+    remaining = k
+    while True:
+        if remaining & 1:
+            if result is None:
+                result,size = window,width
+            elif reverse:
+                result,size = result + ((window >> (64 * size)) << (2 * size)),size + width
+            else:
+                result,size = (result << (2 * width)) + (window >> (64 * size)),size + width
+        remaining >>= 1
+        if not remaining:
+            return result
+        if reverse:
+            window,width = window + ((window >> (64 * width)) << (2 * width)),width * 2
+        else:
+            window,width = (window << (2 * width)) + (window >> (64 * width)),width * 2
+
+def _lanes_to_array(value,n):
+    out = array('Q')
+    out.frombytes(value.to_bytes(8 * n + 8,'little')[:8 * n])
+    if sys.byteorder != 'little':
+        out.byteswap()
+    return out
+
+def _canonical_kmers(codes,k):
+    """Returns an array of the canonical code of the k-mer at each position of codes"""
+    n = len(codes)
+    forward = _kmer_lanes(codes,k)
+    reverse = _kmer_lanes(codes.translate(_CODE_COMPLEMENT),k,True)
+    if k == 32:
+        return array('Q',map(min,_lanes_to_array(forward,n),_lanes_to_array(reverse,n)))
+    # Lanewise minimum: with bit 63 of each lane set, subtracting leaves it
+    # set only where forward >= reverse, which selects the lanes to swap
+    guard = int.from_bytes(b'\x00\x00\x00\x00\x00\x00\x00\x80' * n,'little')
+    swap = ((((forward | guard) - reverse) & guard) >> 63) * ((1 << 63) - 1)
+    return _lanes_to_array(forward ^ ((forward ^ reverse) & swap),n)
+
+# K-mer counts are kept as (codes,counts) pairs of arrays sorted by code, 16
+# bytes per distinct k-mer. Sorting needs a list of Python ints, so k-mers are
+# sorted and merged at most _COUNT_BLOCK at a time
+_COUNT_BLOCK = 1 << 16
+_MERGE_FAN_IN = 16
+
+def _sorted_counts(codes,weights=None):
+    """Collapses a sorted list of k-mer codes into a (codes,counts) pair holding each distinct code once with the number of times it occurs, or with weights, the sum of the weights of its copies"""
+    if not codes:
+        return array('Q'),array('Q')
+    starts = [0]
+    starts.extend(itertools.compress(itertools.count(1),map(operator.ne,itertools.islice(codes,1,None),codes)))
+    distinct = array('Q',map(codes.__getitem__,starts))
+    starts.append(len(codes))
+    if weights is not None:
+        totals = [0]
+        totals.extend(itertools.accumulate(weights))
+        starts = list(map(totals.__getitem__,starts))
+    return distinct,array('Q',map(operator.sub,itertools.islice(starts,1,None),starts))
+
+def _merge_counts(runs):
+    """Merges a list of (codes,counts) pairs into one, adding up the counts of the codes that are in more than one. The arrays of the pairs are emptied as they are merged"""
+    runs = [[run_codes,run_counts,0] for run_codes,run_counts in runs if run_codes]
+    if len(runs) <= 1:
+        return (runs[0][0],runs[0][1]) if runs else (array('Q'),array('Q'))
+    codes,counts = array('Q'),array('Q')
+    step = max(_COUNT_BLOCK // len(runs),1)
+    while runs:
+        # Merge the codes up to the smallest of the codes a step ahead in
+        # each run, so that the block holds at most _COUNT_BLOCK codes
+        cut = min(run_codes[min(start + step,len(run_codes)) - 1] for run_codes,run_counts,start in runs)
+        block,block_counts = array('Q'),array('Q')
+        for run in runs:
+            run_codes,run_counts,start = run
+            stop = bisect_right(run_codes,cut,start)
+            block += run_codes[start:stop]
+            block_counts += run_counts[start:stop]
+            # Free the merged part of the run once it is at least half of
+            # it, so that the runs shrink as the result grows
+            if 2 * stop >= len(run_codes):
+                del run_codes[:stop],run_counts[:stop]
+                stop = 0
+            run[2] = stop
+        runs = [run for run in runs if run[2] < len(run[0])]
+        # The block is made of sorted runs, which sorted() merges
+        order = sorted(range(len(block)),key=block.__getitem__)
+        block,block_counts = _sorted_counts(list(map(block.__getitem__,order)),map(block_counts.__getitem__,order))
+        codes += block
+        counts += block_counts
+    return codes,counts
+
+def _push_counts(levels,counts):
+    """Adds a (codes,counts) pair to levels, a list of lists of them. When a level holds _MERGE_FAN_IN pairs they are merged into one pair on the next level, so each k-mer takes part in O(log n / log _MERGE_FAN_IN) merges"""
+    level = 0
+    while True:
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(counts)
+        if len(levels[level]) < _MERGE_FAN_IN:
+            return
+        counts = _merge_counts(levels[level])
+        levels[level] = []
+        level += 1
+
+def _pop_counts(levels):
+    """Merges all of the (codes,counts) pairs in levels into one"""
+    return _merge_counts([counts for level in levels for counts in level])
+
+def _chunk_kmer_counts(chunk,k):
+    """Counts the canonical k-mers of a chunk of sequences, given as (packed,length,mask) tuples, and returns them as a (codes,counts) pair"""
+    codes = bytearray()
+    windows = [] # ranges of k-mer start positions that contain no masked bases
+    for packed,length,mask in chunk:
+        start = len(codes)
+        codes += _unpack_bytes(packed,length,_CODE_LETTERS)
+        position = start
+        for run_start,run,letter in mask:
+            if start + run_start - position >= k:
+                windows.append((position,start + run_start - k + 1))
+            position = start + run_start + run
+        if start + length - position >= k:
+            windows.append((position,start + length - k + 1))
+    # The canonical k-mers are made and sorted a block of positions at a
+    # time, which bounds the size of the big integers and of the lists
+    runs = []
+    w = 0
+    for start in range(0,len(codes),_COUNT_BLOCK):
+        stop = min(start + _COUNT_BLOCK,len(codes))
+        canonical = None
+        kmers = array('Q')
+        while w < len(windows) and windows[w][0] < stop:
+            first,last = windows[w]
+            if canonical is None:
+                canonical = _canonical_kmers(codes[start:stop + k - 1],k)
+            kmers += canonical[max(first,start) - start:min(last,stop) - start]
+            if last > stop:
+                break # the window goes on into the next block
+            w += 1
+        if kmers:
+            runs.append(_sorted_counts(sorted(kmers)))
+    return _merge_counts(runs)
+
+def _count_kmers(job):
+    """Worker process entry point for KmerIndex. Counts the canonical k-mers of a chunk of sequences and returns the name of a shared memory block holding the sorted codes followed by their counts, and the number of codes"""
+    from multiprocessing import shared_memory
+    chunk,k = job
+    codes,counts = _chunk_kmer_counts(chunk,k)
+    if not codes:
+        return None,0
+    block = shared_memory.SharedMemory(create=True,size=16 * len(codes))
+    try:
+        block.buf[:8 * len(codes)] = codes.tobytes()
+        block.buf[8 * len(codes):16 * len(codes)] = counts.tobytes()
+        return block.name,len(codes)
+    finally:
+        block.close()
+
+def _encode_kmer(kmer):
+    code = 0
+    for base in kmer:
+        code = (code << 2) | 'ACGT'.index(base)
+    return code
+
+def _decode_kmer(code,k):
+    return ''.join('ACGT'[(code >> (2 * (k - 1 - i))) & 3] for i in range(k))
+
+class KmerIndex():
+    """Counts of the canonical k-mers (the smaller of each k-mer and its reverse complement) of a collection of DNA sequences, for 1 <= k <= 32. K-mers containing N are skipped. The counts are kept in two sorted arrays, so each distinct k-mer takes 16 bytes and lookups use binary search. They are counted the same way, by sorting the k-mers of each chunk of about chunk_size bases and merging the sorted counts, without a dict. With processes > 1 (and Python 3.8 or later), the chunks are counted by a pool of worker processes, which hand back their sorted counts in shared memory"""
+    __slots__ = ('k','_codes','_counts')
+
+    def __init__(self,sequences=(),k=21,processes=1,chunk_size=1 << 18):
+        if not 1 <= k <= 32:
+            raise ValueError('k must be between 1 and 32')
+        self.k = k
+        levels = []
+        if processes > 1 and sys.version_info >= (3,8):
+            # multiprocessing is only imported here, as it takes longer to
+            # import than the rest of this module. Start the resource tracker
+            # before forking the workers, so that they share it and do not
+            # try to clean up the shared memory blocks themselves
+            import multiprocessing
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+            pool = multiprocessing.Pool(processes)
+            try:
+                for name,n in pool.imap_unordered(_count_kmers,((chunk,k) for chunk in self._chunks(sequences,chunk_size))):
+                    if name is not None:
+                        _push_counts(levels,self._receive(name,n))
+            finally:
+                pool.close()
+                pool.join()
         else:
-            raise Exception("The input sequence isn't valid RNA")
-    
-print('Making brain sample DNA class')
-brain_sample = DNASequence('AGT',27)
-print(brain_sample.transcribe())
-brain_sample.reverse_complement()
+            for chunk in self._chunks(sequences,chunk_size):
+                _push_counts(levels,_chunk_kmer_counts(chunk,k))
+        self._codes,self._counts = _pop_counts(levels)
+
+    @staticmethod
+    def _chunks(sequences,chunk_size):
+        chunk = []
+        size = 0
+        for sequence in sequences:
+            if isinstance(sequence,SequenceRope):
+                sequence = sequence.materialize()
+            chunk.append((sequence._sequence,sequence._length,sequence._mask))
+            size += sequence._length
+            if size >= chunk_size:
+                yield chunk
+                chunk = []
+                size = 0
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _receive(name,n):
+        """Copies the counts of n codes out of a worker's shared memory block and frees it"""
+        from multiprocessing import shared_memory
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            codes = array('Q')
+            codes.frombytes(block.buf[:8 * n])
+            chunk_counts = array('Q')
+            chunk_counts.frombytes(block.buf[8 * n:16 * n])
+        finally:
+            block.close()
+            block.unlink()
+        return codes,chunk_counts
+
+    def __len__(self):
+        return len(self._codes)
+
+    def total(self):
+        return sum(self._counts)
+
+    def count(self,kmer):
+        """Returns the number of times kmer or its reverse complement occurs"""
+        kmer = str(kmer.sequence if isinstance(kmer,Sequence) else kmer).replace('U','T')
+        if len(kmer) != self.k:
+            raise ValueError('The index holds {}-mers, not {}-mers'.format(self.k,len(kmer)))
+        if kmer.strip('ACGT'):
+            return 0
+        code = _encode_kmer(kmer)
+        reverse = (4 ** self.k - 1) ^ _encode_kmer(kmer[::-1])
+        i = bisect_left(self._codes,min(code,reverse))
+        if i < len(self._codes) and self._codes[i] == min(code,reverse):
+            return self._counts[i]
+        return 0
+
+    __getitem__ = count
+
+    def most_common(self,n=10):
+        """Returns the n most frequent canonical k-mers as (kmer,count) tuples"""
+        return [(_decode_kmer(self._codes[i],self.k),self._counts[i]) for i in heapq.nlargest(n,range(len(self._codes)),key=self._counts.__getitem__)]
+
+    def items(self):
+        for code,count in zip(self._codes,self._counts):
+            yield _decode_kmer(code,self.k),count
+
+# FM-index text: the sequences are joined with a 0 byte after each one, with
+# A/C/G/T(U) coded 1/2/3/4 and every other letter 5, so that patterns never
+# match across the end of a sequence or over N
+
+_FM_CODES = bytes({'A':1,'C':2,'G':3,'T':4,'U':4}.get(chr(i),5) for i in range(256))
+_FM_SYMBOLS = 6
+_IUPAC_BASES = {'A':'A','C':'C','G':'G','T':'T','U':'T','R':'AG','Y':'CT','S':'CG','W':'AT','K':'GT','M':'AC','B':'CGT','D':'AGT','H':'ACT','V':'ACG','N':'ACGT'}
+_FM_PATTERN_CODES = {letter:tuple(_FM_CODES[ord(base)] for base in bases) for letter,bases in _IUPAC_BASES.items()}
+_FM_SHIFT = 7 # occurrence counts are stored for every 128 rows
+_FM_MAGIC = b'FMINDEX1'
+_FM_HEADER = struct.Struct('<8sQQQQQ') # magic, text length, sample rate, samples, sequences, bytes of names
+
+def _suffix_array(text):
+    """Returns the suffix array of text (bytes) as a list. Suffixes are sorted by their first 8 bytes, then each group that is still tied is sorted by the rank of the suffix h bytes further on, doubling h each round, so later rounds only touch the unresolved suffixes"""
+    n = len(text)
+    # Shift the codes up by one so the zero padding sorts below everything,
+    # like the end of the text
+    padded = text.translate(bytes((i + 1) & 0xFF for i in range(256))) + bytes(8)
+    keys = [0] * n
+    for j in range(8):
+        lane = array('Q')
+        lane.frombytes(padded[j:j + 8 * ((n - j + 7) // 8)])
+        if sys.byteorder == 'little':
+            lane.byteswap() # big-endian, so the integers sort like the bytes
+        keys[j::8] = lane
+    sa = sorted(range(n),key=keys.__getitem__)
+    rank = [0] * n # the position in sa of the first suffix tied with each one
+    groups = [] # (start,stop) of each run of tied suffixes in sa
+    first = 0
+    for i,p in enumerate(sa):
+        if keys[p] != keys[sa[first]]:
+            if i - first > 1:
+                groups.append((first,i))
+            first = i
+        rank[p] = first
+    if n - first > 1:
+        groups.append((first,n))
+    del keys
+    h = 8
+    while groups:
+        shifted = rank[h:] + [-1] * min(h,n)
+        unresolved = []
+        for start,stop in groups:
+            members = sorted(sa[start:stop],key=shifted.__getitem__)
+            sa[start:stop] = members
+            first = start
+            for i,p in enumerate(members,start):
+                if shifted[p] != shifted[members[first - start]]:
+                    if i - first > 1:
+                        unresolved.append((first,i))
+                    first = i
+                rank[p] = first
+            if stop - first > 1:
+                unresolved.append((first,stop))
+        groups = unresolved
+        h *= 2
+    return sa
+
+def _uint64s(buffer,offset,count):
+    """Returns count little-endian unsigned 64-bit integers from buffer, as a view of it where possible"""
+    if sys.byteorder == 'little':
+        return memoryview(buffer)[offset:offset + 8 * count].cast('Q')
+    values = array('Q')
+    values.frombytes(buffer[offset:offset + 8 * count])
+    values.byteswap()
+    return values
+
+def _little_endian(values):
+    if sys.byteorder == 'little':
+        return values
+    values = array('Q',values)
+    values.byteswap()
+    return values
+
+class FMIndex():
+    """Substring index over a sequence or a collection of sequences, built from their suffix array and Burrows-Wheeler transform. count() and locate() take time proportional to the pattern length (plus up to sample_rate steps for each match located), search both strands, and accept IUPAC ambiguity codes in the pattern. Bases other than A, C, G and T(U) in the indexed sequences never match. Indexes can be saved with save() and memory-mapped with load()"""
+    __slots__ = ('sample_rate','names','_n','_C','_bwt','_bwt_offset','_occ','_rows','_positions','_starts')
+
+    def __init__(self,sequences=(),sample_rate=32):
+        if isinstance(sequences,(Sequence,str)):
+            sequences = [sequences]
+        self.sample_rate = sample_rate
+        self.names = []
+        text = bytearray()
+        starts = array('Q')
+        for sequence in sequences:
+            if isinstance(sequence,SequenceRope):
+                sequence = sequence.materialize()
+            starts.append(len(text))
+            self.names.append(getattr(sequence,'name',None))
+            if isinstance(sequence,PackedSequence):
+                start = len(text)
+                text += _unpack_bytes(sequence._sequence,sequence._length,'\x01\x02\x03\x04')
+                for run_start,run,letter in sequence._mask:
+                    text[start + run_start:start + run_start + run] = b'\x05' * run
+            else:
+                sequence = sequence.sequence if isinstance(sequence,Sequence) else sequence
+                text += sequence.upper().encode('ascii','replace').translate(_FM_CODES)
+            text.append(0)
+        text = bytes(text)
+        n = len(text)
+        sa = _suffix_array(text)
+        # Row i of the BWT is the letter before the i-th smallest suffix
+        bwt = bytes(map(text.__getitem__,[p - 1 for p in sa]))
+        counts = [text.count(c) for c in range(_FM_SYMBOLS)]
+        self._n = n
+        self._C = tuple(itertools.accumulate([0] + counts))
+        self._bwt = bwt
+        self._bwt_offset = 0
+        self._occ = array('Q')
+        totals = [0] * _FM_SYMBOLS
+        for block in range(0,n + 1,1 << _FM_SHIFT):
+            self._occ.extend(totals)
+            chunk = bwt[block:block + (1 << _FM_SHIFT)]
+            for c in range(_FM_SYMBOLS):
+                totals[c] += chunk.count(c)
+        # Sample the suffix array at every sample_rate-th position and at the
+        # start of every sequence, so locating never steps over a separator
+        self._rows = array('Q')
+        self._positions = array('Q')
+        for row,(p,c) in enumerate(zip(sa,bwt)):
+            if p % sample_rate == 0 or c == 0:
+                self._rows.append(row)
+                self._positions.append(p)
+        self._starts = starts
+
+    def save(self,path):
+        names = '\n'.join('' if name is None else name for name in self.names).encode('utf-8')
+        with open(path,'wb') as f:
+            f.write(_FM_HEADER.pack(_FM_MAGIC,self._n,self.sample_rate,len(self._rows),len(self._starts),len(names)))
+            for values in (array('Q',self._C),self._occ,self._rows,self._positions,self._starts):
+                f.write(_little_endian(values))
+            f.write(names)
+            f.write(self._bwt[self._bwt_offset:self._bwt_offset + self._n])
+
+    @classmethod
+    def load(cls,path,memory_map=True):
+        """Reads an index written by save(). With memory_map true the file is mapped instead of read, so loading is immediate and processes that load the same file share its pages. Call close() to release the mapping"""
+        with open(path,'rb') as f:
+            if memory_map:
+                buffer = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            else:
+                buffer = f.read()
+        if buffer[:len(_FM_MAGIC)] != _FM_MAGIC:
+            raise ValueError('{} is not an FM-index file'.format(path))
+        magic,n,sample_rate,samples,sequences,names_size = _FM_HEADER.unpack(buffer[:_FM_HEADER.size])
+        index = cls.__new__(cls)
+        index.sample_rate = sample_rate
+        index._n = n
+        offset = _FM_HEADER.size
+        index._C = tuple(_uint64s(buffer,offset,_FM_SYMBOLS + 1))
+        offset += 8 * (_FM_SYMBOLS + 1)
+        blocks = _FM_SYMBOLS * ((n >> _FM_SHIFT) + 1)
+        index._occ = _uint64s(buffer,offset,blocks)
+        offset += 8 * blocks
+        index._rows = _uint64s(buffer,offset,samples)
+        index._positions = _uint64s(buffer,offset + 8 * samples,samples)
+        offset += 16 * samples
+        index._starts = _uint64s(buffer,offset,sequences)
+        offset += 8 * sequences
+        names = bytes(buffer[offset:offset + names_size]).decode('utf-8').split('\n') if sequences else []
+        index.names = [name or None for name in names]
+        index._bwt = buffer
+        index._bwt_offset = offset + names_size
+        return index
+
+    def close(self):
+        for values in (self._occ,self._rows,self._positions,self._starts):
+            if isinstance(values,memoryview):
+                values.release()
+        if isinstance(self._bwt,mmap.mmap):
+            self._bwt.close()
+
+    def _occurrences(self,c,i):
+        """Returns the number of times code c occurs in the first i rows of the BWT"""
+        block = i >> _FM_SHIFT
+        start = self._bwt_offset + (block << _FM_SHIFT)
+        return self._occ[_FM_SYMBOLS * block + c] + self._bwt[start:self._bwt_offset + i].count(c)
+
+    def _patterns(self,pattern,both_strands):
+        """Returns (strand,letters) for the pattern and, if both_strands is true and it differs, its reverse complement"""
+        if isinstance(pattern,SequenceRope):
+            pattern = pattern.materialize()
+        if not isinstance(pattern,PackedSequence):
+            pattern = pattern.sequence if isinstance(pattern,Sequence) else pattern
+            pattern = DNASequence(pattern.upper().replace('U','T'),iupac=True)
+        if not len(pattern):
+            raise ValueError('Cannot search for an empty pattern')
+        patterns = [('+',pattern.sequence)]
+        if both_strands:
+            reverse = pattern.reverse_complement().sequence
+            if reverse != patterns[0][1]:
+                patterns.append(('-',reverse))
+        return patterns
+
+    def _ranges(self,letters):
+        """Returns the (start,stop) ranges of the BWT rows whose suffixes start with letters, by backward search. Each ambiguity code splits the ranges by the bases it stands for"""
+        C = self._C
+        occurrences = self._occurrences
+        ranges = [(0,self._n)]
+        for letter in reversed(letters):
+            narrowed = []
+            for start,stop in ranges:
+                for c in _FM_PATTERN_CODES[letter]:
+                    new_start = C[c] + occurrences(c,start)
+                    new_stop = C[c] + occurrences(c,stop)
+                    if new_start < new_stop:
+                        narrowed.append((new_start,new_stop))
+            ranges = narrowed
+            if not ranges:
+                break
+        return ranges
+
+    def _position(self,row):
+        """Returns the text position of the suffix in a row, stepping back through the text until reaching a sampled position"""
+        steps = 0
+        while True:
+            i = bisect_left(self._rows,row)
+            if i < len(self._rows) and self._rows[i] == row:
+                return self._positions[i] + steps
+            c = self._bwt[self._bwt_offset + row]
+            row = self._C[c] + self._occurrences(c,row)
+            steps += 1
+
+    def count(self,pattern,both_strands=True):
+        """Returns the number of matches of pattern (a str or sequence, which may contain IUPAC codes), on both strands unless both_strands is false. A pattern that is its own reverse complement is counted once per site"""
+        return sum(stop - start for strand,letters in self._patterns(pattern,both_strands) for start,stop in self._ranges(letters))
+
+    def locate(self,pattern,both_strands=True):
+        """Returns sorted (index,position,strand) tuples for the matches of pattern, where index is the position of the sequence in names, position is the 0-based start of the match on the forward strand and strand is '+' or '-'"""
+        matches = []
+        for strand,letters in self._patterns(pattern,both_strands):
+            for start,stop in self._ranges(letters):
+                for row in range(start,stop):
+                    position = self._position(row)
+                    i = bisect_right(self._starts,position) - 1
+                    matches.append((i,position - self._starts[i],strand))
+        matches.sort()
+        return matches
+
+if __name__ == '__main__':
+    print('Making brain sample DNA class')
+    brain_sample = DNASequence('AGT',27)
+    print(brain_sample.transcribe())
+    brain_sample.reverse_complement()
 
-#print('Creating liver sample RNA class...\n')
-#liver_sample = RNASequence('AGU',30)
+    #print('Creating liver sample RNA class...\n')
+    #liver_sample = RNASequence('AGU',30)
 
-#print('Creating test sequence...\n')
-#TestSequence = Sequence('ACGTC',14)
+    #print('Creating test sequence...\n')
+    #TestSequence = Sequence('ACGTC',14)
 
-#print('Printing the addition of brain and liver sample')
-#print(brain_sample + liver_sample)
+    #print('Printing the addition of brain and liver sample')
+    #print(brain_sample + liver_sample)
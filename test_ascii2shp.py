@@ -0,0 +1,549 @@
+"""Tests for ascii2shp.py. Run with: python -m unittest test_ascii2shp"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+
+import ascii2shp
+from ascii2shp import Ascii2Shp, DelimitedTextReader, Geoprocessor, LocalGeoprocessor, MarineError, PointShapefileWriter, _load_numpy, _ProcessRunner
+
+# Stub executable for _ProcessRunner. Its first argument says how to behave.
+
+_STUB = """import subprocess, sys, time
+mode = sys.argv[1]
+if mode == "ok":
+    sys.stdout.write("first\\nsecond\\r\\nno newline")
+    sys.stderr.write("warning\\n")
+elif mode == "fail":
+    sys.stderr.write("failed\\n")
+    sys.exit(3)
+elif mode == "sleep":
+    time.sleep(30)
+elif mode == "orphan":
+    # Start a child that inherits stdout and stderr and outlives this one.
+    subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"])
+    time.sleep(30)
+"""
+
+
+def read_shapefile(path):
+    """Reads back a point shapefile, checking that its .shp, .shx and .dbf files agree. Returns a dictionary of its shape type, bounds, points, attribute fields and records, with each record a list of stripped values that starts with the ID."""
+
+    base = os.path.splitext(path)[0]
+    f = open(base + ".shp", "rb")
+    try:
+        shp = f.read()
+    finally:
+        f.close()
+    f = open(base + ".shx", "rb")
+    try:
+        shx = f.read()
+    finally:
+        f.close()
+    f = open(base + ".dbf", "rb")
+    try:
+        dbf = f.read()
+    finally:
+        f.close()
+
+    assert shp[:100] == shx[:24] + struct.pack(">i", len(shp) // 2) + shx[28:100]
+    assert struct.unpack(">7i", shx[:28]) == (9994, 0, 0, 0, 0, 0, len(shx) // 2)
+    version, shape_type = struct.unpack("<2i", shp[28:36])
+    assert version == 1000
+    dimensions = {1: 2, 21: 3, 11: 4}[shape_type]
+    points = []
+    offset = 100
+    for i in range(100, len(shx), 8):
+        record_offset, record_words = struct.unpack(">2i", shx[i:i+8])
+        assert (record_offset * 2, record_words) == (offset, 2 + 4 * dimensions)
+        assert struct.unpack(">2i", shp[offset:offset+8]) == ((i - 100) // 8 + 1, record_words)
+        content = struct.unpack("<i%id" % dimensions, shp[offset+8:offset+8+record_words*2])
+        assert content[0] == shape_type
+        points.append(content[1:])
+        offset = offset + 8 + record_words * 2
+    assert offset == len(shp)
+
+    record_count, header_length, record_length = struct.unpack("<I2H", dbf[4:12])
+    assert record_count == len(points)
+    fields = []
+    for i in range(32, header_length - 1, 32):
+        name, field_type, width, decimals = struct.unpack("<11sc4xBB14x", dbf[i:i+32])
+        fields.append((name.split(b"\0")[0].decode("latin-1"), field_type.decode("latin-1"), width, decimals))
+    assert dbf[header_length - 1:header_length] == b"\r"
+    assert sum([field[2] for field in fields]) + 1 == record_length
+    assert len(dbf) == header_length + record_count * record_length + 1 and dbf[-1:] == b"\x1a"
+    records = []
+    for i in range(record_count):
+        record = dbf[header_length + i * record_length:header_length + (i + 1) * record_length].decode("latin-1")
+        assert record[0] == " "
+        values = []
+        start = 1
+        for field in fields:
+            values.append(record[start:start+field[2]].strip())
+            start = start + field[2]
+        records.append(values)
+
+    return {"shape_type": shape_type,
+            "bounds": struct.unpack("<8d", shp[36:100]),
+            "points": points,
+            "fields": fields,
+            "records": records}
+
+
+@contextlib.contextmanager
+def local_geoprocessor():
+    """Runs the tools with a LocalGeoprocessor and without printing their log messages."""
+
+    backend = Geoprocessor.backend
+    Geoprocessor.set_backend(LocalGeoprocessor)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        Geoprocessor.set_backend(backend)
+
+
+def write_text(path, text):
+    f = open(path, "wb")
+    try:
+        f.write(text.encode("latin-1"))
+    finally:
+        f.close()
+
+
+class ProcessRunnerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stub = os.path.join(self.directory, "stub.py")
+        f = open(self.stub, "w")
+        try:
+            f.write(_STUB)
+        finally:
+            f.close()
+        self.lines = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def on_line(self, index, stream, line):
+        self.lines.append((index, stream, line))
+
+    def command(self, mode):
+        return [sys.executable, self.stub, mode]
+
+    def test_success(self):
+        results = _ProcessRunner(self.on_line).run([self.command("ok")])
+        self.assertEqual(results[0]["returncode"], 0)
+        self.assertFalse(results[0]["timed_out"])
+        self.assertIsNone(results[0]["error"])
+        self.assertEqual([line for line in self.lines if line[1] == "stdout"], [(0, "stdout", "first"), (0, "stdout", "second"), (0, "stdout", "no newline")])
+        self.assertEqual([line for line in self.lines if line[1] == "stderr"], [(0, "stderr", "warning")])
+
+    def test_nonzero_exit(self):
+        results = _ProcessRunner(self.on_line).run([self.command("fail"), self.command("ok")])
+        self.assertEqual(results[0]["returncode"], 3)
+        self.assertFalse(results[0]["timed_out"])
+        self.assertIn((0, "stderr", "failed"), self.lines)
+        self.assertEqual(results[1]["returncode"], 0)
+
+    def test_timeout(self):
+        started = time.time()
+        results = _ProcessRunner(self.on_line, timeout=0.5).run([self.command("sleep")])
+        self.assertTrue(results[0]["timed_out"])
+        self.assertNotEqual(results[0]["returncode"], 0)
+        self.assertLess(time.time() - started, 5)
+
+    def test_timeout_with_inherited_pipes(self):
+        # The stub's own child keeps the pipes open after the stub is killed.
+        # The runner must not wait for it, and the next command must start
+        # as soon as the timed out one is killed.
+
+        started = time.time()
+        results = _ProcessRunner(self.on_line, max_processes=1).run([self.command("orphan"), self.command("ok")], [1.0, None])
+        self.assertTrue(results[0]["timed_out"])
+        self.assertEqual(results[1]["returncode"], 0)
+        self.assertLess(time.time() - started, 4)
+
+    def test_missing_program(self):
+        results = _ProcessRunner(self.on_line).run([[os.path.join(self.directory, "missing")], self.command("ok")])
+        self.assertIsNone(results[0]["returncode"])
+        self.assertIsNotNone(results[0]["error"])
+        self.assertEqual(results[1]["returncode"], 0)
+
+
+class DelimitedTextReaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "points.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read(self, text, columns, delimiter=",", quote_character="\"", comment_string=None, memory_map=False, chunk_size=4194304):
+        write_text(self.path, text)
+        reader = DelimitedTextReader(self.path, delimiter, quote_character, comment_string, memory_map)
+        rows = []
+        for chunk in reader.chunks(chunk_size, 0, None, columns):
+            rows.extend(chunk)
+        return rows
+
+    def assertSameRows(self, text, columns, **options):
+        # A complete row is a tuple of its fields. A row that lacks one of
+        # the columns is a one-element list, which CoordinateDecoder rejects
+        # and whose contents differ between the two modes.
+
+        expected = self.read(text, columns, memory_map=False, **options)
+        actual = self.read(text, columns, memory_map=True, **options)
+        self.assertEqual([r if isinstance(r, tuple) else None for r in actual], [r if isinstance(r, tuple) else None for r in expected], repr(text))
+        return expected
+
+    def test_quoted_delimiter_in_short_row(self):
+        rows = self.assertSameRows("1,2,\"a, b\",c\n3,4,\"d, e\"\n", [0, 1, 2, 3])
+        self.assertEqual(rows[0], ("1", "2", "a, b", "c"))
+        self.assertEqual(len(rows[1]), 1)
+
+    def test_doubled_quotes(self):
+        rows = self.assertSameRows("1,\"abc\"\"\" ,x\n2,\"a\"\"b\",y\n", [0, 1, 2])
+        self.assertEqual(rows, [("1", "abc\" ", "x"), ("2", "a\"b", "y")])
+        rows = self.assertSameRows("1,'1''',x\n", [0, 1, 2], quote_character="'")
+        self.assertEqual(rows, [("1", "1'", "x")])
+
+    def test_text_around_quotes(self):
+        rows = self.assertSameRows("a\"b,c\"d,e\n\"unterminated,f\n", [0, 1])
+        self.assertEqual(rows[0], ("ab,cd", "e"))
+        self.assertEqual(len(rows[1]), 1)
+
+    def test_whitespace_delimited(self):
+        rows = self.assertSameRows("  1 \t\"a b\"  c\n2 \"\" d\n\n# note\n3 x\n", [0, 1, 2], delimiter=None, comment_string="#")
+        self.assertEqual(rows[:2], [("1", "a b", "c"), ("2", "", "d")])
+        self.assertEqual(len(rows[2]), 1)
+
+    def test_random_lines(self):
+        rng = random.Random(0)
+        characters = ["a", "1", " ", "\t", ",", ";", "\"", "'", "#"]
+        for i in range(500):
+            text = "\n".join(["".join([rng.choice(characters) for j in range(rng.randrange(12))]) for k in range(4)]) + rng.choice(["", "\n", "\r\n"])
+            columns = [rng.randrange(4) for j in range(rng.randrange(1, 4))]
+            self.assertSameRows(text, columns, delimiter=rng.choice([",", ";", None]), quote_character=rng.choice(["\"", "'", None]), comment_string=rng.choice(["#", None]), chunk_size=rng.choice([1, 16, 4194304]))
+
+
+class PointShapefileWriterTests(unittest.TestCase):
+
+    FIELDS = [("NAME", "C", 5, 0), ("DEPTH", "N", 6, 2)]
+    POINTS = [(1.0, 2.0, -3.0), (-4.5, 6.0, 7.0), (0.5, -1.0, 0.0)]
+    ATTRIBUTES = b"abc    1.50de   -20.00       0.00"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_files(self, path):
+        contents = []
+        for extension in [".shp", ".shx", ".dbf"]:
+            f = open(os.path.splitext(path)[0] + extension, "rb")
+            try:
+                contents.append(f.read())
+            finally:
+                f.close()
+        return contents
+
+    def test_write_points(self):
+        path = os.path.join(self.directory, "points.shp")
+        writer = PointShapefileWriter(path, has_z=True, block_size=2, fields=self.FIELDS)
+        writer.write_points(self.POINTS[:1], self.ATTRIBUTES[:11])
+        writer.write_points(self.POINTS[1:], self.ATTRIBUTES[11:])
+        writer.close()
+
+        shapefile = read_shapefile(path)
+        self.assertEqual(shapefile["shape_type"], 11)
+        self.assertEqual(shapefile["points"], [p + (PointShapefileWriter.NO_DATA,) for p in self.POINTS])
+        self.assertEqual(shapefile["bounds"], (-4.5, -1.0, 1.0, 6.0, -3.0, 7.0, 0.0, 0.0))
+        self.assertEqual(shapefile["fields"], [("ID", "N", 10, 0)] + self.FIELDS)
+        self.assertEqual(shapefile["records"], [["1", "abc", "1.50"], ["2", "de", "-20.00"], ["3", "", "0.00"]])
+
+    @unittest.skipIf(_load_numpy() is None, "NumPy is not installed")
+    def test_write_array(self):
+        # Packing an array must give the same files as packing the tuples.
+
+        numpy = _load_numpy()
+        expected = os.path.join(self.directory, "tuples.shp")
+        writer = PointShapefileWriter(expected, has_z=True, fields=self.FIELDS)
+        writer.write_points(self.POINTS, self.ATTRIBUTES)
+        writer.close()
+        actual = os.path.join(self.directory, "array.shp")
+        writer = PointShapefileWriter(actual, has_z=True, fields=self.FIELDS)
+        writer.write_array(numpy.array(self.POINTS[:2]), self.ATTRIBUTES[:22])
+        writer.write_array(numpy.array(self.POINTS[2:]), self.ATTRIBUTES[22:])
+        writer.close()
+        self.assertEqual(self.read_files(actual), self.read_files(expected))
+
+    def test_point_and_point_m(self):
+        path = os.path.join(self.directory, "points.shp")
+        writer = PointShapefileWriter(path)
+        writer.write_points([p[:2] for p in self.POINTS])
+        writer.close()
+        shapefile = read_shapefile(path)
+        self.assertEqual(shapefile["shape_type"], 1)
+        self.assertEqual(shapefile["points"], [p[:2] for p in self.POINTS])
+        self.assertEqual(shapefile["bounds"][:4], (-4.5, -1.0, 1.0, 6.0))
+        self.assertEqual(shapefile["records"], [["1"], ["2"], ["3"]])
+
+        writer = PointShapefileWriter(path, has_m=True)
+        writer.write_points(self.POINTS)
+        writer.close()
+        shapefile = read_shapefile(path)
+        self.assertEqual(shapefile["shape_type"], 21)
+        self.assertEqual(shapefile["points"], self.POINTS)
+        self.assertEqual(shapefile["bounds"], (-4.5, -1.0, 1.0, 6.0, 0.0, 0.0, -3.0, 7.0))
+
+    def test_empty(self):
+        path = os.path.join(self.directory, "points.shp")
+        PointShapefileWriter(path, has_z=True).close()
+        shapefile = read_shapefile(path)
+        self.assertEqual(shapefile["points"], [])
+        self.assertEqual(shapefile["bounds"], (0.0,) * 8)
+
+
+class Ascii2ShpTests(unittest.TestCase):
+
+    TEXT = "% Stations\n" \
+           "x,y,depth,name\n" \
+           "\n" \
+           "1.5,2.5,-10,\"Point, the first\"\n" \
+           "-3,4.25,-20.5,second\n" \
+           "% skipped\n" \
+           "7,-8,0,\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_textfile = os.path.join(self.directory, "points.txt")
+        self.output_shapefile = os.path.join(self.directory, "points.shp")
+        write_text(self.input_textfile, self.TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def convert(self, **options):
+        parameters = {"input_textfile": self.input_textfile, "output_shapefile": self.output_shapefile, "xcol": "x", "ycol": "y", "comment_string": "%", "quote_character": "double quote"}
+        parameters.update(options)
+        with local_geoprocessor():
+            tool = Ascii2Shp(**parameters)
+            tool.run()
+        return tool
+
+    def test_convert(self):
+        # The small chunk sizes make the reader carry partial lines over
+        # from one chunk to the next.
+
+        for options in [{}, {"chunk_size": 7}, {"memory_map": True, "chunk_size": 7}, {"parallel_workers": 2, "chunk_size": 16}]:
+            for extension in [".shp", ".shx", ".dbf"]:
+                if os.path.isfile(os.path.join(self.directory, "points" + extension)):
+                    os.remove(os.path.join(self.directory, "points" + extension))
+            tool = self.convert(zcol="depth", attribute_columns="name", **options)
+            self.assertEqual(tool.record_count, 3)
+            shapefile = read_shapefile(self.output_shapefile)
+            self.assertEqual(shapefile["shape_type"], 11, options)
+            self.assertEqual(shapefile["points"], [(1.5, 2.5, -10.0, PointShapefileWriter.NO_DATA), (-3.0, 4.25, -20.5, PointShapefileWriter.NO_DATA), (7.0, -8.0, 0.0, PointShapefileWriter.NO_DATA)], options)
+            self.assertEqual(shapefile["bounds"], (-3.0, -8.0, 7.0, 4.25, -20.5, 0.0, 0.0, 0.0), options)
+            self.assertEqual(shapefile["fields"], [("ID", "N", 10, 0), ("name", "C", 16, 0)], options)
+            self.assertEqual(shapefile["records"], [["1", "Point, the first"], ["2", "second"], ["3", ""]], options)
+
+    def test_column_numbers_and_m(self):
+        self.convert(xcol="1", ycol="2", mcol="3")
+        shapefile = read_shapefile(self.output_shapefile)
+        self.assertEqual(shapefile["shape_type"], 21)
+        self.assertEqual([p[2] for p in shapefile["points"]], [-10.0, -20.5, 0.0])
+        self.assertEqual(shapefile["records"], [["1"], ["2"], ["3"]])
+
+    def test_bad_row(self):
+        write_text(self.input_textfile, self.TEXT + "9,north,1,x\n")
+        with self.assertRaises(MarineError) as context:
+            self.convert()
+        self.assertIn("Data row 4 ", str(context.exception))
+        self.assertFalse(os.path.exists(self.output_shapefile))
+
+    def test_values_wider_than_the_sample(self):
+        # Only the first 10 rows are sampled. Later rows hold wider numbers,
+        # a fraction in the integer column and longer text, which must all
+        # be written as they are.
+
+        lines = ["x,y,id,count,name"]
+        for i in range(1, 31):
+            lines.append("%i,%i,%i,%s,%s" % (i, -i, i * 1000, "2.5" if i == 20 else str(i % 10), "a much longer name" if i == 25 else "n%i" % (i % 10)))
+        write_text(self.input_textfile, "\n".join(lines) + "\n")
+
+        for options in [{}, {"parallel_workers": 2, "chunk_size": 64}]:
+            for extension in [".shp", ".shx", ".dbf"]:
+                if os.path.isfile(os.path.join(self.directory, "points" + extension)):
+                    os.remove(os.path.join(self.directory, "points" + extension))
+            self.convert(attribute_columns="all", attribute_sample_rows=10, **options)
+            shapefile = read_shapefile(self.output_shapefile)
+            self.assertEqual(shapefile["fields"], [("ID", "N", 10, 0), ("id_1", "N", 5, 0), ("count", "N", 3, 1), ("name", "C", 18, 0)], options)
+            self.assertEqual([r[1] for r in shapefile["records"]], [str(i * 1000) for i in range(1, 31)], options)
+            self.assertEqual(shapefile["records"][19][2:], ["2.5", "n0"], options)
+            self.assertEqual(shapefile["records"][24][2:], ["5", "a much longer name"], options)
+
+    def test_numeric_headroom(self):
+        # Numeric fields inferred from a sample are as wide as possible, so
+        # that the larger numbers after it fit without inferring again.
+
+        write_text(self.input_textfile, "x,y,id,depth\n" + "".join(["%i,%i,%i,%i.25\n" % (i, i, i ** 3, -i ** 3) for i in range(1, 31)]))
+        self.convert(attribute_columns="all", attribute_sample_rows=10)
+        shapefile = read_shapefile(self.output_shapefile)
+        self.assertEqual(shapefile["fields"], [("ID", "N", 10, 0), ("id_1", "N", 19, 0), ("depth", "N", 19, 2)])
+        self.assertEqual(shapefile["records"][29], ["30", "27000", "-27000.25"])
+
+    def test_value_too_long_for_any_field(self):
+        write_text(self.input_textfile, "x,y,note\n1,2,short\n3,4,%s\n" % ("z" * 300))
+        with self.assertRaises(MarineError) as context:
+            self.convert(attribute_columns="note", attribute_sample_rows=0)
+        self.assertIn("Data row 2 ", str(context.exception))
+        self.assertFalse(os.path.exists(self.output_shapefile))
+
+    def test_main_with_omitted_parameters(self):
+        argv = sys.argv
+        sys.argv = ["ascii2shp.py", self.input_textfile, self.output_shapefile, "x", "y", "#", "#", "comma", "#", "%", "double quote"]
+        try:
+            with local_geoprocessor():
+                ascii2shp.main()
+        finally:
+            sys.argv = argv
+        self.assertEqual(len(read_shapefile(self.output_shapefile)["points"]), 3)
+
+
+class IncrementalTests(unittest.TestCase):
+
+    TEXT = "x,y,name\n1,2,a\n3,4,b\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_textfile = os.path.join(self.directory, "points.txt")
+        self.output_shapefile = os.path.join(self.directory, "points.shp")
+        write_text(self.input_textfile, self.TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def convert(self, **options):
+        parameters = {"input_textfile": self.input_textfile, "output_shapefile": self.output_shapefile, "xcol": "x", "ycol": "y", "attribute_columns": "name", "incremental": True}
+        parameters.update(options)
+        with local_geoprocessor():
+            tool = Ascii2Shp(**parameters)
+            tool.run()
+        return tool
+
+    def append_text(self, text):
+        f = open(self.input_textfile, "ab")
+        try:
+            f.write(text.encode("latin-1"))
+        finally:
+            f.close()
+
+    def output_files(self):
+        contents = {}
+        for extension in [".shp", ".shx", ".dbf", ".a2s", ".qix"]:
+            if not os.path.isfile(os.path.join(self.directory, "points" + extension)):
+                continue
+            f = open(os.path.join(self.directory, "points" + extension), "rb")
+            try:
+                contents[extension] = f.read()
+            finally:
+                f.close()
+        return contents
+
+    def records_written(self, tool):
+        counter = tool.metrics["counters"].get("records")
+        if counter is None:
+            return 0
+        return counter["count"]
+
+    def test_skip_unchanged(self):
+        self.assertEqual(self.records_written(self.convert()), 2)
+        before = self.output_files()
+        tool = self.convert()
+        self.assertEqual(self.records_written(tool), 0)
+        self.assertEqual(tool.record_count, 2)
+        self.assertEqual(self.output_files(), before)
+
+    def test_append(self):
+        self.convert()
+
+        # A partial last line is left for the next run.
+
+        self.append_text("5,6,c\n7,8")
+        tool = self.convert()
+        self.assertEqual(self.records_written(tool), 1)
+        self.assertEqual(read_shapefile(self.output_shapefile)["records"], [["1", "a"], ["2", "b"], ["3", "c"]])
+
+        self.append_text(",d\n")
+        tool = self.convert()
+        self.assertEqual(self.records_written(tool), 1)
+        self.assertEqual(tool.record_count, 4)
+        shapefile = read_shapefile(self.output_shapefile)
+        self.assertEqual(shapefile["points"], [(1.0, 2.0), (3.0, 4.0), (5.0, 6.0), (7.0, 8.0)])
+        self.assertEqual(shapefile["bounds"][:4], (1.0, 2.0, 7.0, 8.0))
+        self.assertEqual(shapefile["records"], [["1", "a"], ["2", "b"], ["3", "c"], ["4", "d"]])
+
+    def test_rewrite_modified(self):
+        self.convert()
+
+        # Same size, different contents and modification time.
+
+        write_text(self.input_textfile, self.TEXT.replace("3,4", "9,9"))
+        os.utime(self.input_textfile, (0, 0))
+        tool = self.convert()
+        self.assertEqual(self.records_written(tool), 2)
+        self.assertEqual(read_shapefile(self.output_shapefile)["points"], [(1.0, 2.0), (9.0, 9.0)])
+
+        # Rows before the converted part changed and rows were appended.
+
+        write_text(self.input_textfile, "x,y,name\n0,0,z\n" + self.TEXT[9:] + "5,6,c\n")
+        tool = self.convert()
+        self.assertEqual(self.records_written(tool), 4)
+        self.assertEqual(read_shapefile(self.output_shapefile)["records"], [["1", "z"], ["2", "a"], ["3", "b"], ["4", "c"]])
+
+    def test_rewrite_with_new_parameters(self):
+        self.convert()
+        tool = self.convert(attribute_columns=None)
+        self.assertEqual(self.records_written(tool), 2)
+        self.assertEqual(read_shapefile(self.output_shapefile)["fields"], [("ID", "N", 10, 0)])
+
+    def test_rewrite_when_appended_value_does_not_fit(self):
+        self.convert()
+        self.append_text("5,6,partial\n7,8,dd\n")
+        tool = self.convert()
+        self.assertEqual(self.records_written(tool), 4)
+        shapefile = read_shapefile(self.output_shapefile)
+        self.assertEqual(shapefile["fields"], [("ID", "N", 10, 0), ("name", "C", 7, 0)])
+        self.assertEqual(shapefile["records"], [["1", "a"], ["2", "b"], ["3", "partial"], ["4", "dd"]])
+
+    def test_abort_restores(self):
+        self.convert(spatial_index=_load_numpy() is not None)
+        before = self.output_files()
+        self.append_text("5,6,c\nnorth,8,d\n")
+        with self.assertRaises(MarineError) as context:
+            self.convert(spatial_index=_load_numpy() is not None)
+        self.assertIn("Data row 4 ", str(context.exception))
+        self.assertEqual(self.output_files(), before)
+
+        # Once the row is fixed, the new rows are appended as usual.
+
+        write_text(self.input_textfile, self.TEXT + "5,6,c\n7,8,d\n")
+        tool = self.convert(spatial_index=_load_numpy() is not None)
+        self.assertEqual(self.records_written(tool), 2)
+        self.assertEqual(read_shapefile(self.output_shapefile)["records"], [["1", "a"], ["2", "b"], ["3", "c"], ["4", "d"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
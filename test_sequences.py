@@ -0,0 +1,50 @@
+"""Tests for sequences.py. Run with: python -m unittest test_sequences"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sequences import DNASequence, TwoBitReader, write_2bit
+
+
+class TwoBitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "reads.2bit")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def round_trip(self, sequences):
+        self.assertEqual(write_2bit(self.path, sequences), len(sequences))
+        reader = TwoBitReader(self.path)
+        try:
+            return [reader.fetch(name) for name in reader.names]
+        finally:
+            reader.close()
+
+    def test_round_trip(self):
+        sequences = [DNASequence("ACGTNNACGTA", bytes(range(30, 41)), "per_base"),
+                     DNASequence("GATTACA", 25, "mean"),
+                     DNASequence("", 0, "empty")]
+        fetched = self.round_trip(sequences)
+        self.assertEqual([s.name for s in fetched], ["per_base", "mean", "empty"])
+        self.assertEqual([s.sequence for s in fetched], ["ACGTNNACGTA", "GATTACA", ""])
+        self.assertEqual([s.quality for s in fetched], [bytes(range(30, 41)), 25, 0])
+
+    def test_empty_read_with_per_base_quality(self):
+        # trim() cuts a read whose first bases are all low quality down to
+        # nothing, keeping its (now empty) per-base quality.
+
+        trimmed = DNASequence("ACGT", b"\x02\x02\x02\x02", "trimmed").trim()
+        self.assertEqual(len(trimmed), 0)
+        self.assertEqual(trimmed.quality, b"")
+        fetched = self.round_trip([trimmed, DNASequence("ACGTACGT", b"\x28" * 8, "kept")])
+        self.assertEqual([(s.name, s.sequence, s.mean_quality()) for s in fetched], [("trimmed", "", 0), ("kept", "ACGTACGT", 40)])
+        self.assertEqual(fetched[1].quality, b"\x28" * 8)
+
+
+if __name__ == "__main__":
+    unittest.main()